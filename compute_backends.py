@@ -0,0 +1,6 @@
+# Compute backends offered in the settings. Kept apart from phototag_compute, which loads
+# multiprocessing, so the settings dialogs don't pay for it
+COMPUTE_THREADS = "Threads"
+COMPUTE_PROCESSES = "Processes"
+COMPUTE_BACKENDS = [COMPUTE_THREADS, COMPUTE_PROCESSES]
+DEFAULT_COMPUTE_BACKEND = COMPUTE_THREADS
@@ -1,21 +1,34 @@
 import anchorpoint as ap
 import apsync as aps
 import os
-from typing import Optional
-from phototag_settings import PhototagSettings
-from phototag_settings_list import PhototagSettingsList
-from phototag_api import get_phototag_credits
-from phototag_local_settings import PhototagLocalSettings
-
-settings_list = PhototagSettingsList()
-current_settings = None
-local_settings = PhototagLocalSettings()
-
-# Initialize current_settings from last_edited if None
-if current_settings is None and local_settings.last_edited:
-    current_settings = PhototagSettings(local_settings.last_edited)
-if current_settings is None:
-    current_settings = PhototagSettings()
+import threading
+from typing import Dict, Optional
+from phototag_settings import (
+    DEFAULT_METADATA_POLICY,
+    EXPORT_MODES,
+    EXPORT_NONE,
+    METADATA_POLICIES,
+    PhototagSettings,
+    PhototagSettingsSnapshot,
+    cache_settings_snapshot,
+    get_settings_snapshot,
+    invalidate_settings_snapshot,
+)
+from phototag_settings_list import get_settings_list
+from phototag_credits import credits_service
+from phototag_local_settings import get_local_settings
+from phototag_scheduler import DEFAULT_FILE_ORDER, FILE_ORDERS
+from compute_backends import COMPUTE_BACKENDS, DEFAULT_COMPUTE_BACKEND
+
+# Loaded when the dialog is opened, see load_current_settings()
+settings_list = None
+# Snapshot of the preset shown in the dialog, shared with the snapshot cache of tagging runs
+current_settings: Optional[PhototagSettingsSnapshot] = None
+local_settings = None
+
+# Seconds to wait for further credit checks before asking the server
+CREDITS_CHECK_DELAY = 0.5
+_credits_timer: Optional[threading.Timer] = None
 
 # Dialog variables
 settings_dialog = None
@@ -37,6 +50,7 @@ def save_api_key_callback(dialog: ap.Dialog):
         dialog.set_value("phototag_api_key", "")
     else:
         settings_list.set_api_key(api_key)
+        credits_service.invalidate()
         check_credits_callback(dialog)
         ap.UI().show_success("API Key Updated")
 
@@ -63,10 +77,10 @@ def new_settings_callback(dialog: ap.Dialog):
 
     if settings_list.add_setting(name):
         global current_settings
-        current_settings = PhototagSettings(name)
+        current_settings = get_settings_snapshot(name, settings_list.get_api_key())
         local_settings.last_edited = current_settings.name
         local_settings.store()
-        show_settings_dialog()
+        update_settings_dialog(names_changed=True)
     else:
         ap.UI().show_error("Settings with this name already exists")
 
@@ -75,6 +89,7 @@ def save_settings_callback(dialog: ap.Dialog):
     """
     Saves the current Phototag settings.
     """
+    global current_settings
 
     # Keywords settings
     max_keywords = dialog.get_value("max_keywords")
@@ -87,6 +102,31 @@ def save_settings_callback(dialog: ap.Dialog):
         ap.UI().show_error("Min Keywords must be between 5 and 40")
         return
 
+    max_new_keywords = dialog.get_value("max_new_keywords")
+    if max_new_keywords and not validate_int_range(max_new_keywords, 1, 100000):
+        ap.UI().show_error("Max New Keywords per Run must be between 1 and 100000")
+        return
+
+    max_concurrent_uploads = dialog.get_value("max_concurrent_uploads")
+    if max_concurrent_uploads and not validate_int_range(max_concurrent_uploads, 1, 256):
+        ap.UI().show_error("Concurrent Uploads must be between 1 and 256")
+        return
+
+    member_rate = dialog.get_value("member_requests_per_minute")
+    if member_rate and not validate_int_range(member_rate, 1, 10000):
+        ap.UI().show_error("Member Requests per Minute must be between 1 and 10000")
+        return
+
+    member_budget = dialog.get_value("member_daily_budget")
+    if member_budget and not validate_int_range(member_budget, 1, 1000000):
+        ap.UI().show_error("Member Daily Budget must be between 1 and 1000000")
+        return
+
+    time_budget = dialog.get_value("time_budget_minutes")
+    if time_budget and not validate_int_range(time_budget, 1, 10080):
+        ap.UI().show_error("Time Budget must be between 1 and 10080 minutes")
+        return
+
     # Description settings
     max_desc = dialog.get_value("max_description_chars")
     if max_desc and not validate_int_range(max_desc, 50, 500):
@@ -109,56 +149,106 @@ def save_settings_callback(dialog: ap.Dialog):
         ap.UI().show_error("Min Title Characters must be between 5 and 200")
         return
 
-    # Store settings
-    current_settings.max_keywords = int(max_keywords) if max_keywords else 0
-    current_settings.min_keywords = int(min_keywords) if min_keywords else 0
-    current_settings.required_keywords = str(
+    # Store settings, all values come from the dialog so nothing is read from SharedSettings
+    settings = PhototagSettings(current_settings.name, load=False)
+    settings.max_keywords = int(max_keywords) if max_keywords else 0
+    settings.min_keywords = int(min_keywords) if min_keywords else 0
+    settings.required_keywords = str(
         dialog.get_value("required_keywords") or ""
     )
-    current_settings.excluded_keywords = str(
+    settings.excluded_keywords = str(
         dialog.get_value("excluded_keywords") or ""
     )
-    current_settings.custom_context = str(dialog.get_value("custom_context") or "")
-    current_settings.prohibited_characters = str(
+    settings.custom_context = str(dialog.get_value("custom_context") or "")
+    settings.prohibited_characters = str(
         dialog.get_value("prohibited_characters") or ""
     )
-    current_settings.max_description_chars = int(max_desc) if max_desc else 0
-    current_settings.min_description_chars = int(min_desc) if min_desc else 0
-    current_settings.max_title_chars = int(max_title) if max_title else 0
-    current_settings.min_title_chars = int(min_title) if min_title else 0
-    current_settings.use_file_name_for_context = bool(
+    settings.max_description_chars = int(max_desc) if max_desc else 0
+    settings.min_description_chars = int(min_desc) if min_desc else 0
+    settings.max_title_chars = int(max_title) if max_title else 0
+    settings.min_title_chars = int(min_title) if min_title else 0
+    settings.use_file_name_for_context = bool(
         dialog.get_value("use_file_name_for_context")
     )
-    current_settings.single_word_keywords_only = bool(
+    settings.single_word_keywords_only = bool(
         dialog.get_value("single_word_keywords_only")
     )
-    current_settings.be_creative = bool(dialog.get_value("be_creative"))
-    current_settings.title_case_title = bool(dialog.get_value("title_case_title"))
+    settings.be_creative = bool(dialog.get_value("be_creative"))
+    settings.title_case_title = bool(dialog.get_value("title_case_title"))
+    settings.normalize_keywords = bool(dialog.get_value("normalize_keywords"))
+    settings.max_new_keywords = (
+        int(max_new_keywords) if max_new_keywords else 0
+    )
 
-    current_settings.enable_ai_title = bool(dialog.get_value("enable_ai_title"))
-    current_settings.enable_ai_description = bool(
+    settings.enable_ai_title = bool(dialog.get_value("enable_ai_title"))
+    settings.enable_ai_description = bool(
         dialog.get_value("enable_ai_description")
     )
-    current_settings.enable_ai_tags = bool(dialog.get_value("enable_ai_tags"))
+    settings.enable_ai_tags = bool(dialog.get_value("enable_ai_tags"))
+    settings.skip_tagged_files = bool(dialog.get_value("skip_tagged_files"))
+    settings.embedded_metadata = str(
+        dialog.get_value("embedded_metadata") or DEFAULT_METADATA_POLICY
+    )
+    settings.export_results = str(dialog.get_value("export_results") or EXPORT_NONE)
 
-    current_settings.store()
+    settings.store()
+    current_settings = cache_settings_snapshot(settings, settings_list.get_api_key())
     local_settings.last_edited = current_settings.name
+    local_settings.file_order = str(dialog.get_value("file_order") or DEFAULT_FILE_ORDER)
+    local_settings.time_budget_minutes = int(time_budget) if time_budget else 0
+    local_settings.compute_backend = str(
+        dialog.get_value("compute_backend") or DEFAULT_COMPUTE_BACKEND
+    )
+    local_settings.spool_uploads = bool(dialog.get_value("spool_uploads"))
     local_settings.store()
 
+    # The admin settings are shown to admins only, checked again in case the dialog was opened before
+    if is_admin():
+        save_admin_settings(dialog)
+
+    keyword_synonyms = str(dialog.get_value("keyword_synonyms") or "")
+    if keyword_synonyms != settings_list.get_keyword_synonyms():
+        settings_list.set_keyword_synonyms(keyword_synonyms)
+
     ap.UI().show_success("Settings Saved")
-    show_settings_dialog()
+
+
+def save_admin_settings(dialog: ap.Dialog):
+    """
+    Stores the workspace wide upload and member limits from the Admin Settings.
+    """
+    max_concurrent_uploads = dialog.get_value("max_concurrent_uploads")
+    if max_concurrent_uploads and int(max_concurrent_uploads) != settings_list.max_concurrent_uploads:
+        settings_list.set_max_concurrent_uploads(int(max_concurrent_uploads))
+
+    member_rate = dialog.get_value("member_requests_per_minute")
+    member_budget = dialog.get_value("member_daily_budget")
+    member_quotas = dialog.get_value("member_quotas")
+    if member_quotas is not None:
+        member_limits = (
+            int(member_rate) if member_rate else 0,
+            int(member_budget) if member_budget else 0,
+            str(member_quotas),
+        )
+        if member_limits != (
+            settings_list.member_requests_per_minute,
+            settings_list.member_daily_budget,
+            settings_list.member_quotas,
+        ):
+            settings_list.set_member_limits(*member_limits)
 
 
 def settings_dropdown_callback(dialog: ap.Dialog, value: str):
     """
     Updates current settings when dropdown selection changes
     """
-    name = value
     global current_settings
-    current_settings = settings_list.get_setting(name)
+    if value not in settings_list.get_settings_names():
+        return
+    current_settings = get_settings_snapshot(value, settings_list.get_api_key())
     local_settings.last_edited = current_settings.name
     local_settings.store()
-    show_settings_dialog()
+    update_settings_dialog()
 
 
 def confirm_create_new_settings():
@@ -172,14 +262,14 @@ def confirm_create_new_settings():
         return
 
     if settings_list.add_setting(name):
-        new_settings = PhototagSettings(name)
+        new_settings = PhototagSettings(name, load=False)
         new_settings.copy(current_settings)
-        current_settings = new_settings
+        current_settings = cache_settings_snapshot(new_settings, settings_list.get_api_key())
         local_settings.last_edited = current_settings.name
         local_settings.store()
         settings_dialog.hide_row("create_new_field", True)
         save_settings_callback(settings_dialog)
-        show_settings_dialog()
+        update_settings_dialog(names_changed=True)
     else:
         ap.UI().show_error("Settings with this name already exists")
 
@@ -188,7 +278,7 @@ def confirm_rename_settings():
     """
     Renames current settings directly from the main dialog's input field
     """
-    global settings_dialog
+    global settings_dialog, current_settings
     old_name = current_settings.name
     new_name = settings_dialog.get_value("rename_field")
     if not new_name:
@@ -204,9 +294,14 @@ def confirm_rename_settings():
         return
 
     settings_list.rename_setting(old_name, new_name)
-    current_settings.rename(new_name)
+    settings = PhototagSettings(new_name, load=False)
+    settings.copy(current_settings)
+    invalidate_settings_snapshot(old_name)
+    current_settings = cache_settings_snapshot(settings, settings_list.get_api_key())
+    local_settings.last_edited = new_name
+    local_settings.store()
     settings_dialog.hide_row("rename_field", True)
-    show_settings_dialog()
+    update_settings_dialog(names_changed=True)
 
 
 def confirm_delete_settings():
@@ -220,11 +315,13 @@ def confirm_delete_settings():
         return
 
     settings_list.delete_setting(name)
-    current_settings = PhototagSettings(settings_list.get_settings_names()[0])
+    current_settings = get_settings_snapshot(
+        settings_list.get_settings_names()[0], settings_list.get_api_key()
+    )
     local_settings.last_edited = current_settings.name
     local_settings.store()
     settings_dialog.hide_row("delete_confirm", True)
-    show_settings_dialog()
+    update_settings_dialog(names_changed=True)
 
 
 def is_admin():
@@ -235,6 +332,60 @@ def is_admin():
     return accessLevel == aps.AccessLevel.Owner or accessLevel == aps.AccessLevel.Admin
 
 
+def get_dialog_values(settings: PhototagSettingsSnapshot) -> Dict[str, object]:
+    """
+    Returns the values of the dialog fields that show a settings preset, by variable name.
+    """
+    return {
+        "min_keywords": str(settings.min_keywords or ""),
+        "max_keywords": str(settings.max_keywords or ""),
+        "required_keywords": settings.required_keywords or "",
+        "excluded_keywords": settings.excluded_keywords or "",
+        "single_word_keywords_only": settings.single_word_keywords_only,
+        "normalize_keywords": settings.normalize_keywords,
+        "max_new_keywords": str(settings.max_new_keywords or ""),
+        "min_description_chars": str(settings.min_description_chars or ""),
+        "max_description_chars": str(settings.max_description_chars or ""),
+        "min_title_chars": str(settings.min_title_chars or ""),
+        "max_title_chars": str(settings.max_title_chars or ""),
+        "title_case_title": settings.title_case_title,
+        "custom_context": settings.custom_context or "",
+        "prohibited_characters": settings.prohibited_characters or "",
+        "use_file_name_for_context": settings.use_file_name_for_context,
+        "be_creative": settings.be_creative,
+        "enable_ai_title": settings.enable_ai_title,
+        "enable_ai_description": settings.enable_ai_description,
+        "enable_ai_tags": settings.enable_ai_tags,
+        "skip_tagged_files": settings.skip_tagged_files,
+        "embedded_metadata": settings.embedded_metadata
+        if settings.embedded_metadata in METADATA_POLICIES
+        else DEFAULT_METADATA_POLICY,
+        "export_results": settings.export_results
+        if settings.export_results in EXPORT_MODES
+        else EXPORT_NONE,
+    }
+
+
+def update_settings_dialog(names_changed: bool = False):
+    """
+    Shows current_settings in the open dialog instead of rebuilding it.
+    Only the fields whose value differs from what the dialog shows are set.
+
+    Args:
+        names_changed: Whether settings templates were added, renamed or deleted
+    """
+    for var, value in get_dialog_values(current_settings).items():
+        if settings_dialog.get_value(var) != value:
+            settings_dialog.set_value(var, value)
+    settings_dialog.set_value("rename_field", current_settings.name)
+    if names_changed:
+        settings_dialog.set_dropdown_values(
+            "settings_name", current_settings.name, settings_list.get_settings_names()
+        )
+    elif settings_dialog.get_value("settings_name") != current_settings.name:
+        settings_dialog.set_value("settings_name", current_settings.name)
+
+
 def show_settings_dialog():
     """
     Displays a dialog to manage Phototag settings.
@@ -244,8 +395,10 @@ def show_settings_dialog():
     input_width_small = 100
     input_width_large = 400
 
+    values = get_dialog_values(current_settings)
     settings_dialog = ap.Dialog()
-    settings_dialog.title = f"Phototag.ai Settings - {current_settings.name}"
+    # The selected template is shown in the dropdown, the dialog isn't rebuilt when it changes
+    settings_dialog.title = "Phototag.ai Settings"
     ctx = ap.get_context()
     settings_dialog.icon = ctx.yaml_dir + "/icons/tagImage.svg"
 
@@ -265,7 +418,7 @@ def show_settings_dialog():
     settings_dialog.add_text("Credits:").add_text("loading...", var="credits")
     settings_dialog.add_separator()
 
-    if is_admin:
+    if is_admin():
         settings_dialog.add_text("<b>Admin Settings</b>")
         settings_dialog.add_checkbox(
             settings_list.enabled_for_members,
@@ -274,6 +427,40 @@ def show_settings_dialog():
             callback=lambda _, value: settings_list.set_enabled_for_members(value),
         )
         settings_dialog.add_info("Allow regular members of the Workspace to use the action")
+        settings_dialog.add_text("Concurrent Uploads:", width=label_width).add_input(
+            str(settings_list.max_concurrent_uploads),
+            var="max_concurrent_uploads",
+            width=input_width_small,
+            placeholder="1-256",
+        )
+        settings_dialog.add_info("How many files are uploaded to Phototag.ai at the same time")
+        settings_dialog.add_text("Member Requests per Minute:", width=label_width).add_input(
+            str(settings_list.member_requests_per_minute or ""),
+            var="member_requests_per_minute",
+            width=input_width_small,
+            placeholder="unlimited",
+        )
+        settings_dialog.add_text("Member Daily Budget:", width=label_width).add_input(
+            str(settings_list.member_daily_budget or ""),
+            var="member_daily_budget",
+            width=input_width_small,
+            placeholder="unlimited",
+        )
+        settings_dialog.add_info(
+            "Limits how fast and how many files each member can tag per day, so a large run<br>"
+            "doesn't use up the throughput and credits of the shared API key. Admins are unlimited.<br>"
+            "The daily budget covers all machines of a member, the request rate applies per machine"
+        )
+        settings_dialog.add_text("Quotas per Member:")
+        settings_dialog.add_input(
+            settings_list.member_quotas,
+            var="member_quotas",
+            width=input_width_large,
+            placeholder="e.g. anna@studio.com = 120, 5000; ben@studio.com = 30, 500",
+        )
+        settings_dialog.add_info(
+            "Requests per minute and daily budget for single users, including admins. 0 is unlimited"
+        )
         settings_dialog.add_separator()
 
     # Keywords Section
@@ -284,14 +471,14 @@ def show_settings_dialog():
         var="keywords_section",
     )
     settings_dialog.add_text("Min Keywords:", width=label_width).add_input(
-        str(current_settings.min_keywords or ""),
+        values["min_keywords"],
         var="min_keywords",
         width=input_width_small,
         placeholder="5-40",
     )
     settings_dialog.add_info("Minimum number of keywords to return (range: 5-40)")
     settings_dialog.add_text("Max Keywords:", width=label_width).add_input(
-        str(current_settings.max_keywords or ""),
+        values["max_keywords"],
         var="max_keywords",
         width=input_width_small,
         placeholder="5-200",
@@ -301,7 +488,7 @@ def show_settings_dialog():
     )
     settings_dialog.add_text("Required Keywords (comma-separated):")
     settings_dialog.add_input(
-        current_settings.required_keywords or "",
+        values["required_keywords"],
         var="required_keywords",
         width=input_width_large,
         placeholder="e.g. portrait, studio, professional",
@@ -309,18 +496,45 @@ def show_settings_dialog():
     settings_dialog.add_info("Comma-separated keywords that must be included")
     settings_dialog.add_text("Excluded Keywords (comma-separated):")
     settings_dialog.add_input(
-        current_settings.excluded_keywords or "",
+        values["excluded_keywords"],
         var="excluded_keywords",
         width=input_width_large,
         placeholder="e.g. landscape, nature, outdoor",
     )
     settings_dialog.add_info("Comma-separated keywords that must be excluded")
     settings_dialog.add_checkbox(
-        current_settings.single_word_keywords_only,
+        values["single_word_keywords_only"],
         var="single_word_keywords_only",
         text="Single Word Keywords Only",
     )
     settings_dialog.add_info("Only allow single-word keywords")
+    settings_dialog.add_checkbox(
+        values["normalize_keywords"],
+        var="normalize_keywords",
+        text="Normalize Keywords",
+    )
+    settings_dialog.add_info(
+        "Lowercase keywords, reduce plurals and apply the workspace synonyms before<br>they are written as tags"
+    )
+    settings_dialog.add_text("Max New Keywords per Run:", width=label_width).add_input(
+        values["max_new_keywords"],
+        var="max_new_keywords",
+        width=input_width_small,
+        placeholder="unlimited",
+    )
+    settings_dialog.add_info(
+        "Limits how many keywords that don't exist as tags yet can be added in one run"
+    )
+    settings_dialog.add_text("Workspace Synonyms:")
+    settings_dialog.add_input(
+        settings_list.get_keyword_synonyms(),
+        var="keyword_synonyms",
+        width=input_width_large,
+        placeholder="e.g. car = automobile, auto; dog = puppy",
+    )
+    settings_dialog.add_info(
+        "Synonyms are replaced with the keyword on the left. Shared by all settings templates"
+    )
     settings_dialog.end_section()
 
     # Description Section
@@ -333,7 +547,7 @@ def show_settings_dialog():
     settings_dialog.add_text(
         "Min Description Characters:", width=label_width
     ).add_input(
-        str(current_settings.min_description_chars or ""),
+        values["min_description_chars"],
         var="min_description_chars",
         width=input_width_small,
         placeholder="5-200",
@@ -344,7 +558,7 @@ def show_settings_dialog():
     settings_dialog.add_text(
         "Max Description Characters:", width=label_width
     ).add_input(
-        str(current_settings.max_description_chars or ""),
+        values["max_description_chars"],
         var="max_description_chars",
         width=input_width_small,
         placeholder="50-500",
@@ -362,7 +576,7 @@ def show_settings_dialog():
         var="title_section",
     )
     settings_dialog.add_text("Min Title Characters:", width=label_width).add_input(
-        str(current_settings.min_title_chars or ""),
+        values["min_title_chars"],
         var="min_title_chars",
         width=input_width_small,
         placeholder="5-200",
@@ -371,7 +585,7 @@ def show_settings_dialog():
         "Minimum number of characters allowed in the title (range: 5-200)"
     )
     settings_dialog.add_text("Max Title Characters:", width=label_width).add_input(
-        str(current_settings.max_title_chars or ""),
+        values["max_title_chars"],
         var="max_title_chars",
         width=input_width_small,
         placeholder="50-500",
@@ -380,7 +594,7 @@ def show_settings_dialog():
         "Maximum number of characters allowed in the title, overrides minTitle<br>(range: 50-500)"
     )
     settings_dialog.add_checkbox(
-        current_settings.title_case_title,
+        values["title_case_title"],
         var="title_case_title",
         text="Title Case Title",
     )
@@ -396,7 +610,7 @@ def show_settings_dialog():
     )
     settings_dialog.add_text("Custom Context:")
     settings_dialog.add_input(
-        current_settings.custom_context or "",
+        values["custom_context"],
         var="custom_context",
         width=input_width_large,
         placeholder="Additional context for AI generation",
@@ -404,7 +618,7 @@ def show_settings_dialog():
     settings_dialog.add_info("Additional context for keyword generation")
     settings_dialog.add_text("Prohibited Characters:")
     settings_dialog.add_input(
-        current_settings.prohibited_characters or "",
+        values["prohibited_characters"],
         var="prohibited_characters",
         width=input_width_large,
         placeholder="!@#$%^&*()",
@@ -413,13 +627,13 @@ def show_settings_dialog():
         "Characters to be removed from the title, description, and keywords"
     )
     settings_dialog.add_checkbox(
-        current_settings.use_file_name_for_context,
+        values["use_file_name_for_context"],
         var="use_file_name_for_context",
         text="Use File Name for Context",
     )
     settings_dialog.add_info("Use the file name as context for keyword generation")
     settings_dialog.add_checkbox(
-        current_settings.be_creative, var="be_creative", text="Be Creative"
+        values["be_creative"], var="be_creative", text="Be Creative"
     )
     settings_dialog.add_info(
         "Make the title and description more creative and artistic"
@@ -434,21 +648,92 @@ def show_settings_dialog():
         var="ai_attributes_section",
     )
     settings_dialog.add_checkbox(
-        current_settings.enable_ai_title, var="enable_ai_title", text="Enable AI-Title"
+        values["enable_ai_title"], var="enable_ai_title", text="Enable AI-Title"
     )
     settings_dialog.add_info("Generate and apply AI-generated titles")
     settings_dialog.add_checkbox(
-        current_settings.enable_ai_description,
+        values["enable_ai_description"],
         var="enable_ai_description",
         text="Enable AI-Description",
     )
     settings_dialog.add_info("Generate and apply AI-generated descriptions")
     settings_dialog.add_checkbox(
-        current_settings.enable_ai_tags, var="enable_ai_tags", text="Enable AI-Tags"
+        values["enable_ai_tags"], var="enable_ai_tags", text="Enable AI-Tags"
     )
     settings_dialog.add_info("Generate and apply AI-generated tags")
+    settings_dialog.add_checkbox(
+        values["skip_tagged_files"],
+        var="skip_tagged_files",
+        text="Skip Tagged Files",
+    )
+    settings_dialog.add_info("Don't send files that already have all enabled AI attributes")
+    settings_dialog.add_text("Embedded Metadata:", width=label_width).add_dropdown(
+        values["embedded_metadata"],
+        METADATA_POLICIES,
+        var="embedded_metadata",
+        width=input_width_small * 2,
+    )
+    settings_dialog.add_info(
+        "How titles, descriptions and keywords already stored in the files (XMP, IPTC, EXIF) are used.<br>"
+        "Write them to the AI attributes and only request what is missing, pass them to Phototag.ai<br>"
+        "as context, or skip files whose metadata already covers all enabled attributes"
+    )
+    settings_dialog.add_text("Export Results:", width=label_width).add_dropdown(
+        values["export_results"],
+        EXPORT_MODES,
+        var="export_results",
+        width=input_width_small * 2,
+    )
+    settings_dialog.add_info(
+        "Also write the results to XMP sidecars next to the files, or to a JSON lines manifest<br>"
+        "in the common folder of the tagged files, for tools that can't read Anchorpoint attributes"
+    )
     settings_dialog.end_section()
 
+    settings_dialog.add_separator()
+    # Run Settings, stored on this machine only
+    settings_dialog.add_text("<b>Run Settings</b>")
+    settings_dialog.add_text("File Order:", width=label_width).add_dropdown(
+        local_settings.file_order
+        if local_settings.file_order in FILE_ORDERS
+        else DEFAULT_FILE_ORDER,
+        list(FILE_ORDERS.keys()),
+        var="file_order",
+        width=input_width_small * 2,
+    )
+    settings_dialog.add_info(
+        "Order in which files are tagged. Explicitly selected files can go before the contents<br>"
+        "of selected folders, newest files first and files grouped by folder"
+    )
+    settings_dialog.add_text("Time Budget (minutes):", width=label_width).add_input(
+        str(local_settings.time_budget_minutes or ""),
+        var="time_budget_minutes",
+        width=input_width_small,
+        placeholder="unlimited",
+    )
+    settings_dialog.add_info(
+        "Tag as many files as possible in this time, then stop. Applies to runs on this machine"
+    )
+    settings_dialog.add_text("Image Processing:", width=label_width).add_dropdown(
+        local_settings.compute_backend
+        if local_settings.compute_backend in COMPUTE_BACKENDS
+        else DEFAULT_COMPUTE_BACKEND,
+        COMPUTE_BACKENDS,
+        var="compute_backend",
+        width=input_width_small * 2,
+    )
+    settings_dialog.add_info(
+        "Large previews are downscaled before the upload. Processes use all CPU cores,<br>"
+        "threads start faster and are enough for smaller runs"
+    )
+    settings_dialog.add_checkbox(
+        local_settings.spool_uploads, var="spool_uploads", text="Queue Uploads"
+    )
+    settings_dialog.add_info(
+        "Queue the previews on this machine and upload them in the background, e.g. when<br>"
+        "working offline. Uploads that fail because of the connection are always queued"
+    )
+
     settings_dialog.add_separator()
     # Settings Management
     settings_dialog.add_text("<b>Settings Management</b>")
@@ -557,25 +842,51 @@ def check_credits_callback(dialog: ap.Dialog):
     """
     Checks and displays the current credits balance
     """
+    global _credits_timer
     if not settings_list.get_api_key():
         return
+    # Show the cached balance right away if it is recent enough
+    balance = credits_service.get_cached_balance(credits_service.ttl)
+    if balance is not None:
+        dialog.set_value("credits", str(balance))
+        return
     dialog.set_value("credits", "loading...")
-    ctx = ap.get_context()
-    ctx.run_async(check_credits, dialog)
+    # Checks in quick succession, e.g. when the API key is updated repeatedly, share one request
+    if _credits_timer:
+        _credits_timer.cancel()
+    _credits_timer = threading.Timer(CREDITS_CHECK_DELAY, check_credits, (dialog,))
+    _credits_timer.daemon = True
+    _credits_timer.start()
 
 
 def check_credits(dialog: ap.Dialog):
     """
     Checks and displays the current credits balance
     """
-    response = get_phototag_credits()
-    if response["error"]:
-        ap.UI().show_error(f"Error checking credits: {response['error']}")
+    balance = credits_service.get_balance()
+    if balance is None:
+        ap.UI().show_error(f"Error checking credits: {credits_service.error}")
         return
-    dialog.set_value("credits", str(response["data"]["credits"]))
+    dialog.set_value("credits", str(balance))
+
+
+def load_current_settings():
+    """
+    Loads the settings shown in the dialog. Deferred until the dialog is opened so that
+    importing this module doesn't read any SharedSettings.
+    """
+    global settings_list, local_settings, current_settings
+    settings_list = get_settings_list()
+    local_settings = get_local_settings()
+    # Initialize current_settings from last_edited if None
+    if current_settings is None and local_settings.last_edited:
+        current_settings = get_settings_snapshot(local_settings.last_edited, settings_list.get_api_key())
+    if current_settings is None:
+        current_settings = get_settings_snapshot("default", settings_list.get_api_key())
 
 
 def main():
+    load_current_settings()
     show_settings_dialog()
 
 
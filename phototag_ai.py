@@ -1,21 +1,51 @@
+import collections
+import concurrent.futures
 import os
-import requests
-from typing import Optional, Dict, Any
-import tempfile
+from typing import TYPE_CHECKING, Optional, Dict, Any, TextIO
+import time
 import anchorpoint as ap
 import apsync as aps
-from phototag_settings import PhototagSettings
-from phototag_api import get_phototag_response
-from phototag_settings_list import PhototagSettingsList
-from phototag_local_settings import PhototagLocalSettings
+from phototag_settings import (
+    EXPORT_NONE,
+    METADATA_CONTEXT,
+    METADATA_IGNORE,
+    METADATA_SKIP_COMPLETE,
+    PhototagSettingsSnapshot,
+    get_settings_snapshot,
+)
+from phototag_credits import credits_service
+from phototag_settings_list import get_settings_list
+from phototag_local_settings import get_local_settings
+from phototag_progress import ProgressReporter
+from phototag_preview import (
+    Preview,
+    PreviewCache,
+    finish_mesh_preview,
+    get_preview_name,
+    load_preview,
+    submit_mesh_preview,
+)
+from phototag_mesh_preview import has_mesh_preview_format
+from phototag_spool import Spool, SpoolJob
+from phototag_quota import get_member_quota
+from phototag_scheduler import FILE_ORDERS, schedule_files
+from phototag_paths import PathTable
+from phototag_planner import FileSelection, TaggingPlan, collect_files, plan_tagging, read_mtimes
+from phototag_vocabulary import KeywordNormalizer
 from supported_extensions import SUPPORTED_EXTENSIONS
 
-# Initialize settings
-phototag_settings = PhototagSettings()
-local_settings = PhototagLocalSettings()
-settings_list = PhototagSettingsList()
+if TYPE_CHECKING:
+    from phototag_export import ResultExporter
+    from phototag_metadata import EmbeddedMetadata
 
-def get_all_files_recursive(folder_path) -> list[str]:
+# Set from the action inputs, plans the run without uploading anything
+dry_run = False
+
+# Seconds to wait before retrying queued uploads after a connection error, doubled up to the maximum
+SPOOL_RETRY_DELAY = 5
+SPOOL_MAX_RETRY_DELAY = 300
+
+def get_all_files_recursive(folder_path) -> PathTable:
     """
     Recursively collects all supported files from a folder and its subfolders.
     Only includes extensions in SUPPORTED_EXTENSIONS.
@@ -24,24 +54,232 @@ def get_all_files_recursive(folder_path) -> list[str]:
         folder_path: Path to the root folder to scan
 
     Returns:
-        List of absolute file paths
+        PathTable of the file paths, the full paths are built when they are accessed
     """
-    files = []
+    files = PathTable()
     for root, _, file_names in os.walk(folder_path):
         for file_name in file_names:
             if os.path.splitext(file_name)[1].lower() in SUPPORTED_EXTENSIONS:
-                files.append(str(os.path.join(root, file_name)))
+                files.add_file(root, file_name)
     return files
 
 
-def process_files(file_paths, database):
+def get_existing_keywords(database, attribute_name: str = "AI-Keywords") -> list[str]:
+    """
+    Returns the tag values that already exist on a keywords attribute.
+    """
+    try:
+        attribute = database.attributes.get_attribute(attribute_name)
+        if not attribute:
+            return []
+        return [tag.name for tag in attribute.tags]
+    except Exception as e:
+        print(f"Failed to read existing keywords: {e}")
+        return []
+
+
+def get_snapshots(names: list[str]) -> list[PhototagSettingsSnapshot]:
+    """
+    Returns immutable snapshots of the named presets, taken once per run.
+    """
+    api_key = get_settings_list().get_api_key()
+    return [get_settings_snapshot(name, api_key) for name in names]
+
+
+def get_attribute_names(settings: PhototagSettingsSnapshot, multiple_presets: bool) -> Dict[str, str]:
+    """
+    Returns the attribute names the results of a settings preset are written to.
+    When several presets are applied in one run, the preset name is appended so that
+    the results can be compared side by side.
+    """
+    suffix = f" ({settings.name})" if multiple_presets else ""
+    return {
+        "title": "AI-Title" + suffix,
+        "description": "AI-Description" + suffix,
+        "keywords": "AI-Keywords" + suffix,
+    }
+
+
+def create_keyword_normalizer(
+    settings: PhototagSettingsSnapshot, database, attribute_name: str = "AI-Keywords"
+) -> Optional[KeywordNormalizer]:
+    """
+    Creates the keyword normalizer for a tagging run, seeded with the existing tag vocabulary.
+    Returns None if normalization is disabled in the settings.
+    """
+    if not settings.normalize_keywords:
+        return None
+    return KeywordNormalizer(
+        required_keywords=settings.required_keywords,
+        excluded_keywords=settings.excluded_keywords,
+        prohibited_characters=settings.prohibited_characters,
+        synonyms=get_settings_list().get_keyword_synonyms(),
+        max_keywords=settings.max_keywords,
+        max_new_keywords=settings.max_new_keywords,
+        vocabulary=get_existing_keywords(database, attribute_name),
+    )
+
+
+def apply_result(
+    database,
+    file_path: str,
+    data: Dict[str, Any],
+    settings: PhototagSettingsSnapshot,
+    attribute_names: Dict[str, str],
+    normalizer: Optional[KeywordNormalizer],
+) -> Dict[str, Any]:
+    """
+    Writes the AI-generated content of one API response to the file attributes.
+
+    Returns:
+        The values that were written, keyed by "title", "description" and "keywords"
+    """
+    written = {}
+    title = data.get("title")
+    description = data.get("description")
+    keywords_data = data.get("keywords")
+    if normalizer:
+        title = normalizer.clean_text(title) if title else title
+        description = normalizer.clean_text(description) if description else description
+        keywords_data = normalizer.normalize_keywords(keywords_data or [])
+
+    # Update file attributes with AI-generated content
+    if title and settings.enable_ai_title:
+        database.attributes.set_attribute_value(
+            file_path, attribute_names["title"], title
+        )
+        written["title"] = title
+
+    if description and settings.enable_ai_description:
+        database.attributes.set_attribute_value(
+            file_path, attribute_names["description"], description
+        )
+        written["description"] = description
+
+    if keywords_data and settings.enable_ai_tags:
+        keywords = aps.AttributeTagList()
+        for keyword in keywords_data:
+            keywords.append(aps.AttributeTag(keyword))
+        database.attributes.set_attribute_value(
+            file_path, attribute_names["keywords"], keywords
+        )
+        written["keywords"] = list(keywords_data)
+    return written
+
+
+def apply_metadata_policy(
+    database,
+    file_path: str,
+    metadata: Optional["EmbeddedMetadata"],
+    run: tuple,
+    exporter: Optional["ResultExporter"] = None,
+) -> Optional[tuple]:
+    """
+    Applies the embedded metadata policy of a settings preset to one file.
+    Values written from the metadata are passed on to the exporter.
+
+    Returns:
+        The request payload and the fields the API result must not overwrite,
+        or None if no request is needed for this preset
+    """
+    from phototag_metadata import build_context_payload, get_enabled_fields
+
+    settings, payload, attribute_names, normalizer = run
+    policy = settings.embedded_metadata
+    if not metadata or policy == METADATA_IGNORE:
+        return payload, set()
+    if policy == METADATA_CONTEXT:
+        return build_context_payload(payload, metadata, settings.max_keywords), set()
+
+    covered = metadata.get_covered_fields(settings)
+    complete = covered == get_enabled_fields(settings)
+    if policy == METADATA_SKIP_COMPLETE:
+        if not complete:
+            return payload, set()
+    if covered:
+        # Write the embedded values and only ask the API for the missing attributes
+        written = apply_result(database, file_path, metadata.to_data(), settings, attribute_names, normalizer)
+        if exporter:
+            exporter.update(file_path, written)
+    if complete:
+        return None
+    return build_context_payload(payload, metadata, settings.max_keywords), covered
+
+
+def process_files(
+    file_paths,
+    database,
+    presets: Optional[list[PhototagSettingsSnapshot]] = None,
+    notify: bool = True,
+    deadline: Optional[float] = None,
+    report_stream: Optional[TextIO] = None,
+    notify_out_of_credits: bool = True,
+) -> bool:
     """
     Processes a list of files by sending them to Phototag.ai and updating their attributes.
+    The preview of each file is generated once and sent once per settings preset.
+    Embedded XMP/IPTC/EXIF metadata is read first if a preset uses it, and files
+    whose metadata already covers all enabled attributes can skip the upload.
 
     Args:
-        file_paths: List of file paths to process
+        file_paths: Files to process, e.g. a PathTable. Full paths are built one file at a time
         database: Anchorpoint database instance for attribute updates
+        presets: Snapshots of the settings presets to apply, defaults to the last selected settings
+        notify: Whether to show a message when tagging is complete
+        deadline: time.monotonic() value after which no new files are started
+        report_stream: Optional text stream that receives the progress as JSON lines
+        notify_out_of_credits: Whether to show a message when the credits run out
+
+    Returns:
+        False if tagging stopped because no credits are left
     """
+    # Heavy modules are loaded when tagging starts, so showing the dialogs stays fast
+    from phototag_async_api import AsyncPhototagClient
+    from phototag_export import ResultExporter
+    from phototag_fingerprint import get_fingerprint_index
+    from phototag_compute import (
+        MAX_UPLOAD_EDGE,
+        MIN_RESIZE_BYTES,
+        acquire_compute_backend,
+        downscale_image,
+        release_compute_backend,
+    )
+    from phototag_metadata import read_embedded_metadata
+
+    if not presets:
+        presets = get_snapshots([get_local_settings().last_selected or "default"])
+    multiple_presets = len(presets) > 1
+
+    # The payloads are prebuilt in the snapshots, drop presets without enabled attributes
+    runs = []
+    for settings in presets:
+        payload = settings.payload
+        if payload is None:
+            continue
+        attribute_names = get_attribute_names(settings, multiple_presets)
+        normalizer = create_keyword_normalizer(
+            settings, database, attribute_names["keywords"]
+        )
+        runs.append((settings, payload, attribute_names, normalizer))
+
+    # One exporter per export mode. A sidecar holds the values of one preset, so with several
+    # presets only the first one that exports in a mode is exported
+    exporters = {}
+    run_exporters = {}
+    for run in runs:
+        mode = run[0].export_results
+        if mode != EXPORT_NONE and mode not in exporters:
+            exporters[mode] = run_exporters[run[0].name] = ResultExporter(mode)
+
+    read_metadata = any(run[0].embedded_metadata != METADATA_IGNORE for run in runs)
+
+    if not runs:
+        ap.UI().show_info(
+            "Nothing to tag",
+            "AI-Title, AI-Description and AI-Tags are disabled in the selected settings",
+        )
+        return True
+
     # Create a progress dialog that can be canceled
     progress = ap.Progress(
         "Tagging Files",
@@ -50,99 +288,524 @@ def process_files(file_paths, database):
         show_loading_screen=True,
         cancelable=True,
     )
+    reporter = ProgressReporter(len(file_paths), progress, report_stream)
     
-    temp_dir = os.path.join(tempfile.gettempdir(), "anchorpoint", "phototag_ai", "previews")
-    
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
+    index = get_fingerprint_index()
+    preview_cache = PreviewCache(index=index)
+    # Files are only fingerprinted to skip the ones tagged by earlier runs, which is also
+    # only recorded then
+    use_fingerprints = index is not None and any(run[0].skip_tagged_files for run in runs)
+    # Fingerprints of the files in flight, recorded in the index once they are tagged
+    fingerprints = {}
 
-    for i, file_path in enumerate(file_paths):
-        # Check if user canceled the operation
-        if progress.canceled:
-            progress.finish()
+    start_time = time.monotonic()
+    request_count = 0
+    out_of_credits = False
+    budget_reached = False
+    # Set when the daily budget of the member is used up
+    quota_exceeded = False
+
+    # Requests that are uploaded later by drain_spool, when queueing is enabled or the connection failed
+    spool = Spool()
+    queue_only = get_local_settings().spool_uploads
+    queued = 0
+
+    # Downscaling large previews is CPU-bound and runs on the compute backend
+    backend = acquire_compute_backend(get_local_settings().compute_backend)
+    # Previews waiting for the compute backend, in file order
+    preparing = collections.deque()
+
+    # Uploads run concurrently on an event loop, previews are prepared here meanwhile
+    quota = get_member_quota()
+    client = AsyncPhototagClient(get_settings_list().max_concurrent_uploads, quota)
+    # Bounds the number of previews held in memory while waiting for an upload slot
+    max_pending = client.max_concurrency * 4
+    pending = {}
+    # Number of requests per file that haven't returned yet
+    remaining = {}
+
+    def request_done(file_path: str):
+        remaining[file_path] -= 1
+        if remaining[file_path] == 0:
+            del remaining[file_path]
+            fingerprints.pop(file_path, None)
+            for exporter in exporters.values():
+                exporter.flush(file_path)
+            reporter.file_done()
+
+    def collect_results(timeout: Optional[float]):
+        """
+        Applies the results of all finished requests, waiting up to timeout for the first one.
+        """
+        nonlocal request_count, queued, quota_exceeded
+        if not pending:
             return
+        done, _ = concurrent.futures.wait(
+            list(pending), timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            file_path, run, covered, preview, payload = pending.pop(future)
+            settings, _, attribute_names, normalizer = run
+            if future.cancelled():
+                continue
+            result = future.result()
+            request_count += 1
+            if result.get("retryable") and not progress.canceled:
+                # Offline or the server is overloaded, try again in the background
+                spool.enqueue(
+                    file_path,
+                    preview,
+                    settings,
+                    payload,
+                    attribute_names,
+                    covered,
+                    fingerprints.get(file_path),
+                    settings.name in run_exporters,
+                )
+                queued += 1
+                request_done(file_path)
+                continue
+            if result.get("quota_exceeded"):
+                # Reported once when the run stops
+                quota_exceeded = True
+                reporter.add_skip()
+                request_done(file_path)
+                continue
+            if result.get("error"):
+                reporter.add_error()
+                request_done(file_path)
+                ap.UI().show_error("API Error", result["error"])
+                continue
+            credits_service.debit()
+
+            data = result.get("data")
+            if data and covered:
+                # Keep the values written from the embedded metadata
+                data = {key: value for key, value in data.items() if key not in covered}
+            if data:
+                written = apply_result(database, file_path, data, settings, attribute_names, normalizer)
+                if settings.name in run_exporters:
+                    run_exporters[settings.name].update(file_path, written)
+            if index and fingerprints.get(file_path):
+                index.mark_tagged(file_path, fingerprints[file_path], settings.fingerprint)
+            request_done(file_path)
+
+    def submit_uploads(file_path: str, preview: Preview, requests: list) -> bool:
+        """
+        Queues one upload per settings preset. Returns False when the credits run out.
+        """
+        nonlocal queued
+        if queue_only:
+            # Written to the spool without touching the network, credits are checked when uploading
+            for run, payload, covered in requests:
+                spool.enqueue(
+                    file_path,
+                    preview,
+                    run[0],
+                    payload,
+                    run[2],
+                    covered,
+                    fingerprints.get(file_path),
+                    run[0].name in run_exporters,
+                )
+            queued += len(requests)
+            fingerprints.pop(file_path, None)
+            # Values written from the embedded metadata are exported now, the results later
+            for exporter in exporters.values():
+                exporter.flush(file_path)
+            reporter.file_done()
+            return True
+        for run, payload, covered in requests:
+            # Stop cleanly instead of failing every remaining request
+            if not credits_service.has_credits(len(pending) + 1):
+                return False
+            future = client.submit(preview.name, preview.data, run[0], payload, preview.content_type)
+            pending[future] = (file_path, run, covered, preview, payload)
+            remaining[file_path] = remaining.get(file_path, 0) + 1
+        return True
+
+    def upload_prepared(wait: bool) -> bool:
+        """
+        Uploads the prepared previews in order. Waits for the compute backend if wait is
+        set or too many previews are in preparation. Returns False when the credits run out.
+        """
+        while preparing:
+            file_path, preview, requests, future = preparing[0]
+            if future and not future.done() and not wait and len(preparing) <= backend.max_workers * 2:
+                return True
+            preparing.popleft()
+            if preview is None:
+                # Contact sheet of a mesh, rendered on the compute backend
+                preview = finish_mesh_preview(file_path, future, preview_cache, backend)
+                if not preview:
+                    fingerprints.pop(file_path, None)
+                    reporter.add_skip()
+                    reporter.file_done()
+                    ap.UI().show_error("Failed to generate thumbnail", f"Failed to generate thumbnail for {file_path}")
+                    continue
+            elif future:
+                try:
+                    data = future.result()
+                except Exception as e:
+                    print(f"Failed to downscale preview of {file_path}: {e}")
+                    data = None
+                if data:
+                    preview = Preview(get_preview_name(file_path, ".jpg"), data, "image/jpeg", preview.source)
+            if not submit_uploads(file_path, preview, requests):
+                return False
+        return True
 
-        progress.report_progress(i / len(file_paths))
-        
-        thumbnail_path = aps.get_thumbnail(file_path, False)
-        if not thumbnail_path:
-            success = aps.generate_thumbnail(file_path, temp_dir, with_detail=True, with_preview=True)
-            if not success:
+    try:
+        for i, file_path in enumerate(file_paths):
+            # Check if user canceled the operation
+            if progress.canceled:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                budget_reached = True
+                break
+            if quota_exceeded:
+                break
+
+            metadata = None
+            if read_metadata:
+                reporter.set_stage("Reading metadata")
+                metadata = read_embedded_metadata(file_path)
+            fingerprint = index.get_fingerprint(file_path) if use_fingerprints else None
+            requests = []
+            for run in runs:
+                # Tagged with the same settings before and unchanged since, e.g. a touched file in a watched folder
+                if run[0].skip_tagged_files and fingerprint and index.is_tagged(
+                    file_path, fingerprint, run[0].fingerprint
+                ):
+                    continue
+                request = apply_metadata_policy(
+                    database, file_path, metadata, run, run_exporters.get(run[0].name)
+                )
+                if request:
+                    requests.append((run,) + request)
+            if not requests:
+                # Already tagged or the embedded metadata covers everything, no credits are used
+                for exporter in exporters.values():
+                    exporter.flush(file_path)
+                reporter.add_skip()
+                reporter.file_done()
+                continue
+
+            reporter.set_stage("Preparing previews")
+            mesh = has_mesh_preview_format(file_path)
+            preview = load_preview(file_path, preview_cache, render=not mesh)
+            future = None
+            if preview is None and mesh:
+                # Rendered on the compute backend while the next files are prepared
+                future = submit_mesh_preview(file_path, backend)
+            elif not preview:
+                reporter.add_skip()
+                reporter.file_done()
                 ap.UI().show_error("Failed to generate thumbnail", f"Failed to generate thumbnail for {file_path}")
                 continue
-            # file_name_pt.png
-            file_name_without_ext = os.path.splitext(os.path.basename(file_path))[0]
-            thumbnail_path = os.path.join(temp_dir, file_name_without_ext + "_dt.png")
+            else:
+                if preview.source != "rendered":
+                    reporter.add_cache_hit()
+                # Small previews can't be much larger than MAX_UPLOAD_EDGE and are sent as they are
+                if len(preview) >= MIN_RESIZE_BYTES:
+                    future = backend.submit(downscale_image, preview.data, MAX_UPLOAD_EDGE)
+            if fingerprint:
+                fingerprints[file_path] = fingerprint
+            preparing.append((file_path, preview, requests, future))
 
-        result = get_phototag_response(thumbnail_path, phototag_settings)
-        if result.get("error"):
-            ap.UI().show_error("API Error", result["error"])
-            continue
+            reporter.set_stage("Uploading")
+            if not upload_prepared(wait=False):
+                out_of_credits = True
+                break
+            collect_results(0)
+            # The pipeline is full, wait for uploads in short steps so cancel stays responsive
+            while len(pending) >= max_pending and not progress.canceled:
+                collect_results(0.2)
+                reporter.update()
 
-        data = result.get("data")
-        if not data:
-            continue
+        if not out_of_credits and not progress.canceled and not upload_prepared(wait=True):
+            out_of_credits = True
 
-        # Update file attributes with AI-generated content
-        if data.get("title") and phototag_settings.enable_ai_title:
-            database.attributes.set_attribute_value(
-                file_path, "AI-Title", data["title"]
-            )
+        reporter.set_stage("Waiting for results")
+        while pending and not progress.canceled:
+            collect_results(0.2)
+            reporter.update()
 
-        if data.get("description") and phototag_settings.enable_ai_description:
-            database.attributes.set_attribute_value(
-                file_path, "AI-Description", data["description"]
+        if progress.canceled:
+            # Abort queued and in-flight uploads immediately
+            client.cancel()
+            collect_results(5)
+    finally:
+        client.close()
+        release_compute_backend()
+        # Results already written to the attributes are exported even if the run was canceled
+        if exporters:
+            reporter.set_stage("Exporting results")
+            reporter.update(force=True)
+        export_reports = [
+            f"{mode}: {exporter.close().get_report()}" for mode, exporter in exporters.items()
+        ]
+
+    get_local_settings().update_throughput(time.monotonic() - start_time, request_count)
+    reporter.finish("Canceled" if progress.canceled else "Finished")
+    progress.finish()
+    if queued:
+        # Also picks up requests queued by earlier runs
+        ap.get_context().run_async(drain_spool, database, spool)
+    if progress.canceled:
+        return not out_of_credits
+
+    if out_of_credits:
+        if notify_out_of_credits:
+            ap.UI().show_info(
+                "Out of credits",
+                f"Tagging stopped after {i} of {len(file_paths)} files because no Phototag.ai credits are left",
             )
+        return False
 
-        if data.get("keywords") and phototag_settings.enable_ai_tags:
-            keywords = aps.AttributeTagList()
-            for keyword in data["keywords"]:
-                keywords.append(aps.AttributeTag(keyword))
-            database.attributes.set_attribute_value(file_path, "AI-Keywords", keywords)
+    if quota_exceeded:
+        ap.UI().show_info(
+            "Daily budget used up",
+            f"Tagging stopped after {i} of {len(file_paths)} files. {quota.get_error()}, "
+            "please try again tomorrow or ask your workspace admin",
+        )
+        return True
 
-    progress.finish()
-    ap.UI().show_success("Tagging Complete", f"Processed {len(file_paths)} files")
+    if budget_reached:
+        ap.UI().show_info(
+            "Time budget reached",
+            f"Tagged {i} of {len(file_paths)} files in the configured time budget",
+        )
+        return True
+
+    if notify:
+        ap.UI().show_success(
+            "Tagging Complete",
+            "<br>".join(
+                [f"Processed {len(file_paths)} files"]
+                + ([f"{queued} uploads queued, they are sent in the background"] if queued else [])
+                + export_reports
+            ),
+        )
+    return True
+
+
+def drain_spool(database, spool: Optional[Spool] = None):
+    """
+    Uploads the queued requests and applies their results, retrying with exponential
+    backoff while the connection is down. Only one process drains the spool at a time,
+    the others return immediately. Jobs that fail for other reasons are moved to the
+    failed folder of the spool.
+
+    Args:
+        database: Anchorpoint database instance for attribute updates
+        spool: Spool to drain, defaults to the spool in the temp folder
+    """
+    from phototag_async_api import AsyncPhototagClient
+    from phototag_export import ResultExporter
+    from phototag_fingerprint import get_fingerprint_index
+
+    spool = spool or Spool()
+    lock = spool.get_drain_lock()
+    if not lock.acquire(blocking=False):
+        return
+
+    progress = ap.Progress(
+        "Uploading Queued Files",
+        f"{len(spool)} queued",
+        infinite=True,
+        cancelable=True,
+    )
+    quota = get_member_quota()
+    client = AsyncPhototagClient(get_settings_list().max_concurrent_uploads, quota)
+    index = get_fingerprint_index()
+    # Presets are resolved with their current values, they may have been edited while queued
+    runs = {}
+    exporters = {}
+    delay = SPOOL_RETRY_DELAY
+    uploaded = 0
+    failed = 0
+    out_of_credits = False
+    quota_exceeded = False
 
+    def get_run(job: SpoolJob):
+        run = runs.get(job.preset)
+        if run is None:
+            settings = get_snapshots([job.preset])[0]
+            normalizer = create_keyword_normalizer(settings, database, job.attribute_names["keywords"])
+            run = runs[job.preset] = (settings, normalizer)
+        return run
 
-def select_settings_callback(dialog: ap.Dialog, selected_files):
+    def apply_job(job: SpoolJob, data: Dict[str, Any]):
+        settings, normalizer = get_run(job)
+        data = {key: value for key, value in data.items() if key not in job.covered}
+        if data:
+            written = apply_result(database, job.file_path, data, settings, job.attribute_names, normalizer)
+            # Queued by a run that didn't export this preset, see process_files
+            if settings.export_results != EXPORT_NONE and job.export is not False:
+                exporter = exporters.get(settings.export_results)
+                if exporter is None:
+                    exporter = exporters[settings.export_results] = ResultExporter(settings.export_results)
+                exporter.update(job.file_path, written)
+                exporter.flush(job.file_path)
+        if index and job.fingerprint:
+            index.mark_tagged(job.file_path, job.fingerprint, job.settings_fingerprint)
+
+    try:
+        while not progress.canceled:
+            job_ids = spool.get_job_ids()
+            if not job_ids:
+                break
+            progress.set_text(f"{len(job_ids)} queued, {uploaded} uploaded")
+
+            batch = {}
+            for job_id in job_ids[: client.max_concurrency * 4]:
+                job = spool.load(job_id)
+                if not job:
+                    # Unreadable job file, drop it instead of retrying it forever
+                    spool.complete(SpoolJob({"id": job_id}))
+                    failed += 1
+                    continue
+                preview = spool.load_preview(job)
+                if not preview:
+                    spool.fail(job, "The queued preview is missing")
+                    failed += 1
+                    continue
+                if not credits_service.has_credits(len(batch) + 1):
+                    out_of_credits = True
+                    break
+                future = client.submit(
+                    preview.name, preview.data, get_run(job)[0], job.payload, preview.content_type
+                )
+                batch[future] = job
+            if not batch:
+                if out_of_credits:
+                    break
+                continue
+
+            retry = False
+            pending = set(batch)
+            while pending and not progress.canceled:
+                done, pending = concurrent.futures.wait(
+                    pending, timeout=0.2, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    job = batch[future]
+                    if future.cancelled():
+                        continue
+                    result = future.result()
+                    if result.get("quota_exceeded"):
+                        # Stays queued for the next day
+                        quota_exceeded = True
+                    elif result.get("retryable"):
+                        if spool.retry_later(job, result.get("error", "")):
+                            retry = True
+                        else:
+                            failed += 1
+                    elif result.get("error"):
+                        spool.fail(job, result["error"])
+                        failed += 1
+                    else:
+                        credits_service.debit()
+                        apply_job(job, result.get("data") or {})
+                        spool.complete(job)
+                        uploaded += 1
+            if progress.canceled:
+                client.cancel()
+                break
+            if out_of_credits or quota_exceeded:
+                break
+
+            if retry:
+                # Wait for the connection to come back, checking for cancel meanwhile
+                progress.set_text(f"Connection failed, retrying in {int(delay)} seconds")
+                resume = time.monotonic() + delay
+                while time.monotonic() < resume and not progress.canceled:
+                    time.sleep(0.2)
+                delay = min(delay * 2, SPOOL_MAX_RETRY_DELAY)
+            else:
+                delay = SPOOL_RETRY_DELAY
+    finally:
+        client.close()
+        for exporter in exporters.values():
+            exporter.close()
+        progress.finish()
+        lock.release()
+
+    if out_of_credits:
+        ap.UI().show_info(
+            "Out of credits",
+            f"{len(spool)} queued files are uploaded once Phototag.ai credits are available",
+        )
+    elif quota_exceeded:
+        ap.UI().show_info(
+            "Daily budget used up",
+            f"{len(spool)} queued files are uploaded with the next run. {quota.get_error()}",
+        )
+    elif failed:
+        ap.UI().show_error(
+            "Queued uploads failed",
+            f"{failed} queued files could not be tagged, see {spool.failed_dir}",
+        )
+
+
+def select_settings_callback(dialog: ap.Dialog, selection: FileSelection):
     """
     Callback for selecting Phototag settings.
     """
-    name = dialog.get_value("settings_name")
+    names = get_settings_list().get_settings_names()
+    if dialog.get_value("use_multiple_settings"):
+        selected_names = [
+            name
+            for index, name in enumerate(names)
+            if dialog.get_value(f"preset_{index}")
+        ]
+        if not selected_names:
+            ap.UI().show_error("No settings selected", "Please select at least one settings template")
+            return
+        dialog.close()
+        process_selected_files(selection, get_snapshots(selected_names))
+        return
 
-    global phototag_settings
-    phototag_settings = settings_list.get_setting(name)
-    if phototag_settings:
-        local_settings.last_selected = phototag_settings.name
+    name = dialog.get_value("settings_name")
+    if name in names:
+        local_settings = get_local_settings()
+        local_settings.last_selected = name
         local_settings.store()
         dialog.close()
-        process_selected_files(selected_files)
+        process_selected_files(selection, get_snapshots([name]))
     else:
         ap.UI().show_error("Failed to load settings")
 
 
-def show_settings_selection(selected_files):
+def toggle_multiple_settings(dialog: ap.Dialog, enabled: bool, count: int):
+    """
+    Switches the selection dialog between a single settings dropdown and one checkbox per settings template.
+    """
+    dialog.hide_row("settings_name", enabled)
+    for index in range(count):
+        dialog.hide_row(f"preset_{index}", not enabled)
+
+
+def show_settings_selection(selection: FileSelection):
     """
     Displays a dialog to select Phototag settings.
     If no settings are saved, it uses the default settings without showing the dialog.
     If there is only one saved setting, it uses that setting without showing the dialog.
     If there are multiple settings, it shows the dialog to select one.
     """
-    names = settings_list.get_settings_names()
+    names = get_settings_list().get_settings_names()
     if not names:
         ap.UI().show_error("No saved settings found")
         return False
-    global phototag_settings
     if len(names) == 0:
         # Use default settings
-        phototag_settings = PhototagSettings()
-        process_selected_files(selected_files)
+        process_selected_files(selection, get_snapshots(["default"]))
         return True
 
     if len(names) == 1:
         # Use the only saved settings, don't show the dialog
-        phototag_settings = settings_list.get_setting(names[0])
-        process_selected_files(selected_files)
+        process_selected_files(selection, get_snapshots(names))
         return True
 
     ctx = ap.get_context()
@@ -150,12 +813,29 @@ def show_settings_selection(selected_files):
     dialog.closable = False
     dialog.title = "Select Phototag Settings"
     dialog.icon = ctx.icon
-    default_name = local_settings.last_selected if local_settings.last_selected in names else names[0]
+    last_selected = get_local_settings().last_selected
+    default_name = last_selected if last_selected in names else names[0]
     dialog.add_text("Select Settings:").add_dropdown(
         default_name, names, var="settings_name"
     )
+    dialog.add_checkbox(
+        False,
+        var="use_multiple_settings",
+        text="Tag with multiple settings",
+        callback=lambda d, value: toggle_multiple_settings(d, value, len(names)),
+    )
+    for index, name in enumerate(names):
+        dialog.add_checkbox(name == default_name, var=f"preset_{index}", text=name)
+        dialog.hide_row(f"preset_{index}", True)
+    dialog.add_info(
+        "With multiple settings, each file is scanned once and the results are written<br>"
+        "to separate attributes per settings template, e.g. AI-Keywords (default)"
+    )
     (
-        dialog.add_button("Tag", callback=lambda d: select_settings_callback(d, selected_files))
+        dialog.add_button(
+            "Plan" if dry_run else "Tag",
+            callback=lambda d: select_settings_callback(d, selection),
+        )
         .add_button(
             "Cancel", primary=False, callback=lambda _: dialog.close()
         )
@@ -164,29 +844,149 @@ def show_settings_selection(selected_files):
     return True
 
 
-def process_selected_files(selected_files):
+def get_tagged_attribute_names(presets: list[PhototagSettingsSnapshot]) -> list[str]:
+    """
+    Returns the attributes a file must have to count as tagged by all presets.
+    """
+    names = []
+    multiple_presets = len(presets) > 1
+    for settings in presets:
+        attribute_names = get_attribute_names(settings, multiple_presets)
+        if settings.enable_ai_title:
+            names.append(attribute_names["title"])
+        if settings.enable_ai_description:
+            names.append(attribute_names["description"])
+        if settings.enable_ai_tags:
+            names.append(attribute_names["keywords"])
+    return names
+
+
+def get_available_credits() -> Optional[int]:
+    """
+    Returns the credits balance from the server, or None if it can't be retrieved.
+    """
+    return credits_service.reconcile()
+
+
+def create_plan(
+    selection: FileSelection, database, presets: list[PhototagSettingsSnapshot], check_tagged: bool
+) -> TaggingPlan:
+    """
+    Plans a tagging run with the current credits balance and recent throughput.
+    """
+    from phototag_fingerprint import get_fingerprint_index
+
+    return plan_tagging(
+        selection,
+        presets,
+        database,
+        get_tagged_attribute_names(presets),
+        check_tagged=check_tagged,
+        credits=get_available_credits(),
+        seconds_per_request=get_local_settings().seconds_per_request,
+        index=get_fingerprint_index(),
+    )
+
+
+def show_plan(plan: TaggingPlan):
+    """
+    Shows the result of a dry run.
+    """
+    dialog = ap.Dialog()
+    dialog.title = "Phototag.ai Dry Run"
+    dialog.icon = ap.get_context().icon
+    dialog.add_info(plan.get_report())
+    if plan.exceeds_credits:
+        dialog.add_info(
+            f"<b>This run needs {plan.request_count} credits, but only {plan.credits} are available.</b>"
+        )
+    dialog.add_button("Close", callback=lambda d: d.close())
+    dialog.show()
+
+
+def show_credits_warning(plan: TaggingPlan, database):
+    """
+    Asks whether to start a run that needs more credits than available.
+    """
+    def start(dialog: ap.Dialog):
+        dialog.close()
+        ap.get_context().run_async(tag_plan, plan, database)
+
+    dialog = ap.Dialog()
+    dialog.title = "Not enough credits"
+    dialog.icon = ap.get_context().icon
+    dialog.add_info(
+        f"This run needs {plan.request_count} credits, but only {plan.credits} are available.<br>"
+        "Files will fail once the credits are used up."
+    )
+    dialog.add_info(plan.get_report())
+    (
+        dialog.add_button("Tag anyway", callback=start)
+        .add_button("Cancel", primary=False, callback=lambda d: d.close())
+    )
+    dialog.show()
+
+
+def tag_plan(plan: TaggingPlan, database):
+    """
+    Tags the files of a plan in the configured file order and time budget.
+    """
+    local_settings = get_local_settings()
+    policies = FILE_ORDERS.get(local_settings.file_order, [])
+    if "newest_first" in policies and not plan.selection.has_mtimes:
+        # Only the files that are sent, normal runs don't stat the selection
+        read_mtimes(plan.files)
+    file_paths = schedule_files(plan.files, policies)
+    deadline = None
+    if local_settings.time_budget_minutes:
+        deadline = time.monotonic() + int(local_settings.time_budget_minutes) * 60
+    process_files(file_paths, database, plan.presets, deadline=deadline)
+
+
+def run_tagging(selection: FileSelection, database, presets: list[PhototagSettingsSnapshot]):
+    """
+    Plans the run, checks it against the available credits and starts tagging.
+    In dry run mode only the plan is shown.
+    """
+    if not presets:
+        presets = get_snapshots([get_local_settings().last_selected or "default"])
+    check_tagged = dry_run or any(settings.skip_tagged_files for settings in presets)
+    plan = create_plan(selection, database, presets, check_tagged)
+
+    if dry_run:
+        show_plan(plan)
+        return
+
+    if not plan.files:
+        ap.UI().show_info("Nothing to tag", "All selected files are already tagged")
+        return
+
+    if plan.credits == 0:
+        ap.UI().show_error("No credits left", "Please top up your Phototag.ai credits")
+        return
+
+    if plan.exceeds_credits:
+        show_credits_warning(plan, database)
+        return
+
+    tag_plan(plan, database)
+
+
+def process_selected_files(selection: FileSelection, presets: Optional[list[PhototagSettingsSnapshot]] = None):
     """
     Processes the selected files or folders by sending them to Phototag.ai and updating their attributes.
     """
-    if not selected_files:
+    if not selection.files:
         ap.UI().show_error("No Files Found", "No files found in selected files or folders")
         return
 
     # Start async processing
     database = ap.get_api()
     ctx = ap.get_context()
-    ctx.run_async(process_files, selected_files, database)
+    ctx.run_async(run_tagging, selection, database, presets)
 
 
 def main():
-    # Check if the user is a member and the feature is enabled for members
-    workspace_id = ap.get_context().workspace_id
-    access_level = aps.get_workspace_access(workspace_id)
-    enabled_for_members = settings_list.enabled_for_members
-    if not enabled_for_members and access_level == aps.AccessLevel.Member:
-        ap.UI().show_info("Restricted for members", "To better control credit usage, this feature is only available for admins. Please reach out to your workspace admin.")
-        return
-    
     ctx = ap.get_context()
     if not ctx.selected_files and not ctx.selected_folders:
         ap.UI().show_error(
@@ -194,19 +994,23 @@ def main():
         )
         return
 
-    # Prepare selected_files first
-    selected_files = [
-        f for f in ctx.selected_files
-        if os.path.splitext(f)[1].lower() in SUPPORTED_EXTENSIONS
-    ]
-    for folder in ctx.selected_folders:
-        selected_files.extend(get_all_files_recursive(folder))
-        
-    if not selected_files:
+    # Check if the user is a member and the feature is enabled for members
+    access_level = aps.get_workspace_access(ctx.workspace_id)
+    if access_level == aps.AccessLevel.Member and not get_settings_list().enabled_for_members:
+        ap.UI().show_info("Restricted for members", "To better control credit usage, this feature is only available for admins. Please reach out to your workspace admin.")
+        return
+
+    global dry_run
+    dry_run = bool(ctx.inputs.get("dry_run", False)) if ctx.inputs else False
+
+    # Prepare selected_files first, files selected more than once are only tagged once
+    selection = collect_files(ctx.selected_files, ctx.selected_folders, stat_files=dry_run)
+
+    if not selection.files:
         ap.UI().show_error("No Supported Files Found", "No supported files found in selected files or folders")
         return
 
-    show_settings_selection(selected_files)
+    show_settings_selection(selection)
 
 
 if __name__ == "__main__":
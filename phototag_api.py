@@ -1,55 +1,56 @@
 import os
-import requests
-from typing import Optional, Dict, Any
-from phototag_settings import PhototagSettings
-from phototag_settings_list import PhototagSettingsList
+from typing import Optional, Dict, Any, Union
+from phototag_settings import PhototagSettings, PhototagSettingsSnapshot, build_payload
+from phototag_settings_list import get_settings_list
+from phototag_quota import MemberQuota, get_member_quota
 
-# Initialize settings list
-settings_list = PhototagSettingsList()
 API_URL = "https://server.phototag.ai/api/keywords"
 CREDITS_URL = "https://server.phototag.ai/api/credits"
 
 
 def get_phototag_response(
-    file_path: str, settings: PhototagSettings
+    file_path: str,
+    settings: Union[PhototagSettings, PhototagSettingsSnapshot],
+    payload: Optional[Dict[str, Any]] = None,
+    quota: Optional[MemberQuota] = None,
 ) -> Optional[Dict[str, Any]]:
     """
     Sends an image file to the Phototag.ai API and returns the response.
+    Waits for the request rate of the member and fails once their daily budget is used up.
 
     Args:
         file_path: Path to the image file to be analyzed
-        settings: PhototagSettings instance containing API settings
+        settings: PhototagSettings or snapshot containing API settings
+        payload: Prebuilt request payload from build_payload, taken from the settings if omitted
+        quota: Fair-share limits to apply, defaults to the limits of the current user
 
     Returns:
         Dictionary containing the complete API response including data and error fields
     """
-    if not settings_list.get_api_key():
+    if isinstance(settings, PhototagSettingsSnapshot):
+        api_key = settings.api_key
+        if payload is None:
+            payload = settings.payload
+    else:
+        api_key = get_settings_list().get_api_key()
+
+    if not api_key:
         return {"error": "API Key Required", "data": None}
 
-    headers = {"Authorization": f"Bearer {settings_list.get_api_key()}"}
-
-    # Prepare API request payload with settings
-    payload = {
-        "keywordsOnly": False,
-        "saveFile": False,
-        "maxKeywords": settings.max_keywords,
-        "minKeywords": settings.min_keywords,
-        "requiredKeywords": settings.required_keywords,
-        "excludedKeywords": settings.excluded_keywords,
-        "customContext": settings.custom_context,
-        "prohibitedCharacters": settings.prohibited_characters,
-        "maxDescriptionCharacters": settings.max_description_chars,
-        "minDescriptionCharacters": settings.min_description_chars,
-        "maxTitleCharacters": settings.max_title_chars,
-        "minTitleCharacters": settings.min_title_chars,
-        "useFileNameForContext": settings.use_file_name_for_context,
-        "singleWordKeywordsOnly": settings.single_word_keywords_only,
-        "beCreative": settings.be_creative,
-        "titleCaseTitle": settings.title_case_title,
-    }
-
-    # Remove None values from payload
-    payload = {k: v for k, v in payload.items() if v is not None}
+    headers = {"Authorization": f"Bearer {api_key}"}
+
+    if payload is None:
+        payload = build_payload(settings)
+        if payload is None:
+            return {"error": "No AI attributes enabled", "data": None}
+
+    if quota is None:
+        quota = get_member_quota()
+    if not quota.acquire():
+        return {"error": quota.get_error(), "data": None, "quota_exceeded": True}
+
+    # Imported on first use, loading requests dominates the action startup time
+    import requests
 
     try:
         with open(file_path, "rb") as f:
@@ -60,6 +61,7 @@ def get_phototag_response(
             response.raise_for_status()
             return response.json()
     except Exception as e:
+        quota.refund()
         return {"error": str(e), "data": None}
 
 def get_phototag_credits() -> Optional[Dict[str, Any]]:
@@ -69,10 +71,13 @@ def get_phototag_credits() -> Optional[Dict[str, Any]]:
     Returns:
         Dictionary containing the credits balance or error message
     """
-    if not settings_list.get_api_key():
+    api_key = get_settings_list().get_api_key()
+    if not api_key:
         return {"error": "API Key Required", "data": None}
 
-    headers = {"Authorization": f"Bearer {settings_list.get_api_key()}"}
+    headers = {"Authorization": f"Bearer {api_key}"}
+
+    import requests
 
     try:
         response = requests.get(CREDITS_URL, headers=headers)
@@ -0,0 +1,195 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Dict, Optional, Union
+from phototag_api import API_URL
+from phototag_settings import PhototagSettingsSnapshot
+from phototag_settings_list import DEFAULT_MAX_CONCURRENT_UPLOADS
+from phototag_quota import MemberQuota
+
+# Seconds a request may take in total and to connect. Generating the tags takes a while,
+# the limit only keeps a hung connection from blocking an upload slot for long
+REQUEST_TIMEOUT = 120.0
+CONNECT_TIMEOUT = 15.0
+
+
+def _create_form(
+    file_name: str, data: Union[bytes, memoryview], payload: Dict[str, Any], content_type: str
+):
+    import aiohttp
+
+    form = aiohttp.FormData()
+    for key, value in payload.items():
+        # Same encoding as requests uses for form fields
+        form.add_field(key, str(value))
+    # memoryview buffers are streamed into the body without being copied
+    form.add_field("file", data, filename=file_name, content_type=content_type)
+    return form
+
+
+async def post_image(
+    session,
+    file_name: str,
+    data: Union[bytes, memoryview],
+    api_key: str,
+    payload: Dict[str, Any],
+    content_type: str = "image/jpeg",
+) -> Dict[str, Any]:
+    """
+    Sends image bytes to the Phototag.ai API and returns the response.
+
+    Args:
+        session: aiohttp.ClientSession used for the request
+        file_name: File name reported to the API
+        data: Encoded image, e.g. the buffer of a Preview
+        api_key: Phototag.ai API key
+        payload: Request payload from build_payload
+        content_type: MIME type of the image
+
+    Returns:
+        Dictionary containing the complete API response including data and error fields.
+        Failed requests that may succeed later, e.g. while offline, have "retryable" set.
+    """
+    if not api_key:
+        return {"error": "API Key Required", "data": None}
+
+    import aiohttp
+
+    headers = {"Authorization": f"Bearer {api_key}"}
+    try:
+        async with session.post(
+            API_URL, headers=headers, data=_create_form(file_name, data, payload, content_type)
+        ) as response:
+            response.raise_for_status()
+            return await response.json()
+    except asyncio.CancelledError:
+        raise
+    except aiohttp.ClientResponseError as e:
+        # Rate limits and server errors are worth retrying later, other statuses are not
+        return {"error": str(e), "data": None, "retryable": e.status == 429 or e.status >= 500}
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+        # Offline or the connection dropped
+        return {"error": str(e) or type(e).__name__, "data": None, "retryable": True}
+    except Exception as e:
+        return {"error": str(e), "data": None}
+
+
+class AsyncPhototagClient:
+    """
+    Runs Phototag.ai requests on an event loop in a background thread, so that synchronous
+    code like process_files can keep many uploads in flight without a thread per request.
+    Requests are submitted from any thread and return concurrent.futures.Future objects.
+    With a quota, requests wait for the member's request rate and fail with
+    "quota_exceeded" set once the daily budget is used up.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENT_UPLOADS,
+        quota: Optional[MemberQuota] = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.quota = quota if quota and not quota.unlimited else None
+        self.loop = asyncio.new_event_loop()
+        self._session = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._started.set()
+        self.loop.run_forever()
+
+    async def _get_session(self):
+        if self._session is None:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT, sock_connect=CONNECT_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def _reserve_quota(self) -> bool:
+        # The quota state is a locked file, it is updated on the default executor
+        loop = asyncio.get_running_loop()
+        while True:
+            wait = await loop.run_in_executor(None, self.quota.reserve)
+            if wait is None:
+                return False
+            if wait <= 0:
+                return True
+            await asyncio.sleep(wait)
+
+    async def _post(
+        self,
+        file_name: str,
+        data: Union[bytes, memoryview],
+        api_key: str,
+        payload: Dict[str, Any],
+        content_type: str,
+    ):
+        # Waits outside of the semaphore, so rate limited requests don't hold upload slots
+        if self.quota and not await self._reserve_quota():
+            return {"error": self.quota.get_error(), "data": None, "quota_exceeded": True}
+        # Backpressure: only max_concurrency uploads are in flight, the rest wait here
+        async with self._semaphore:
+            session = await self._get_session()
+            result = await post_image(session, file_name, data, api_key, payload, content_type)
+        if self.quota and result.get("error"):
+            await asyncio.get_running_loop().run_in_executor(None, self.quota.refund)
+        return result
+
+    def submit(
+        self,
+        file_name: str,
+        data: Union[bytes, memoryview],
+        settings: PhototagSettingsSnapshot,
+        payload: Optional[Dict[str, Any]] = None,
+        content_type: str = "image/jpeg",
+    ) -> concurrent.futures.Future:
+        """
+        Queues an upload and returns a future with the API response.
+        The future is canceled if cancel() is called before the response arrives.
+        """
+        if payload is None:
+            payload = settings.payload
+        return asyncio.run_coroutine_threadsafe(
+            self._post(file_name, data, settings.api_key, payload, content_type), self.loop
+        )
+
+    def cancel(self):
+        """
+        Aborts all queued and in-flight requests.
+        """
+        def cancel_tasks():
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+
+        self.loop.call_soon_threadsafe(cancel_tasks)
+
+    def close(self):
+        """
+        Closes the HTTP session and stops the event loop thread.
+        """
+        async def shutdown():
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
+
+        if not self.loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(timeout=10)
+        except Exception as e:
+            print(f"Failed to close Phototag.ai session: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=10)
+        if self._thread.is_alive():
+            # Closing a running loop raises, the daemon thread is left to finish on its own
+            print("Phototag.ai event loop didn't stop in time")
+            return
+        self.loop.close()
@@ -0,0 +1,330 @@
+import atexit
+import concurrent.futures
+import concurrent.futures.process
+import hashlib
+import io
+import os
+import sys
+import threading
+from typing import Callable, Optional
+from compute_backends import COMPUTE_BACKENDS, COMPUTE_PROCESSES, COMPUTE_THREADS, DEFAULT_COMPUTE_BACKEND  # noqa: F401
+
+# Previews are downscaled to this long edge before the upload
+MAX_UPLOAD_EDGE = 1600
+# Smaller previews can't exceed MAX_UPLOAD_EDGE by much and are sent as they are
+MIN_RESIZE_BYTES = 512 * 1024
+# Backends no run has used for this long are stopped, a later run starts them again
+IDLE_SHUTDOWN_SECONDS = 300.0
+
+_backends = {}
+_backends_lock = threading.Lock()
+# Runs between acquire_compute_backend and release_compute_backend
+_active_runs = 0
+_idle_timer: Optional[threading.Timer] = None
+
+
+def get_cpu_count() -> int:
+    """
+    Returns the number of cores this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+# Tasks run in the worker threads or processes. They take the input buffer as a
+# memoryview and must be importable module level functions.
+
+
+def downscale_image(data: memoryview, max_edge: int = MAX_UPLOAD_EDGE, quality: int = 90) -> Optional[bytes]:
+    """
+    Returns the image re-encoded as JPEG with a long edge of at most max_edge,
+    or None if it is already small enough or can't be decoded.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        # Only the header is read until the image is loaded
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_edge:
+                return None
+            # Lets the JPEG decoder skip most of the pixels instead of decoding the full size
+            image.draft("RGB", (max_edge, max_edge))
+            image = image.convert("RGB")
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, "JPEG", quality=quality, optimize=True)
+            return output.getvalue()
+    except Exception as e:
+        print(f"Failed to downscale preview: {e}")
+        return None
+
+
+def perceptual_hash(data: memoryview, hash_size: int = 8) -> Optional[int]:
+    """
+    Returns the difference hash of an image, which stays the same for resized or
+    re-encoded copies. Near duplicates differ in only a few bits.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("L", (hash_size * 8, hash_size * 8))
+            pixels = list(
+                image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR).getdata()
+            )
+    except Exception as e:
+        print(f"Failed to compute perceptual hash: {e}")
+        return None
+    value = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def content_hash(data: memoryview) -> str:
+    """
+    Returns a hash of the buffer content. hashlib releases the GIL for large buffers.
+    """
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def warm_up_worker(data: memoryview) -> bool:
+    """
+    Loads Pillow and the mesh renderer in a worker, so the first real task doesn't pay for it.
+    """
+    try:
+        from PIL import Image
+        import phototag_mesh_preview  # noqa: F401
+    except ImportError:
+        return False
+    Image.init()
+    return True
+
+
+def _run_shared(function: Callable, name: str, size: int, args: tuple):
+    from multiprocessing import shared_memory
+
+    try:
+        # Attached segments are owned and unlinked by the parent process
+        memory = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python before 3.13 has no track argument
+        memory = shared_memory.SharedMemory(name=name)
+    try:
+        view = memory.buf[:size]
+        try:
+            return function(view, *args)
+        finally:
+            view.release()
+    finally:
+        memory.close()
+
+
+class ComputeBackend:
+    """
+    Runs CPU-bound tasks on a pool that is reused for every batch.
+    The thread backend passes buffers directly, it scales as far as the tasks release the GIL.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or get_cpu_count()
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> concurrent.futures.Executor:
+        return concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="phototag_compute")
+
+    def submit(self, function: Callable, data, *args) -> concurrent.futures.Future:
+        """
+        Runs function(memoryview(data), *args) and returns a future with its result.
+        """
+        return self._executor.submit(function, memoryview(data), *args)
+
+    def warm_up(self):
+        """
+        Starts all workers in the background and loads the task modules in them.
+        """
+        for _ in range(self.max_workers):
+            self.submit(warm_up_worker, b"")
+
+    def recycle(self):
+        """
+        Replaces the workers after a task timed out, so later tasks don't queue behind it.
+        A thread can't be stopped, the hung one exits when its task returns. Tasks that
+        were already submitted still run on the old threads.
+        """
+        executor, self._executor = self._executor, self._create_executor()
+        executor.shutdown(wait=False)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ProcessComputeBackend(ComputeBackend):
+    """
+    Runs tasks in worker processes, one per core, so they are not serialized by the GIL.
+    Input buffers are copied once into shared memory instead of being pickled, only the
+    segment name is sent to the worker. Results should be small, e.g. a hash or a
+    downscaled preview.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        import multiprocessing
+
+        self.max_workers = max_workers or get_cpu_count()
+        # Forking is unsafe with the upload event loop thread running
+        self._context = multiprocessing.get_context("spawn")
+        executable = get_python_executable()
+        if executable:
+            self._context.set_executable(executable)
+        self._executor = self._create_executor()
+        self._fallback: Optional[ComputeBackend] = None
+
+    def _create_executor(self) -> concurrent.futures.Executor:
+        return concurrent.futures.ProcessPoolExecutor(self.max_workers, mp_context=self._context)
+
+    def submit(self, function: Callable, data, *args) -> concurrent.futures.Future:
+        from multiprocessing import shared_memory
+
+        if self._fallback:
+            return self._fallback.submit(function, data, *args)
+        view = memoryview(data).cast("B")
+        size = view.nbytes
+        # Zero sized segments are not allowed
+        memory = shared_memory.SharedMemory(create=True, size=max(1, size))
+        memory.buf[:size] = view
+
+        def release(_):
+            memory.close()
+            memory.unlink()
+
+        try:
+            future = self._executor.submit(_run_shared, function, memory.name, size, args)
+        except concurrent.futures.process.BrokenProcessPool as e:
+            # Workers that can't start, e.g. in an unusual embedded interpreter, fail on first use
+            release(None)
+            print(f"Compute processes failed, using threads: {e}")
+            self._fallback = ComputeBackend(self.max_workers)
+            return self._fallback.submit(function, data, *args)
+        except Exception:
+            release(None)
+            raise
+        future.add_done_callback(release)
+        return future
+
+    def recycle(self):
+        """
+        Terminates the workers after a task timed out and starts new ones. The worker
+        that runs the hung task can't be told apart, so the tasks running on the other
+        workers fail with BrokenProcessPool.
+        """
+        if self._fallback:
+            self._fallback.recycle()
+            return
+        executor, self._executor = self._executor, self._create_executor()
+        # The executor has no public way to stop its workers
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def close(self):
+        super().close()
+        if self._fallback:
+            self._fallback.close()
+
+
+def get_python_executable() -> Optional[str]:
+    """
+    Returns the Python interpreter for worker processes. Embedding applications set
+    sys.executable to their own binary, which can't run the workers.
+    """
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return None
+    candidates = [
+        os.path.join(sys.exec_prefix, "python.exe"),
+        os.path.join(sys.exec_prefix, "bin", "python3"),
+        os.path.join(sys.exec_prefix, "bin", "python"),
+    ]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def acquire_compute_backend(kind: str = DEFAULT_COMPUTE_BACKEND) -> ComputeBackend:
+    """
+    Returns the shared compute backend of a kind, created on first use. Falls back to
+    threads if worker processes can't be started. The backends are kept until the run
+    calls release_compute_backend and no other run uses them for IDLE_SHUTDOWN_SECONDS,
+    so consecutive runs and the batches of a watched folder reuse the same workers.
+    """
+    global _active_runs, _idle_timer
+    with _backends_lock:
+        _active_runs += 1
+        if _idle_timer:
+            _idle_timer.cancel()
+            _idle_timer = None
+        backend = _backends.get(kind)
+        if backend is None:
+            if kind == COMPUTE_PROCESSES:
+                try:
+                    backend = ProcessComputeBackend()
+                    # Workers are kept for later runs, starting them early hides the spawn time
+                    backend.warm_up()
+                except (OSError, ImportError, ValueError) as e:
+                    print(f"Failed to start compute processes, using threads: {e}")
+                    backend = _backends.get(COMPUTE_THREADS) or ComputeBackend()
+                    _backends[COMPUTE_THREADS] = backend
+            else:
+                backend = ComputeBackend()
+            _backends[kind] = backend
+        return backend
+
+
+def release_compute_backend(idle_seconds: float = IDLE_SHUTDOWN_SECONDS):
+    """
+    Ends the use of the backend acquired by a run. The backends are stopped after
+    idle_seconds unless another run acquires them before.
+    """
+    global _active_runs, _idle_timer
+    with _backends_lock:
+        _active_runs = max(0, _active_runs - 1)
+        if _active_runs or not _backends:
+            return
+        if _idle_timer:
+            _idle_timer.cancel()
+        _idle_timer = threading.Timer(idle_seconds, _close_idle_backends)
+        _idle_timer.daemon = True
+        _idle_timer.start()
+
+
+def _close_idle_backends():
+    global _idle_timer
+    with _backends_lock:
+        # Acquired again since the timer was started
+        if _active_runs or _idle_timer is not threading.current_thread():
+            return
+        _idle_timer = None
+    close_compute_backends()
+
+
+def close_compute_backends():
+    """
+    Stops all worker threads and processes.
+    """
+    with _backends_lock:
+        backends = set(_backends.values())
+        _backends.clear()
+    for backend in backends:
+        backend.close()
+
+
+atexit.register(close_compute_backends)
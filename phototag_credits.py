@@ -0,0 +1,142 @@
+import threading
+import time
+from typing import Optional
+from phototag_api import get_phototag_credits
+
+
+class CreditsService:
+    """
+    Keeps a local estimate of the Phototag.ai credits balance.
+    The balance is fetched from the server at most once per TTL, decremented locally for
+    every successful request and reconciled with the server in the background.
+    When the balance runs low, the server is asked at most once per min_reconcile_interval.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        reconcile_interval: float = 30.0,
+        reconcile_requests: int = 50,
+        min_reconcile_interval: float = 10.0,
+    ):
+        self.ttl = ttl
+        self.reconcile_interval = reconcile_interval
+        self.reconcile_requests = reconcile_requests
+        self.min_reconcile_interval = min_reconcile_interval
+        self.error: Optional[str] = None
+
+        self._lock = threading.Lock()
+        self._balance: Optional[int] = None
+        self._fetched_at = 0.0
+        self._debits_since_fetch = 0
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    def _fetch(self) -> Optional[int]:
+        requested_at = time.monotonic()
+        response = get_phototag_credits()
+        balance = None
+        if not response.get("error") and response.get("data"):
+            try:
+                balance = int(response["data"]["credits"])
+            except (KeyError, TypeError, ValueError):
+                pass
+
+        with self._lock:
+            if balance is None:
+                self.error = response.get("error") or "Invalid credits response"
+                return self._balance
+            self.error = None
+            # Requests that finished while the balance was fetched may not be included yet
+            if self._fetched_at > requested_at:
+                return self._balance
+            self._balance = balance
+            self._fetched_at = time.monotonic()
+            self._debits_since_fetch = 0
+            return self._balance
+
+    def _is_fresh(self, max_age: float) -> bool:
+        return self._balance is not None and time.monotonic() - self._fetched_at < max_age
+
+    def get_balance(self, max_age: Optional[float] = None) -> Optional[int]:
+        """
+        Returns the estimated balance, fetching it from the server if the cached value is
+        older than max_age seconds (defaults to the TTL). Returns None if it is unknown.
+        """
+        with self._lock:
+            if self._is_fresh(self.ttl if max_age is None else max_age):
+                return self._balance
+        return self._fetch()
+
+    def get_cached_balance(self, max_age: Optional[float] = None) -> Optional[int]:
+        """
+        Returns the estimated balance without contacting the server.
+        If max_age is given, None is returned when the balance was fetched longer ago.
+        """
+        with self._lock:
+            if max_age is not None and not self._is_fresh(max_age):
+                return None
+            return self._balance
+
+    def reconcile(self) -> Optional[int]:
+        """
+        Fetches the balance from the server and replaces the local estimate.
+        """
+        return self._fetch()
+
+    def refresh_async(self):
+        """
+        Fetches the balance in a background thread, unless a refresh is already running.
+        """
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._fetch, daemon=True)
+            self._refresh_thread.start()
+
+    def debit(self, count: int = 1):
+        """
+        Decrements the local estimate after successful requests and schedules a background
+        reconcile every reconcile_requests requests or reconcile_interval seconds.
+        """
+        with self._lock:
+            if self._balance is None:
+                return
+            self._balance = max(0, self._balance - count)
+            self._debits_since_fetch += count
+            needs_reconcile = (
+                self._debits_since_fetch >= self.reconcile_requests
+                or time.monotonic() - self._fetched_at >= self.reconcile_interval
+            )
+        if needs_reconcile:
+            self.refresh_async()
+
+    def has_credits(self, required: int = 1) -> bool:
+        """
+        Returns False if the balance is known to be lower than required.
+        The server is asked before giving up, so a stale estimate never stops a run, but
+        not more than once per min_reconcile_interval, so a low balance doesn't turn every
+        request into an extra round-trip. An unknown balance doesn't block, the API reports
+        the error in that case.
+        """
+        with self._lock:
+            balance = self._balance
+            recently_fetched = self._is_fresh(self.min_reconcile_interval)
+        if balance is None or balance >= required:
+            return True
+        if recently_fetched:
+            return False
+        balance = self.reconcile()
+        return balance is None or balance >= required
+
+    def invalidate(self):
+        """
+        Drops the cached balance, e.g. after the API key changed.
+        """
+        with self._lock:
+            self._balance = None
+            self._fetched_at = 0.0
+            self._debits_since_fetch = 0
+            self.error = None
+
+
+credits_service = CreditsService()
@@ -0,0 +1,338 @@
+import mmap
+import os
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Embedded previews with a shorter long edge are ignored
+MIN_PREVIEW_EDGE = 160
+# Photoshop writes 160 pixel thumbnails, too small to tag from, so PSDs are usually rendered
+MIN_PSD_PREVIEW_EDGE = 512
+# Among several embedded previews, the smallest one with at least this long edge is used
+TARGET_PREVIEW_EDGE = 1024
+
+# TIFF tags
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+TAG_EXIF_IFD = 0x8769
+# Panasonic RW2 stores a full size JPEG in this tag
+TAG_RW2_JPEG_FROM_RAW = 0x002E
+
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+# Baseline, extended and progressive JPEG. Lossless JPEG (SOF3) is raw sensor data.
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2}
+
+Candidate = Tuple[int, int]
+
+
+def get_jpeg_size(data, offset: int, length: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns width and height of a JPEG stream by reading its markers up to the frame
+    header, or None if it is not a displayable JPEG.
+    """
+    end = min(len(data), offset + length)
+    if end - offset < 4 or data[offset : offset + 2] != b"\xff\xd8":
+        return None
+    position = offset + 2
+    while position + 4 <= end:
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            position += 2
+            continue
+        segment_length = struct.unpack_from(">H", data, position + 2)[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if marker not in JPEG_SOF_MARKERS or position + 9 > end:
+                return None
+            height, width = struct.unpack_from(">HH", data, position + 5)
+            return width, height
+        position += 2 + segment_length
+    return None
+
+
+def find_tiff_previews(data, base: int = 0) -> List[Candidate]:
+    """
+    Walks the IFDs of a TIFF based file (DNG and most camera RAW formats) and returns
+    the offset and length of every embedded JPEG.
+    """
+    if len(data) < base + 8:
+        return []
+    byte_order = data[base : base + 2]
+    if byte_order == b"II":
+        prefix = "<"
+    elif byte_order == b"MM":
+        prefix = ">"
+    else:
+        return []
+    magic = struct.unpack_from(prefix + "H", data, base + 2)[0]
+    # 42 is TIFF, 0x4F52 and 0x5352 are Olympus ORF, 0x55 is Panasonic RW2
+    if magic not in (42, 0x4F52, 0x5352, 0x55):
+        return []
+
+    candidates = []
+    visited = set()
+    queue = [struct.unpack_from(prefix + "I", data, base + 4)[0]]
+    while queue:
+        ifd_offset = queue.pop()
+        if not ifd_offset or ifd_offset in visited or base + ifd_offset + 2 > len(data):
+            continue
+        visited.add(ifd_offset)
+        position = base + ifd_offset
+        count = struct.unpack_from(prefix + "H", data, position)[0]
+        if position + 2 + count * 12 + 4 > len(data):
+            continue
+
+        values: Dict[int, List[int]] = {}
+        for index in range(count):
+            entry = position + 2 + index * 12
+            tag, value_type, value_count = struct.unpack_from(prefix + "HHI", data, entry)
+            size = TIFF_TYPE_SIZES.get(value_type, 1) * value_count
+            if tag == TAG_RW2_JPEG_FROM_RAW:
+                value_offset = (
+                    entry + 8 if size <= 4 else base + struct.unpack_from(prefix + "I", data, entry + 8)[0]
+                )
+                candidates.append((value_offset, size))
+                continue
+            if value_type not in (3, 4, 13) or value_count > 64:
+                continue
+            value_format = "H" if value_type == 3 else "I"
+            value_offset = entry + 8 if size <= 4 else base + struct.unpack_from(prefix + "I", data, entry + 8)[0]
+            if value_offset + size > len(data):
+                continue
+            values[tag] = list(
+                struct.unpack_from(prefix + value_format * value_count, data, value_offset)
+            )
+
+        if TAG_JPEG_OFFSET in values and TAG_JPEG_LENGTH in values:
+            candidates.append((base + values[TAG_JPEG_OFFSET][0], values[TAG_JPEG_LENGTH][0]))
+        compression = values.get(TAG_COMPRESSION, [0])[0]
+        strips = values.get(TAG_STRIP_OFFSETS, [])
+        strip_lengths = values.get(TAG_STRIP_BYTE_COUNTS, [])
+        # Old and new style JPEG compression stored as a single strip
+        if compression in (6, 7) and len(strips) == 1 and len(strip_lengths) == 1:
+            candidates.append((base + strips[0], strip_lengths[0]))
+
+        queue.extend(values.get(TAG_SUB_IFDS, []))
+        queue.extend(values.get(TAG_EXIF_IFD, []))
+        queue.append(struct.unpack_from(prefix + "I", data, position + 2 + count * 12)[0])
+    return candidates
+
+
+def find_raf_previews(data) -> List[Candidate]:
+    """
+    Fujifilm RAF files start with a header that points to a full size JPEG.
+    """
+    if len(data) < 92 or data[:16] != b"FUJIFILMCCD-RAW ":
+        return []
+    offset, length = struct.unpack_from(">II", data, 84)
+    return [(offset, length)]
+
+
+def iter_psd_resources(data):
+    """
+    Yields the id, data offset and size of every image resource of a PSD or PSB file.
+    """
+    if len(data) < 26 or data[:4] != b"8BPS":
+        return
+    position = 26
+    color_mode_length = struct.unpack_from(">I", data, position)[0]
+    position += 4 + color_mode_length
+    if position + 4 > len(data):
+        return
+    resources_length = struct.unpack_from(">I", data, position)[0]
+    position += 4
+    end = min(len(data), position + resources_length)
+
+    while position + 12 <= end:
+        if data[position : position + 4] != b"8BIM":
+            return
+        resource_id = struct.unpack_from(">H", data, position + 4)[0]
+        name_length = data[position + 6]
+        # Pascal string padded to an even size, including the length byte
+        position += 6 + ((name_length + 2) & ~1)
+        size = struct.unpack_from(">I", data, position)[0]
+        position += 4
+        if position + size > end:
+            return
+        yield resource_id, position, size
+        position += (size + 1) & ~1
+
+
+def find_psd_previews(data) -> List[Candidate]:
+    """
+    Photoshop PSD and PSB files store a JPEG thumbnail in image resource 1036.
+    """
+    for resource_id, position, size in iter_psd_resources(data):
+        # 28 byte thumbnail header, format 1 is JFIF
+        if resource_id == 1036 and size > 28 and struct.unpack_from(">I", data, position)[0] == 1:
+            return [(position + 28, size - 28)]
+    return []
+
+
+def _iter_boxes(data, start: int, end: int):
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, position)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, position + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header or position + size > end:
+            return
+        yield box_type, position + header, position + size
+        position += size
+
+
+def _read_uint(data, position: int, size: int) -> int:
+    if size == 0:
+        return 0
+    return int.from_bytes(data[position : position + size], "big")
+
+
+def find_heif_previews(data) -> List[Candidate]:
+    """
+    HEIC/HEIF files can contain JPEG coded items, usually thumbnails. Most encoders store
+    HEVC thumbnails instead, which can't be sent as a preview.
+    """
+    meta = None
+    for box_type, start, end in _iter_boxes(data, 0, len(data)):
+        if box_type == b"meta":
+            # Full box, skip version and flags
+            meta = (start + 4, end)
+            break
+    if not meta:
+        return []
+
+    jpeg_items = set()
+    locations: Dict[int, List[Candidate]] = {}
+    for box_type, start, end in _iter_boxes(data, *meta):
+        if box_type == b"iinf":
+            version = data[start]
+            entry_start = start + 4 + (2 if version == 0 else 4)
+            for infe_type, infe_start, _ in _iter_boxes(data, entry_start, end):
+                if infe_type != b"infe" or data[infe_start] < 2:
+                    continue
+                id_size = 2 if data[infe_start] == 2 else 4
+                item_id = _read_uint(data, infe_start + 4, id_size)
+                item_type = data[infe_start + 4 + id_size + 2 : infe_start + 4 + id_size + 6]
+                if item_type == b"jpeg":
+                    jpeg_items.add(item_id)
+        elif box_type == b"iloc":
+            version = data[start]
+            position = start + 4
+            offset_size, length_size = data[position] >> 4, data[position] & 0x0F
+            base_offset_size = data[position + 1] >> 4
+            index_size = data[position + 1] & 0x0F if version in (1, 2) else 0
+            position += 2
+            id_size = 4 if version == 2 else 2
+            item_count = _read_uint(data, position, id_size)
+            position += id_size
+            for _ in range(item_count):
+                item_id = _read_uint(data, position, id_size)
+                position += id_size
+                construction_method = 0
+                if version in (1, 2):
+                    construction_method = _read_uint(data, position, 2) & 0x0F
+                    position += 2
+                position += 2  # data_reference_index
+                base_offset = _read_uint(data, position, base_offset_size)
+                position += base_offset_size
+                extent_count = _read_uint(data, position, 2)
+                position += 2
+                extents = []
+                for _ in range(extent_count):
+                    position += index_size
+                    extent_offset = _read_uint(data, position, offset_size)
+                    position += offset_size
+                    extent_length = _read_uint(data, position, length_size)
+                    position += length_size
+                    extents.append((base_offset + extent_offset, extent_length))
+                # Only items stored as a single extent in the file can be sliced directly
+                if construction_method == 0 and len(extents) == 1:
+                    locations[item_id] = extents
+    return [locations[item_id][0] for item_id in jpeg_items if item_id in locations]
+
+
+PREVIEW_FINDERS: Dict[str, Callable[[object], List[Candidate]]] = {
+    ".psd": find_psd_previews,
+    ".psb": find_psd_previews,
+    ".heic": find_heif_previews,
+    ".heif": find_heif_previews,
+    ".raf": find_raf_previews,
+}
+# TIFF based camera RAW formats
+for _extension in (
+    ".dng", ".cr2", ".nef", ".nrw", ".arw", ".sr2", ".srf", ".orf", ".pef", ".rw2", ".raw",
+    ".rwl", ".srw", ".erf", ".dcr", ".kdc", ".k25", ".kc2", ".mos", ".mef", ".3fr", ".fff",
+    ".iiq", ".cap", ".mdc", ".cs1", ".pxn", ".sti", ".drf", ".dsc", ".ptx", ".rwz",
+):
+    PREVIEW_FINDERS[_extension] = find_tiff_previews
+
+
+# Formats whose embedded previews are often too small to tag from
+MIN_PREVIEW_EDGES: Dict[str, int] = {
+    ".psd": MIN_PSD_PREVIEW_EDGE,
+    ".psb": MIN_PSD_PREVIEW_EDGE,
+}
+
+
+def has_embedded_preview_format(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in PREVIEW_FINDERS
+
+
+def select_preview(
+    data, candidates: List[Candidate], min_edge: int = MIN_PREVIEW_EDGE
+) -> Optional[Candidate]:
+    """
+    Picks the smallest embedded JPEG that is at least TARGET_PREVIEW_EDGE large, or the
+    largest one if all of them are smaller. JPEGs with a long edge below min_edge are ignored.
+    """
+    usable = []
+    for offset, length in candidates:
+        if offset < 0 or length <= 0 or offset + length > len(data):
+            continue
+        size = get_jpeg_size(data, offset, length)
+        if not size or max(size) < min_edge:
+            continue
+        usable.append((max(size), offset, length))
+    if not usable:
+        return None
+    large_enough = [preview for preview in usable if preview[0] >= TARGET_PREVIEW_EDGE]
+    _, offset, length = min(large_enough) if large_enough else max(usable)
+    return offset, length
+
+
+def extract_embedded_preview(file_path: str) -> Optional[bytes]:
+    """
+    Returns the embedded JPEG preview of a RAW, PSD/PSB or HEIC file, or None if the file
+    doesn't contain a usable one. The file is memory mapped, so only the container headers
+    and the preview itself are read from disk.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    finder = PREVIEW_FINDERS.get(extension)
+    if not finder:
+        return None
+    try:
+        with open(file_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                candidates = finder(data)
+                selected = select_preview(
+                    data, candidates, MIN_PREVIEW_EDGES.get(extension, MIN_PREVIEW_EDGE)
+                )
+                if not selected:
+                    return None
+                offset, length = selected
+                return data[offset : offset + length]
+    except (OSError, ValueError, struct.error, IndexError) as e:
+        print(f"Failed to read embedded preview of {file_path}: {e}")
+        return None
@@ -0,0 +1,411 @@
+import concurrent.futures
+import io
+import json
+import os
+import threading
+import xml.etree.ElementTree as ElementTree
+from typing import Any, Dict, Iterable, List, Optional
+import anchorpoint as ap
+from phototag_settings import EXPORT_MANIFEST, EXPORT_SIDECARS
+from phototag_planner import collect_files
+from phototag_progress import ProgressReporter
+from supported_extensions import RAW_EXTENSIONS
+
+MANIFEST_NAME = "phototag_manifest.jsonl"
+
+XMP_NAMESPACES = {
+    "x": "adobe:ns:meta/",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dc": "http://purl.org/dc/elements/1.1/",
+}
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+FIELDS = ("title", "description", "keywords")
+
+# Sidecar writes to the same path are serialized by one of these, chosen by the path hash
+SIDECAR_LOCK_COUNT = 64
+
+_namespace_lock = threading.Lock()
+
+
+def _qualified(name: str) -> str:
+    prefix, local_name = name.split(":")
+    return f"{{{XMP_NAMESPACES[prefix]}}}{local_name}"
+
+
+def get_sidecar_path(file_path: str) -> str:
+    """
+    Returns the sidecar path of a file. RAW files use the name with an .xmp extension like
+    Lightroom and Bridge, other files keep their extension, e.g. photo.jpg.xmp, so the
+    JPEG of a RAW+JPEG pair or photo.jpg and photo.tif don't share a sidecar.
+    """
+    root, extension = os.path.splitext(file_path)
+    if extension.lower() in RAW_EXTENSIONS:
+        return root + ".xmp"
+    return file_path + ".xmp"
+
+
+def _parse_sidecar(content: bytes) -> Optional[ElementTree.Element]:
+    # Register the prefixes of the existing file, so they are written back unchanged
+    try:
+        with _namespace_lock:
+            for _, (prefix, uri) in ElementTree.iterparse(io.BytesIO(content), events=("start-ns",)):
+                if not prefix:
+                    continue
+                try:
+                    ElementTree.register_namespace(prefix, uri)
+                except ValueError:
+                    pass
+        return ElementTree.fromstring(content)
+    except ElementTree.ParseError:
+        return None
+
+
+def build_sidecar(values: Dict[str, Any], existing: Optional[bytes] = None) -> bytes:
+    """
+    Returns the content of an XMP sidecar with dc:title, dc:description and dc:subject set
+    from the values. Everything else in an existing sidecar, e.g. Lightroom develop
+    settings of RAW files, is kept.
+    """
+    root = _parse_sidecar(existing) if existing else None
+    if root is not None and root.tag == _qualified("rdf:RDF"):
+        rdf = root
+    elif root is not None and root.tag == _qualified("x:xmpmeta"):
+        rdf = root.find("rdf:RDF", XMP_NAMESPACES)
+        if rdf is None:
+            rdf = ElementTree.SubElement(root, _qualified("rdf:RDF"))
+    else:
+        root = ElementTree.Element(_qualified("x:xmpmeta"))
+        rdf = ElementTree.SubElement(root, _qualified("rdf:RDF"))
+
+    description = rdf.find("rdf:Description", XMP_NAMESPACES)
+    if description is None:
+        description = ElementTree.SubElement(rdf, _qualified("rdf:Description"))
+        description.set(_qualified("rdf:about"), "")
+
+    def replace(name: str, container: str, items: List[str]):
+        # The property can be an element or an attribute of any rdf:Description
+        for parent in rdf.findall("rdf:Description", XMP_NAMESPACES):
+            for element in parent.findall(name, XMP_NAMESPACES):
+                parent.remove(element)
+            parent.attrib.pop(_qualified(name), None)
+        element = ElementTree.SubElement(description, _qualified(name))
+        values_element = ElementTree.SubElement(element, _qualified(container))
+        for item in items:
+            li = ElementTree.SubElement(values_element, _qualified("rdf:li"))
+            if container == "rdf:Alt":
+                li.set(XML_LANG, "x-default")
+            li.text = item
+
+    if values.get("title"):
+        replace("dc:title", "rdf:Alt", [values["title"]])
+    if values.get("description"):
+        replace("dc:description", "rdf:Alt", [values["description"]])
+    if values.get("keywords"):
+        replace("dc:subject", "rdf:Bag", list(values["keywords"]))
+
+    with _namespace_lock:
+        for prefix, uri in XMP_NAMESPACES.items():
+            ElementTree.register_namespace(prefix, uri)
+        return ElementTree.tostring(root, encoding="utf-8", xml_declaration=False) + b"\n"
+
+
+def read_existing(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def replace_file(path: str, content: bytes):
+    """
+    Writes a temporary file next to the target and moves it into place, so readers never
+    see a partially written file.
+    """
+    directory, name = os.path.split(path)
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_sidecar(file_path: str, values: Dict[str, Any]) -> bool:
+    """
+    Writes the values into the XMP sidecar of a file. Returns False if it was unchanged.
+    """
+    sidecar_path = get_sidecar_path(file_path)
+    existing = read_existing(sidecar_path)
+    content = build_sidecar(values, existing)
+    if content == existing:
+        return False
+    replace_file(sidecar_path, content)
+    return True
+
+
+class ExportStats:
+    __slots__ = ("written", "unchanged", "failed")
+
+    def __init__(self):
+        self.written = 0
+        self.unchanged = 0
+        self.failed = 0
+
+    def get_report(self) -> str:
+        return f"{self.written} written, {self.unchanged} unchanged, {self.failed} failed"
+
+
+class ResultExporter:
+    """
+    Streams tagging results into XMP sidecars or a JSON lines manifest.
+    Results are collected per file with update() and exported with flush() once the file
+    is complete. Sidecars are written on a thread pool while the caller continues, the
+    manifest is merged with its previous content and replaced in close().
+    The values of a file should come from one settings preset, a sidecar or manifest entry
+    can't hold the results of several presets.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        manifest_path: Optional[str] = None,
+        max_workers: Optional[int] = None,
+    ):
+        self.mode = mode
+        self.manifest_path = manifest_path
+        self.stats = ExportStats()
+        self._values: Dict[str, Dict[str, Any]] = {}
+        self._manifest: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._sidecar_locks = [threading.Lock() for _ in range(SIDECAR_LOCK_COUNT)]
+        self._executor = None
+        if mode == EXPORT_SIDECARS:
+            # Writing sidecars is I/O bound, so more threads than cores help on network drives
+            max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+            # Bounds the number of queued sidecars, so exports of any size use constant memory
+            self._slots = threading.BoundedSemaphore(max_workers * 4)
+
+    def update(self, file_path: str, values: Dict[str, Any]):
+        """
+        Merges values written to the attributes of a file, later values win.
+        """
+        if not values:
+            return
+        self._values.setdefault(file_path, {}).update(values)
+
+    def flush(self, file_path: str):
+        """
+        Exports the collected values of a file.
+        """
+        values = self._values.pop(file_path, None)
+        if not values:
+            return
+        if self.mode == EXPORT_MANIFEST:
+            self._manifest[file_path] = values
+        elif self._executor:
+            self._slots.acquire()
+            future = self._executor.submit(self._write_sidecar, file_path, values)
+            future.add_done_callback(lambda _: self._slots.release())
+
+    def _write_sidecar(self, file_path: str, values: Dict[str, Any]):
+        # Two RAW files with the same name share a sidecar, their updates must not overlap
+        sidecar_lock = self._sidecar_locks[hash(get_sidecar_path(file_path)) % SIDECAR_LOCK_COUNT]
+        try:
+            with sidecar_lock:
+                written = write_sidecar(file_path, values)
+        except Exception as e:
+            print(f"Failed to write XMP sidecar for {file_path}: {e}")
+            with self._lock:
+                self.stats.failed += 1
+            return
+        with self._lock:
+            if written:
+                self.stats.written += 1
+            else:
+                self.stats.unchanged += 1
+
+    def _write_manifest(self):
+        if not self._manifest:
+            return
+        manifest_path = self.manifest_path or os.path.join(
+            get_common_folder(list(self._manifest)), MANIFEST_NAME
+        )
+        base = os.path.dirname(manifest_path)
+
+        # Paths are stored relative to the manifest, so it stays valid on other machines
+        existing = read_existing(manifest_path)
+        records: Dict[str, Dict[str, Any]] = {}
+        for line in (existing or b"").decode("utf-8", "replace").splitlines():
+            try:
+                record = json.loads(line)
+                records[record["path"]] = record
+            except (ValueError, KeyError, TypeError):
+                continue
+
+        for file_path, values in self._manifest.items():
+            path = get_manifest_path(file_path, base)
+            record = records.setdefault(path, {"path": path})
+            record.update({field: values[field] for field in FIELDS if values.get(field)})
+
+        # Sorted, so that exporting the same results again produces the same file
+        content = "".join(
+            json.dumps(records[path], ensure_ascii=False, sort_keys=True) + "\n"
+            for path in sorted(records)
+        ).encode("utf-8")
+        count = len(self._manifest)
+        if content == existing:
+            self.stats.unchanged += count
+            return
+        try:
+            replace_file(manifest_path, content)
+            self.stats.written += count
+        except OSError as e:
+            print(f"Failed to write manifest {manifest_path}: {e}")
+            self.stats.failed += count
+
+    def close(self) -> ExportStats:
+        """
+        Exports the remaining files and waits until everything is written.
+        """
+        for file_path in list(self._values):
+            self.flush(file_path)
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        if self.mode == EXPORT_MANIFEST:
+            self._write_manifest()
+        return self.stats
+
+
+def get_common_folder(file_paths: List[str]) -> str:
+    """
+    Returns the deepest folder containing all files, or the folder of the first file if
+    they are on different drives.
+    """
+    try:
+        return os.path.commonpath([os.path.dirname(path) for path in file_paths])
+    except ValueError:
+        return os.path.dirname(file_paths[0])
+
+
+def get_manifest_path(file_path: str, base: str) -> str:
+    """
+    Returns the path of a file as stored in a manifest in the base folder. Files on
+    another drive than the manifest keep their absolute path.
+    """
+    try:
+        return os.path.relpath(file_path, base).replace(os.sep, "/")
+    except ValueError:
+        return os.path.abspath(file_path).replace(os.sep, "/")
+
+
+def read_attribute_values(database, file_path: str, attribute_names: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Reads the AI attributes of a file in the shape used by the exporter.
+    """
+    values = {}
+    for field, attribute_name in attribute_names.items():
+        try:
+            value = database.attributes.get_attribute_value(file_path, attribute_name)
+        except Exception:
+            continue
+        if not value:
+            continue
+        if field == "keywords":
+            values[field] = [tag.name if hasattr(tag, "name") else str(tag) for tag in value]
+        else:
+            values[field] = str(value)
+    return values
+
+
+def export_files(
+    file_paths: Iterable[str],
+    database,
+    mode: str,
+    manifest_path: Optional[str] = None,
+    attribute_names: Optional[Dict[str, str]] = None,
+):
+    """
+    Exports the AI attributes of existing files.
+
+    Args:
+        file_paths: Files to export
+        database: Anchorpoint database instance to read the attributes from
+        mode: EXPORT_SIDECARS or EXPORT_MANIFEST
+        manifest_path: Manifest file, defaults to the common folder of the files
+        attribute_names: Attribute names per field, defaults to AI-Title, AI-Description and AI-Keywords
+    """
+    if attribute_names is None:
+        attribute_names = {
+            "title": "AI-Title",
+            "description": "AI-Description",
+            "keywords": "AI-Keywords",
+        }
+    if not hasattr(file_paths, "__len__"):
+        file_paths = list(file_paths)
+    progress = ap.Progress(
+        "Exporting Tags", "Exporting", infinite=False, cancelable=True
+    )
+    reporter = ProgressReporter(len(file_paths), progress)
+    reporter.set_stage("Exporting")
+    exporter = ResultExporter(mode, manifest_path)
+    try:
+        for file_path in file_paths:
+            if progress.canceled:
+                break
+            values = read_attribute_values(database, file_path, attribute_names)
+            if values:
+                exporter.update(file_path, values)
+                exporter.flush(file_path)
+            else:
+                reporter.add_skip()
+            reporter.file_done()
+    finally:
+        stats = exporter.close()
+        reporter.finish("Canceled" if progress.canceled else "Finished")
+        progress.finish()
+
+    ap.UI().show_success("Export Complete", stats.get_report())
+
+
+def export_callback(dialog: ap.Dialog, file_paths: List[str]):
+    mode = dialog.get_value("export_mode")
+    dialog.close()
+    ctx = ap.get_context()
+    ctx.run_async(export_files, file_paths, ap.get_api(), mode)
+
+
+def main():
+    ctx = ap.get_context()
+    selection = collect_files(ctx.selected_files, ctx.selected_folders)
+    if not selection.files:
+        ap.UI().show_error("No Supported Files Found", "No supported files found in selected files or folders")
+        return
+
+    dialog = ap.Dialog()
+    dialog.title = "Export Tags"
+    dialog.icon = ctx.icon
+    dialog.add_text("Export To:").add_dropdown(
+        EXPORT_SIDECARS, [EXPORT_SIDECARS, EXPORT_MANIFEST], var="export_mode"
+    )
+    dialog.add_info(
+        "XMP sidecars are written next to each file and can be read by Lightroom and most DAMs.<br>"
+        f"The JSON manifest ({MANIFEST_NAME}) is written to the common folder of the files.<br>"
+        "Unchanged files are not rewritten."
+    )
+    (
+        dialog.add_button("Export", callback=lambda d: export_callback(d, selection.files))
+        .add_button("Cancel", primary=False, callback=lambda d: d.close())
+    )
+    dialog.show()
+
+
+if __name__ == "__main__":
+    main()
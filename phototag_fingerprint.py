@@ -0,0 +1,222 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from typing import Optional, Tuple
+
+FINGERPRINT_DB = os.path.join(tempfile.gettempdir(), "anchorpoint", "phototag_ai", "fingerprints.db")
+
+# Size of the head, middle and tail blocks of the sampled hash
+SAMPLE_BLOCK_SIZE = 64 * 1024
+FULL_HASH_CHUNK_SIZE = 1024 * 1024
+
+_index: Optional["FingerprintIndex"] = None
+_index_lock = threading.Lock()
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Returns the full content hash of a file, read in chunks.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(FULL_HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sample_file(file_path: str, size: int, block_size: int = SAMPLE_BLOCK_SIZE) -> Tuple[str, bool]:
+    """
+    Returns a fast non-cryptographic hash of the head, middle and tail blocks of a file
+    and whether it covers the whole content. Files smaller than three blocks are hashed
+    completely with the full hash instead.
+    """
+    if size <= 3 * block_size:
+        return hash_file(file_path), True
+    crc = 0
+    adler = 1
+    with open(file_path, "rb") as f:
+        for offset in (0, size // 2 - block_size // 2, size - block_size):
+            f.seek(offset)
+            block = f.read(block_size)
+            crc = zlib.crc32(block, crc)
+            adler = zlib.adler32(block, adler)
+    return f"{size:x}-{crc:08x}{adler:08x}", False
+
+
+class FingerprintIndex:
+    """
+    Persistent, tiered fingerprints of files, used as keys for the preview cache and to
+    recognize files that were already tagged with the same settings.
+
+    1. Size, modification time and inode match the memoized entry: no content is read.
+    2. Otherwise a sampled hash of the head, middle and tail blocks is computed. If it
+       differs from the memoized entry, the file changed and gets a new fingerprint.
+    3. A full hash is only computed when the sample is inconclusive: the sampled hash
+       matches the memoized entry, e.g. the file was touched or edited in place outside
+       the sampled blocks, or another file has the same sampled hash. The fingerprint is
+       kept if the full hash matches the memoized one.
+
+    Fingerprints are strings prefixed with "s:" for sampled and "f:" for full hashes.
+    """
+
+    def __init__(self, db_path: str = FINGERPRINT_DB, block_size: int = SAMPLE_BLOCK_SIZE):
+        self.db_path = db_path
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # Shared by the tagging run and the preview cache, which may run on different threads
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._connection:
+            # Several actions may run at the same time, e.g. a watched folder and a manual run
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+                "device INTEGER, sample TEXT, full_hash TEXT, fingerprint TEXT)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS files_sample ON files (sample)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tagged ("
+                "path TEXT, fingerprint TEXT, settings TEXT, tagged_at REAL, "
+                "PRIMARY KEY (path, settings))"
+            )
+
+    @staticmethod
+    def _normalize(file_path: str) -> str:
+        return os.path.normcase(os.path.abspath(file_path))
+
+    def get_fingerprint(self, file_path: str, read_content: bool = True) -> Optional[str]:
+        """
+        Returns the fingerprint of a file, or None if it can't be read.
+        With read_content disabled, only memoized fingerprints of unchanged files are returned.
+        """
+        path = self._normalize(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        identity = (stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev)
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, inode, device, sample, full_hash, fingerprint "
+                "FROM files WHERE path = ?",
+                (path,),
+            ).fetchone()
+        if row and tuple(row[:4]) == identity:
+            return row[6]
+        if not read_content:
+            return None
+
+        try:
+            sample, exact = sample_file(file_path, stat.st_size, self.block_size)
+            if exact:
+                self._store(path, identity, sample, sample, "f:" + sample)
+                return "f:" + sample
+
+            fingerprint = "s:" + sample
+            full_hash = None
+            if row and row[4] == sample:
+                # Touched, or edited outside the sampled blocks. Without a full hash from
+                # before, the fingerprint changes once and later touches are compared exactly
+                full_hash = hash_file(file_path)
+                fingerprint = row[6] if full_hash == row[5] else "f:" + full_hash
+            else:
+                other = self._find_other(path, sample, stat)
+                if other:
+                    full_hash = hash_file(file_path)
+                    # Copies share the fingerprint, different files fall back to the full hash
+                    fingerprint = other[1] if full_hash == other[0] else "f:" + full_hash
+        except OSError as e:
+            print(f"Failed to fingerprint {file_path}: {e}")
+            return None
+
+        self._store(path, identity, sample, full_hash, fingerprint)
+        return fingerprint
+
+    def _find_other(self, path: str, sample: str, stat: os.stat_result) -> Optional[Tuple[str, str]]:
+        """
+        Returns the full hash and fingerprint of another file with the same sampled hash.
+        Hard links of the same file are not a conflict.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, size, mtime_ns, inode, device, full_hash, fingerprint FROM files "
+                "WHERE sample = ? AND path != ?",
+                (sample, path),
+            ).fetchall()
+        for other_path, size, mtime_ns, inode, device, full_hash, fingerprint in rows:
+            if (inode, device) == (stat.st_ino, stat.st_dev):
+                continue
+            if not full_hash:
+                try:
+                    other_stat = os.stat(other_path)
+                    # Entries of files that changed since are refreshed when they are used again
+                    if (other_stat.st_size, other_stat.st_mtime_ns) != (size, mtime_ns):
+                        continue
+                    full_hash = hash_file(other_path)
+                except OSError:
+                    # The other file is gone, its entry is stale
+                    with self._lock, self._connection:
+                        self._connection.execute("DELETE FROM files WHERE path = ?", (other_path,))
+                    continue
+                with self._lock, self._connection:
+                    self._connection.execute(
+                        "UPDATE files SET full_hash = ? WHERE path = ?", (full_hash, other_path)
+                    )
+            return full_hash, fingerprint
+        return None
+
+    def _store(self, path: str, identity: tuple, sample: str, full_hash: Optional[str], fingerprint: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files "
+                "(path, size, mtime_ns, inode, device, sample, full_hash, fingerprint) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, *identity, sample, full_hash, fingerprint),
+            )
+
+    def is_tagged(self, file_path: str, fingerprint: str, settings_fingerprint: str) -> bool:
+        """
+        Returns True if the file was tagged with these settings and hasn't changed since.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fingerprint FROM tagged WHERE path = ? AND settings = ?",
+                (self._normalize(file_path), settings_fingerprint),
+            ).fetchone()
+        return bool(row) and row[0] == fingerprint
+
+    def mark_tagged(self, file_path: str, fingerprint: str, settings_fingerprint: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO tagged (path, fingerprint, settings, tagged_at) VALUES (?, ?, ?, ?)",
+                (self._normalize(file_path), fingerprint, settings_fingerprint, time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def get_fingerprint_index() -> Optional[FingerprintIndex]:
+    """
+    Returns the process-wide fingerprint index, opened on first use.
+    Returns None if the database can't be opened, fingerprints are an optimization only.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            try:
+                _index = FingerprintIndex()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Failed to open fingerprint index: {e}")
+                return None
+        return _index
@@ -1,8 +1,12 @@
 import anchorpoint as ap
 import apsync as aps
 from phototag_settings import PhototagSettings
+from phototag_scheduler import DEFAULT_FILE_ORDER
+from compute_backends import DEFAULT_COMPUTE_BACKEND
 from typing import Optional
 
+_local_settings: Optional["PhototagLocalSettings"] = None
+
 
 class PhototagLocalSettings:
     def __init__(self):
@@ -19,6 +23,11 @@ class PhototagLocalSettings:
     section_title_folded: bool
     section_additional_folded: bool
     section_ai_attributes_folded: bool
+    seconds_per_request: Optional[float]
+    file_order: str
+    time_budget_minutes: Optional[int]
+    compute_backend: str
+    spool_uploads: bool
 
     def get(self, key: str, default: object = "") -> object:
         return self.settings.get(key, default)
@@ -37,6 +46,11 @@ class PhototagLocalSettings:
         self.section_title_folded = bool(self.get("section_title_folded", True))
         self.section_additional_folded = bool(self.get("section_additional_folded", True))
         self.section_ai_attributes_folded = bool(self.get("section_ai_attributes_folded", True))
+        self.seconds_per_request = self.get("seconds_per_request", None)
+        self.file_order = str(self.get("file_order", DEFAULT_FILE_ORDER))
+        self.time_budget_minutes = self.get("time_budget_minutes", None)
+        self.compute_backend = str(self.get("compute_backend", DEFAULT_COMPUTE_BACKEND))
+        self.spool_uploads = bool(self.get("spool_uploads", False))
 
     def store(self):
         """
@@ -49,4 +63,31 @@ class PhototagLocalSettings:
         self.set("section_title_folded", self.section_title_folded)
         self.set("section_additional_folded", self.section_additional_folded)
         self.set("section_ai_attributes_folded", self.section_ai_attributes_folded)
+        self.set("seconds_per_request", self.seconds_per_request)
+        self.set("file_order", self.file_order)
+        self.set("time_budget_minutes", self.time_budget_minutes)
+        self.set("compute_backend", self.compute_backend)
+        self.set("spool_uploads", self.spool_uploads)
         self.settings.store()
+
+    def update_throughput(self, seconds: float, requests: int):
+        """
+        Updates the moving average of seconds per API request with the throughput of a finished run.
+        """
+        if requests <= 0:
+            return
+        measured = seconds / requests
+        if self.seconds_per_request:
+            measured = 0.7 * float(self.seconds_per_request) + 0.3 * measured
+        self.seconds_per_request = measured
+        self.store()
+
+
+def get_local_settings() -> PhototagLocalSettings:
+    """
+    Returns the process-wide local settings, loaded on first use.
+    """
+    global _local_settings
+    if _local_settings is None:
+        _local_settings = PhototagLocalSettings()
+    return _local_settings
@@ -0,0 +1,70 @@
+import os
+import time
+from typing import Optional
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """
+    Exclusive lock on a file that works across processes on Windows, macOS and Linux.
+    The lock is released by the operating system if the process dies, so there are no
+    stale locks. Two FileLock objects on the same path also exclude each other within
+    one process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def _try_lock(self) -> bool:
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        """
+        Acquires the lock. Returns False if it is held elsewhere and blocking is disabled
+        or the timeout expired.
+        """
+        if self._file is not None:
+            raise RuntimeError(f"Lock {self.path} is already acquired")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a+b")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._try_lock():
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                self._file.close()
+                self._file = None
+                return False
+            time.sleep(0.01)
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
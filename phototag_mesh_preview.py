@@ -0,0 +1,332 @@
+import io
+import itertools
+import json
+import math
+import os
+import re
+import struct
+from array import array
+from typing import List, Optional
+
+# 3D formats that are rendered by aps.generate_thumbnail, the slowest kind of preview
+THREE_D_EXTENSIONS = {
+    ".max", ".obj", ".ply", ".stl", ".pts", ".step", ".stp", ".iges", ".igs", ".brep", ".abc",
+    ".3ds", ".wrl", ".fbx", ".glb", ".gltf", ".dae", ".3mf", ".usd", ".usda", ".usdc", ".usdz",
+    ".f3d",
+}
+
+# Formats whose vertices can be read directly, they get a contact sheet instead
+MESH_PREVIEW_EXTENSIONS = {".obj", ".stl", ".ply", ".glb"}
+
+# Larger meshes are left to aps.generate_thumbnail, the whole file is held in memory
+MAX_MESH_BYTES = 128 * 1024 * 1024
+# Vertices drawn per view, larger meshes are sampled evenly
+MAX_MESH_POINTS = 60000
+CONTACT_SHEET_SIZE = 1024
+
+# Renders get BASE seconds plus one second per BYTES_PER_SECOND of the file, up to MAX
+RENDER_TIMEOUT_BASE = 10.0
+RENDER_TIMEOUT_BYTES_PER_SECOND = 20 * 1024 * 1024
+RENDER_TIMEOUT_MAX = 180.0
+
+_PLY_TYPES = {
+    "char": "b", "int8": "b", "uchar": "B", "uint8": "B",
+    "short": "h", "int16": "h", "ushort": "H", "uint16": "H",
+    "int": "i", "int32": "i", "uint": "I", "uint32": "I",
+    "float": "f", "float32": "f", "double": "d", "float64": "d",
+}
+
+
+def get_render_timeout(size: int, bytes_per_second: float = RENDER_TIMEOUT_BYTES_PER_SECOND) -> float:
+    """
+    Returns how long rendering the preview of a file of this size may take, so one huge
+    CAD file can't stall the batch.
+    """
+    return min(RENDER_TIMEOUT_MAX, RENDER_TIMEOUT_BASE + size / bytes_per_second)
+
+
+# Text vertices are matched in the buffer itself, without copying it or collecting all matches
+_STL_VERTEX = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+_STL_VERTEX_START = re.compile(rb"vertex\s")
+_OBJ_VERTEX = re.compile(rb"^v[ \t]+(\S+)[ \t]+(\S+)[ \t]+(\S+)", re.MULTILINE)
+_OBJ_VERTEX_START = re.compile(rb"^v[ \t]", re.MULTILINE)
+_LINE = re.compile(rb"[^\r\n]+")
+
+
+def _get_stride(count: int, max_points: int) -> int:
+    return max(1, -(-count // max_points))
+
+
+def _read_text_points(data: memoryview, vertex: re.Pattern, vertex_start: re.Pattern, max_points: int) -> array:
+    """
+    Samples vertices matched by a pattern with three groups in two passes over the buffer,
+    the first one only counts them.
+    """
+    points = array("f")
+    count = sum(1 for _ in vertex_start.finditer(data))
+    for match in itertools.islice(vertex.finditer(data), 0, None, _get_stride(count, max_points)):
+        points.extend(float(value) for value in match.groups())
+    return points
+
+
+def read_stl_points(data: memoryview, max_points: int = MAX_MESH_POINTS) -> array:
+    """
+    Returns sampled vertices of a binary or ASCII STL file as a flat array of x, y, z.
+    """
+    points = array("f")
+    if len(data) >= 84:
+        (count,) = struct.unpack_from("<I", data, 80)
+        # ASCII files start with "solid" too, the size tells them apart
+        if 84 + count * 50 == len(data):
+            for triangle in range(0, count, _get_stride(count, max_points // 3)):
+                points.extend(struct.unpack_from("<9f", data, 84 + triangle * 50 + 12))
+            return points
+    return _read_text_points(data, _STL_VERTEX, _STL_VERTEX_START, max_points)
+
+
+def read_obj_points(data: memoryview, max_points: int = MAX_MESH_POINTS) -> array:
+    """
+    Returns sampled vertices of a Wavefront OBJ file as a flat array of x, y, z.
+    """
+    return _read_text_points(data, _OBJ_VERTEX, _OBJ_VERTEX_START, max_points)
+
+
+def read_ply_points(data: memoryview, max_points: int = MAX_MESH_POINTS) -> array:
+    """
+    Returns sampled vertices of an ASCII or binary PLY file as a flat array of x, y, z.
+    """
+    points = array("f")
+    head = bytes(data[:65536])
+    header_end = head.find(b"end_header")
+    newline = head.find(b"\n", header_end)
+    if header_end < 0 or newline < 0:
+        return points
+    body = newline + 1
+
+    file_format = "ascii"
+    count = 0
+    properties: List[str] = []
+    formats: List[str] = []
+    element = None
+    for line in head[:header_end].decode("ascii", "replace").splitlines():
+        words = line.split()
+        if not words:
+            continue
+        if words[0] == "format":
+            file_format = words[1]
+        elif words[0] == "element":
+            element = words[1]
+            if element == "vertex":
+                count = int(words[2])
+            elif not count:
+                # The vertices are read from the start of the body
+                return points
+        elif words[0] == "property" and element == "vertex":
+            if words[1] == "list" or words[1] not in _PLY_TYPES:
+                return points
+            formats.append(_PLY_TYPES[words[1]])
+            properties.append(words[2])
+    if not count or not {"x", "y", "z"} <= set(properties):
+        return points
+    indices = [properties.index(axis) for axis in ("x", "y", "z")]
+    stride = _get_stride(count, max_points)
+
+    if file_format == "ascii":
+        for line in itertools.islice(_LINE.finditer(data, body), 0, count, stride):
+            values = line.group().split()
+            if len(values) >= len(properties):
+                points.extend(float(values[index]) for index in indices)
+        return points
+
+    vertex = struct.Struct(("<" if file_format == "binary_little_endian" else ">") + "".join(formats))
+    count = min(count, (len(data) - body) // vertex.size)
+    for position in range(0, count, stride):
+        values = vertex.unpack_from(data, body + position * vertex.size)
+        points.extend(values[index] for index in indices)
+    return points
+
+
+def _multiply(a: List[float], b: List[float]) -> List[float]:
+    # Column-major 4x4 matrices as used by glTF
+    return [
+        sum(a[k * 4 + row] * b[column * 4 + k] for k in range(4))
+        for column in range(4)
+        for row in range(4)
+    ]
+
+
+def _get_node_matrix(node: dict) -> List[float]:
+    if "matrix" in node:
+        return [float(value) for value in node["matrix"]]
+    tx, ty, tz = node.get("translation", (0, 0, 0))
+    x, y, z, w = node.get("rotation", (0, 0, 0, 1))
+    sx, sy, sz = node.get("scale", (1, 1, 1))
+    return [
+        (1 - 2 * (y * y + z * z)) * sx, 2 * (x * y + z * w) * sx, 2 * (x * z - y * w) * sx, 0,
+        2 * (x * y - z * w) * sy, (1 - 2 * (x * x + z * z)) * sy, 2 * (y * z + x * w) * sy, 0,
+        2 * (x * z + y * w) * sz, 2 * (y * z - x * w) * sz, (1 - 2 * (x * x + y * y)) * sz, 0,
+        tx, ty, tz, 1,
+    ]
+
+
+def read_glb_points(data: memoryview, max_points: int = MAX_MESH_POINTS) -> array:
+    """
+    Returns sampled vertices of a binary glTF file in scene space as a flat array of x, y, z.
+    """
+    points = array("f")
+    magic, _, _ = struct.unpack_from("<4sII", data, 0)
+    if magic != b"glTF":
+        return points
+    json_length, json_type = struct.unpack_from("<II", data, 12)
+    if json_type != 0x4E4F534A:
+        return points
+    document = json.loads(bytes(data[20:20 + json_length]))
+    binary_start = 20 + json_length + 8
+    accessors = document.get("accessors", [])
+    views = document.get("bufferViews", [])
+    meshes = document.get("meshes", [])
+    nodes = document.get("nodes", [])
+
+    # Mesh instances with their world matrices
+    instances = []
+    scenes = document.get("scenes", [])
+    roots = scenes[document.get("scene", 0)].get("nodes", []) if scenes else range(len(nodes))
+    stack = [(index, [1.0, 0, 0, 0, 0, 1.0, 0, 0, 0, 0, 1.0, 0, 0, 0, 0, 1.0]) for index in roots]
+    while stack:
+        index, parent = stack.pop()
+        node = nodes[index]
+        matrix = _multiply(parent, _get_node_matrix(node))
+        if "mesh" in node:
+            instances.append((meshes[node["mesh"]], matrix))
+        stack.extend((child, matrix) for child in node.get("children", []))
+
+    total = 0
+    sources = []
+    for mesh, matrix in instances:
+        for primitive in mesh.get("primitives", []):
+            attributes = primitive.get("attributes", {})
+            if "POSITION" not in attributes:
+                continue
+            accessor = accessors[attributes["POSITION"]]
+            # Only plain float vectors stored in the binary chunk
+            if accessor.get("componentType") != 5126 or "bufferView" not in accessor:
+                continue
+            view = views[accessor["bufferView"]]
+            if view.get("buffer", 0) != 0:
+                continue
+            offset = binary_start + view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+            sources.append((offset, view.get("byteStride", 12), accessor["count"], matrix))
+            total += accessor["count"]
+
+    stride = _get_stride(total, max_points)
+    for offset, byte_stride, count, m in sources:
+        for position in range(0, count, stride):
+            x, y, z = struct.unpack_from("<3f", data, offset + position * byte_stride)
+            points.extend(
+                (
+                    m[0] * x + m[4] * y + m[8] * z + m[12],
+                    m[1] * x + m[5] * y + m[9] * z + m[13],
+                    m[2] * x + m[6] * y + m[10] * z + m[14],
+                )
+            )
+    return points
+
+
+MESH_READERS = {
+    ".stl": read_stl_points,
+    ".obj": read_obj_points,
+    ".ply": read_ply_points,
+    ".glb": read_glb_points,
+}
+
+
+def render_contact_sheet(points: array, size: int = CONTACT_SHEET_SIZE) -> Optional[bytes]:
+    """
+    Draws the points from the front, side, top and at an angle into a 2x2 grid and returns
+    it as PNG. Points are shaded by depth, so the shape reads without lighting or meshes.
+    """
+    from PIL import Image, ImageDraw
+
+    count = len(points) // 3
+    if count < 3:
+        return None
+    xs, ys, zs = points[0::3], points[1::3], points[2::3]
+    center = [(min(values) + max(values)) / 2 for values in (xs, ys, zs)]
+    extent = max(max(values) - min(values) for values in (xs, ys, zs)) or 1.0
+    if not math.isfinite(extent):
+        return None
+
+    cell = size // 2
+    scale = cell * 0.85 / extent
+    # Projections to screen x, screen y and depth, larger depth is closer to the viewer
+    angle_y = math.radians(45)
+    angle_x = math.radians(30)
+    cos_y, sin_y, cos_x, sin_x = math.cos(angle_y), math.sin(angle_y), math.cos(angle_x), math.sin(angle_x)
+    views = [
+        lambda x, y, z: (x, y, z),
+        lambda x, y, z: (-z, y, x),
+        lambda x, y, z: (x, -z, y),
+        lambda x, y, z: (
+            x * cos_y - z * sin_y,
+            y * cos_x + (x * sin_y + z * cos_y) * sin_x,
+            -y * sin_x + (x * sin_y + z * cos_y) * cos_x,
+        ),
+    ]
+    # Sparse meshes are drawn with larger dots
+    offsets = [(0, 0)] if count > 20000 else [(0, 0), (1, 0), (0, 1), (1, 1)]
+    shades = 16
+
+    image = Image.new("L", (size, size), 235)
+    draw = ImageDraw.Draw(image)
+    for view_index, project in enumerate(views):
+        left = (view_index % 2) * cell + cell // 2
+        top = (view_index // 2) * cell + cell // 2
+        projected = [
+            project(x - center[0], y - center[1], z - center[2]) for x, y, z in zip(xs, ys, zs)
+        ]
+        depths = [depth for _, _, depth in projected]
+        near, far = max(depths), min(depths)
+        depth_range = (near - far) or 1.0
+        buckets = [[] for _ in range(shades)]
+        for screen_x, screen_y, depth in projected:
+            shade = min(shades - 1, int((depth - far) / depth_range * shades))
+            px = left + int(screen_x * scale)
+            py = top - int(screen_y * scale)
+            buckets[shade].extend((px + dx, py + dy) for dx, dy in offsets)
+        # Far points first, so closer points are drawn over them
+        for shade, coordinates in enumerate(buckets):
+            if coordinates:
+                draw.point(coordinates, fill=170 - shade * 150 // shades)
+    draw.line([(cell, 0), (cell, size)], fill=200)
+    draw.line([(0, cell), (size, cell)], fill=200)
+
+    output = io.BytesIO()
+    image.save(output, "PNG")
+    return output.getvalue()
+
+
+def render_mesh_preview(data: memoryview, extension: str, max_points: int = MAX_MESH_POINTS) -> Optional[bytes]:
+    """
+    Compute backend task that renders the contact sheet of a mesh file.
+    Returns None if the format is not supported, the file can't be parsed or Pillow is missing.
+    """
+    reader = MESH_READERS.get(extension.lower())
+    if not reader:
+        return None
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return None
+    try:
+        return render_contact_sheet(reader(data, max_points))
+    except Exception as e:
+        print(f"Failed to render mesh preview: {e}")
+        return None
+
+
+def has_mesh_preview_format(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in MESH_PREVIEW_EXTENSIONS
+
+
+def is_3d_file(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in THREE_D_EXTENSIONS
@@ -0,0 +1,402 @@
+import mmap
+import os
+import struct
+import xml.etree.ElementTree as ElementTree
+from typing import Any, Dict, List, Optional
+from phototag_embedded_preview import iter_psd_resources
+from phototag_vocabulary import parse_keyword_list
+
+# Longest embedded description passed to the API as context
+MAX_CONTEXT_CHARS = 500
+
+XMP_NAMESPACES = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "photoshop": "http://ns.adobe.com/photoshop/1.0/",
+}
+XMP_JPEG_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+PHOTOSHOP_JPEG_HEADER = b"Photoshop 3.0\x00"
+EXIF_JPEG_HEADER = b"Exif\x00\x00"
+
+# TIFF tags
+TAG_IMAGE_DESCRIPTION = 0x010E
+TAG_XMP = 0x02BC
+TAG_IPTC = 0x83BB
+TAG_XP_TITLE = 0x9C9B
+TAG_XP_KEYWORDS = 0x9C9E
+
+# IPTC IIM datasets of record 2
+IPTC_OBJECT_NAME = 5
+IPTC_KEYWORDS = 25
+IPTC_HEADLINE = 105
+IPTC_CAPTION = 120
+
+# Photoshop image resources
+PSD_RESOURCE_IPTC = 0x0404
+PSD_RESOURCE_XMP = 0x0424
+
+
+def get_enabled_fields(settings) -> set:
+    """
+    Returns the enabled AI attributes of a preset, as keys of the attribute names dictionary.
+    """
+    fields = set()
+    if settings.enable_ai_title:
+        fields.add("title")
+    if settings.enable_ai_description:
+        fields.add("description")
+    if settings.enable_ai_tags:
+        fields.add("keywords")
+    return fields
+
+
+class EmbeddedMetadata:
+    """
+    Title, description and keywords found in the XMP, IPTC and EXIF metadata of a file.
+    Values from XMP take precedence over IPTC, and IPTC over EXIF.
+    """
+
+    __slots__ = ("title", "description", "keywords")
+
+    def __init__(self):
+        self.title: Optional[str] = None
+        self.description: Optional[str] = None
+        self.keywords: List[str] = []
+
+    def merge(self, title: Optional[str], description: Optional[str], keywords: List[str]):
+        """
+        Fills the fields that are still empty.
+        """
+        if not self.title and title:
+            self.title = title.strip()
+        if not self.description and description:
+            self.description = description.strip()
+        if not self.keywords and keywords:
+            self.keywords = [keyword.strip() for keyword in keywords if keyword.strip()]
+
+    def is_empty(self) -> bool:
+        return not (self.title or self.description or self.keywords)
+
+    def get_covered_fields(self, settings) -> set:
+        """
+        Returns the enabled AI attributes of a preset that this metadata provides.
+        """
+        values = {"title": self.title, "description": self.description, "keywords": self.keywords}
+        return {field for field in get_enabled_fields(settings) if values[field]}
+
+    def is_complete(self, settings) -> bool:
+        """
+        Returns True if this metadata provides all enabled AI attributes of a preset.
+        """
+        return self.get_covered_fields(settings) == get_enabled_fields(settings)
+
+    def to_data(self) -> Dict[str, Any]:
+        """
+        Returns the metadata in the shape of the "data" field of an API response.
+        """
+        return {
+            "title": self.title,
+            "description": self.description,
+            "keywords": list(self.keywords),
+        }
+
+
+def _decode_text(value: bytes) -> str:
+    value = value.rstrip(b"\x00")
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+def parse_xmp(packet: bytes, metadata: EmbeddedMetadata):
+    """
+    Reads dc:title, dc:description and dc:subject from an XMP packet.
+    """
+    start = packet.find(b"<x:xmpmeta")
+    if start < 0:
+        start = packet.find(b"<rdf:RDF")
+    end_tag = b"</x:xmpmeta>" if packet.startswith(b"<x:xmpmeta", start) else b"</rdf:RDF>"
+    end = packet.find(end_tag, start)
+    if start < 0 or end < 0:
+        return
+    try:
+        root = ElementTree.fromstring(bytes(packet[start : end + len(end_tag)]))
+    except ElementTree.ParseError as e:
+        print(f"Failed to parse XMP metadata: {e}")
+        return
+
+    def get_items(path: str) -> List[str]:
+        return [
+            item.text
+            for element in root.iterfind(f".//{path}", XMP_NAMESPACES)
+            for item in element.iterfind(".//rdf:li", XMP_NAMESPACES)
+            if item.text
+        ]
+
+    def get_text(path: str) -> Optional[str]:
+        # Language alternatives, the first entry is the default language
+        items = get_items(path)
+        if items:
+            return items[0]
+        for element in root.iterfind(f".//{path}", XMP_NAMESPACES):
+            if element.text and element.text.strip():
+                return element.text
+        # Simple properties can also be written as attributes of rdf:Description
+        namespace, name = path.split(":")
+        attribute = f"{{{XMP_NAMESPACES[namespace]}}}{name}"
+        for description in root.iterfind(".//rdf:Description", XMP_NAMESPACES):
+            if attribute in description.attrib:
+                return description.attrib[attribute]
+        return None
+
+    metadata.merge(
+        get_text("dc:title") or get_text("photoshop:Headline"),
+        get_text("dc:description"),
+        get_items("dc:subject"),
+    )
+
+
+def parse_iptc(data, metadata: EmbeddedMetadata):
+    """
+    Reads the object name, headline, caption and keywords from IPTC IIM records.
+    """
+    title = None
+    headline = None
+    caption = None
+    keywords = []
+    position = 0
+    while position + 5 <= len(data):
+        if data[position] != 0x1C:
+            break
+        record, dataset, size = struct.unpack_from(">BBH", data, position + 1)
+        position += 5
+        if size & 0x8000:
+            # Extended dataset, the length is stored in the following bytes
+            length_size = size & 0x7FFF
+            size = int.from_bytes(data[position : position + length_size], "big")
+            position += length_size
+        value = bytes(data[position : position + size])
+        position += size
+        if record != 2:
+            continue
+        if dataset == IPTC_OBJECT_NAME:
+            title = _decode_text(value)
+        elif dataset == IPTC_HEADLINE:
+            headline = _decode_text(value)
+        elif dataset == IPTC_CAPTION:
+            caption = _decode_text(value)
+        elif dataset == IPTC_KEYWORDS:
+            keywords.append(_decode_text(value))
+    metadata.merge(headline or title, caption, keywords)
+
+
+def _parse_photoshop_resources(data, start: int, end: int, metadata: EmbeddedMetadata):
+    # Image resource blocks as stored in the Photoshop APP13 segment of JPEG files
+    position = start
+    while position + 12 <= end and data[position : position + 4] == b"8BIM":
+        resource_id = struct.unpack_from(">H", data, position + 4)[0]
+        name_length = data[position + 6]
+        position += 6 + ((name_length + 2) & ~1)
+        size = struct.unpack_from(">I", data, position)[0]
+        position += 4
+        if resource_id == PSD_RESOURCE_IPTC:
+            parse_iptc(data[position : min(end, position + size)], metadata)
+        position += (size + 1) & ~1
+
+
+def read_tiff_metadata(data, base: int, metadata: EmbeddedMetadata, xmp: list, iptc: list):
+    """
+    Reads the metadata tags of the first IFD of a TIFF structure. XMP and IPTC blocks are
+    collected, so they can be parsed in order of precedence.
+    """
+    if len(data) < base + 8:
+        return
+    prefix = {b"II": "<", b"MM": ">"}.get(bytes(data[base : base + 2]))
+    if not prefix:
+        return
+    ifd_offset = struct.unpack_from(prefix + "I", data, base + 4)[0]
+    position = base + ifd_offset
+    if position + 2 > len(data):
+        return
+    count = struct.unpack_from(prefix + "H", data, position)[0]
+
+    description = None
+    title = None
+    keywords = []
+    for index in range(count):
+        entry = position + 2 + index * 12
+        if entry + 12 > len(data):
+            break
+        tag, value_type, value_count = struct.unpack_from(prefix + "HHI", data, entry)
+        # IPTC is sometimes stored as LONG values
+        size = value_count * (4 if value_type == 4 else 1)
+        value_offset = entry + 8 if size <= 4 else base + struct.unpack_from(prefix + "I", data, entry + 8)[0]
+        if value_offset + size > len(data):
+            continue
+        value = data[value_offset : value_offset + size]
+        if tag == TAG_XMP:
+            xmp.append(value)
+        elif tag == TAG_IPTC:
+            iptc.append(value)
+        elif tag == TAG_IMAGE_DESCRIPTION:
+            description = _decode_text(bytes(value))
+        elif tag == TAG_XP_TITLE:
+            title = bytes(value).decode("utf-16-le", "ignore").rstrip("\x00")
+        elif tag == TAG_XP_KEYWORDS:
+            keywords = bytes(value).decode("utf-16-le", "ignore").rstrip("\x00").split(";")
+    # EXIF is the last fallback
+    metadata.merge(title, description, keywords)
+
+
+def _read_jpeg(data, metadata: EmbeddedMetadata):
+    xmp, iptc, exif = [], [], []
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            break
+        marker = data[position + 1]
+        # Metadata segments come before the image data
+        if marker in (0xDA, 0xD9):
+            break
+        size = struct.unpack_from(">H", data, position + 2)[0]
+        start = position + 4
+        end = min(len(data), position + 2 + size)
+        if marker == 0xE1 and data[start : start + len(XMP_JPEG_HEADER)] == XMP_JPEG_HEADER:
+            xmp.append(data[start + len(XMP_JPEG_HEADER) : end])
+        elif marker == 0xE1 and data[start : start + len(EXIF_JPEG_HEADER)] == EXIF_JPEG_HEADER:
+            exif.append(start + len(EXIF_JPEG_HEADER))
+        elif marker == 0xED and data[start : start + len(PHOTOSHOP_JPEG_HEADER)] == PHOTOSHOP_JPEG_HEADER:
+            iptc.append((start + len(PHOTOSHOP_JPEG_HEADER), end))
+        position += 2 + size
+
+    for packet in xmp:
+        parse_xmp(packet, metadata)
+    for start, end in iptc:
+        _parse_photoshop_resources(data, start, end, metadata)
+    for base in exif:
+        read_tiff_metadata(data, base, metadata, [], [])
+
+
+def _read_png(data, metadata: EmbeddedMetadata):
+    position = 8
+    exif = []
+    while position + 8 <= len(data):
+        size, chunk_type = struct.unpack_from(">I4s", data, position)
+        start = position + 8
+        if chunk_type == b"IDAT":
+            break
+        if chunk_type == b"iTXt" and data[start : start + 18] == b"XML:com.adobe.xmp\x00":
+            # Keyword, compression flag and method, language tag and translated keyword
+            text_start = start + 20
+            for _ in range(2):
+                text_start = data.find(b"\x00", text_start, start + size) + 1
+            if text_start > 0:
+                parse_xmp(data[text_start : start + size], metadata)
+        elif chunk_type == b"eXIf":
+            exif.append(start)
+        position = start + size + 4
+    for base in exif:
+        read_tiff_metadata(data, base, metadata, [], [])
+
+
+def _read_tiff(data, metadata: EmbeddedMetadata):
+    xmp, iptc = [], []
+    exif = EmbeddedMetadata()
+    read_tiff_metadata(data, 0, exif, xmp, iptc)
+    for packet in xmp:
+        parse_xmp(packet, metadata)
+    for block in iptc:
+        parse_iptc(block, metadata)
+    metadata.merge(exif.title, exif.description, exif.keywords)
+
+
+def _read_psd(data, metadata: EmbeddedMetadata):
+    resources = {
+        resource_id: (position, size)
+        for resource_id, position, size in iter_psd_resources(data)
+        if resource_id in (PSD_RESOURCE_XMP, PSD_RESOURCE_IPTC)
+    }
+    if PSD_RESOURCE_XMP in resources:
+        position, size = resources[PSD_RESOURCE_XMP]
+        parse_xmp(data[position : position + size], metadata)
+    if PSD_RESOURCE_IPTC in resources:
+        position, size = resources[PSD_RESOURCE_IPTC]
+        parse_iptc(data[position : position + size], metadata)
+
+
+def _read_webp(data, metadata: EmbeddedMetadata):
+    position = 12
+    exif = []
+    while position + 8 <= len(data):
+        chunk_type, size = struct.unpack_from("<4sI", data, position)
+        start = position + 8
+        if chunk_type == b"XMP ":
+            parse_xmp(data[start : start + size], metadata)
+        elif chunk_type == b"EXIF":
+            exif.append(start + (6 if data[start : start + 6] == EXIF_JPEG_HEADER else 0))
+        position = start + size + (size & 1)
+    for base in exif:
+        read_tiff_metadata(data, base, metadata, [], [])
+
+
+def read_embedded_metadata(file_path: str) -> Optional[EmbeddedMetadata]:
+    """
+    Reads the title, description and keywords embedded in an image. The file is memory
+    mapped and only the metadata segments in front of the image data are parsed, so the
+    pixel data is not read from disk.
+
+    Supports JPEG, PNG, WebP, PSD/PSB and TIFF based files including DNG and most camera RAW formats.
+
+    Returns:
+        The metadata, or None if the file doesn't contain any
+    """
+    metadata = EmbeddedMetadata()
+    try:
+        with open(file_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                header = data[:12]
+                if header[:3] == b"\xff\xd8\xff":
+                    _read_jpeg(data, metadata)
+                elif header[:8] == b"\x89PNG\r\n\x1a\n":
+                    _read_png(data, metadata)
+                elif header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+                    _read_webp(data, metadata)
+                elif header[:4] == b"8BPS":
+                    _read_psd(data, metadata)
+                elif header[:2] in (b"II", b"MM"):
+                    _read_tiff(data, metadata)
+    except (OSError, ValueError, struct.error, IndexError) as e:
+        print(f"Failed to read metadata of {os.path.basename(file_path)}: {e}")
+        return None
+    return None if metadata.is_empty() else metadata
+
+
+def build_context_payload(
+    payload: Dict[str, Any], metadata: EmbeddedMetadata, max_keywords: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Returns a copy of a request payload with the embedded title and description added to
+    customContext and the embedded keywords added to requiredKeywords.
+    """
+    payload = dict(payload)
+    context = [payload.get("customContext") or ""]
+    if metadata.title:
+        context.append(f"Title: {metadata.title}")
+    if metadata.description:
+        context.append(f"Description: {metadata.description[:MAX_CONTEXT_CHARS]}")
+    context = ". ".join(part for part in context if part)
+    if context:
+        payload["customContext"] = context
+
+    if metadata.keywords:
+        keywords = parse_keyword_list(payload.get("requiredKeywords") or "")
+        seen = {keyword.lower() for keyword in keywords}
+        for keyword in metadata.keywords:
+            if keyword.lower() not in seen:
+                seen.add(keyword.lower())
+                keywords.append(keyword)
+        if max_keywords:
+            keywords = keywords[:max_keywords]
+        payload["requiredKeywords"] = ", ".join(keywords)
+    return payload
@@ -0,0 +1,220 @@
+import os
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Unused slot of the hash index
+_EMPTY = -1
+_EXPLICIT = 1
+
+
+def _encode(name: str) -> bytes:
+    # Lossless for any str, including undecodable file names from os.listdir
+    return name.encode("utf-8", "surrogatepass")
+
+
+def _decode(data: bytes) -> str:
+    return data.decode("utf-8", "surrogatepass")
+
+
+class DirectoryInterner:
+    """
+    Stores each directory once and hands out integer ids for them. Spellings of the same
+    directory, e.g. with a trailing separator or in different case on Windows, share an id.
+    """
+
+    __slots__ = ("directories", "_ids", "_normalized_ids")
+
+    def __init__(self):
+        self.directories: List[str] = []
+        # Fast path for the spelling as given, os.walk repeats the same root for every file
+        self._ids: Dict[str, int] = {}
+        self._normalized_ids: Dict[str, int] = {}
+
+    def intern(self, directory: str) -> int:
+        directory_id = self._ids.get(directory)
+        if directory_id is not None:
+            return directory_id
+        normalized = os.path.normcase(os.path.abspath(directory))
+        directory_id = self._normalized_ids.get(normalized)
+        if directory_id is None:
+            directory_id = len(self.directories)
+            self.directories.append(directory)
+            self._normalized_ids[normalized] = directory_id
+        self._ids[directory] = directory_id
+        return directory_id
+
+    def find(self, directory: str) -> Optional[int]:
+        directory_id = self._ids.get(directory)
+        if directory_id is None:
+            directory_id = self._normalized_ids.get(os.path.normcase(os.path.abspath(directory)))
+        return directory_id
+
+
+class PathTable:
+    """
+    Compact, ordered set of file paths for selections of millions of files.
+
+    Directories are interned and each file is a directory id, a UTF-8 encoded name, a
+    flags byte and the modification time from collecting it in flat arrays, so there is
+    no Python object per file and the directory prefix isn't repeated. Membership tests
+    and deduplication use an open addressing hash index. Full path strings are only built
+    when a file is accessed, e.g. while iterating. Paths are compared like the file system
+    does, case-insensitively on Windows.
+    """
+
+    __slots__ = ("interner", "_directory_ids", "_name_data", "_name_offsets", "_flags", "_mtimes", "_hashes", "_index")
+
+    def __init__(self, interner: Optional[DirectoryInterner] = None):
+        """
+        Args:
+            interner: Directories shared with another table, e.g. the selection a plan is taken from
+        """
+        self.interner = interner or DirectoryInterner()
+        self._directory_ids = array("I")
+        self._name_data = bytearray()
+        # Start of each name in _name_data, with the end of the last name at the end
+        self._name_offsets = array("Q", [0])
+        self._flags = bytearray()
+        # 0 if unknown, so ordering by it doesn't need another stat
+        self._mtimes = array("d")
+        # Hash of each entry, so the index can grow without decoding the names
+        self._hashes = array("q")
+        self._index = array("q", [_EMPTY]) * 16
+
+    def __len__(self) -> int:
+        return len(self._directory_ids)
+
+    def __getitem__(self, position: int) -> str:
+        return os.path.join(self.get_directory(position), self.get_name(position))
+
+    def __iter__(self) -> Iterator[str]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def __contains__(self, path: str) -> bool:
+        directory, name = os.path.split(path)
+        directory_id = self.interner.find(directory)
+        if directory_id is None:
+            return False
+        return self._find(directory_id, name, self._hash(directory_id, name))[1] != _EMPTY
+
+    def get_directory(self, position: int) -> str:
+        return self.interner.directories[self._directory_ids[position]]
+
+    def get_directory_id(self, position: int) -> int:
+        return self._directory_ids[position]
+
+    def get_name(self, position: int) -> str:
+        start, end = self._name_offsets[position], self._name_offsets[position + 1]
+        return _decode(bytes(self._name_data[start:end]))
+
+    def is_explicit(self, position: int) -> bool:
+        return bool(self._flags[position] & _EXPLICIT)
+
+    def get_mtime(self, position: int) -> float:
+        return self._mtimes[position]
+
+    def set_mtime(self, position: int, mtime: float):
+        self._mtimes[position] = mtime
+
+    @staticmethod
+    def _hash(directory_id: int, name: str) -> int:
+        return hash((directory_id, os.path.normcase(name)))
+
+    def _find(self, directory_id: int, name: str, name_hash: int):
+        """
+        Returns the index slot of a file and its position, or the free slot and _EMPTY.
+        """
+        mask = len(self._index) - 1
+        slot = name_hash & mask
+        normalized = None
+        while True:
+            position = self._index[slot]
+            if position == _EMPTY:
+                return slot, _EMPTY
+            if self._hashes[position] == name_hash and self._directory_ids[position] == directory_id:
+                if normalized is None:
+                    normalized = os.path.normcase(name)
+                if os.path.normcase(self.get_name(position)) == normalized:
+                    return slot, position
+            slot = (slot + 1) & mask
+
+    def _find_free_slot(self, name_hash: int) -> int:
+        mask = len(self._index) - 1
+        slot = name_hash & mask
+        while self._index[slot] != _EMPTY:
+            slot = (slot + 1) & mask
+        return slot
+
+    def _grow(self):
+        size = len(self._index) * 2
+        self._index = array("q", [_EMPTY]) * size
+        for position, name_hash in enumerate(self._hashes):
+            self._index[self._find_free_slot(name_hash)] = position
+
+    def _append(
+        self, directory_id: int, encoded_name: bytes, flags: int, mtime: float, name_hash: int, slot: int
+    ):
+        count = len(self._directory_ids) + 1
+        self._index[slot] = count - 1
+        self._directory_ids.append(directory_id)
+        self._name_data += encoded_name
+        self._name_offsets.append(len(self._name_data))
+        self._flags.append(flags)
+        self._mtimes.append(mtime)
+        self._hashes.append(name_hash)
+        # Keeps the load factor below 2/3 so probe sequences stay short
+        if count * 3 >= len(self._index) * 2:
+            self._grow()
+
+    def add_file(self, directory: str, name: str, explicit: bool = False, mtime: float = 0.0) -> bool:
+        """
+        Adds a file by its directory and name, without building the full path.
+        Returns False if the file is already in the table.
+        """
+        directory_id = self.interner.intern(directory)
+        name_hash = self._hash(directory_id, name)
+        slot, position = self._find(directory_id, name, name_hash)
+        if position != _EMPTY:
+            if explicit:
+                self._flags[position] |= _EXPLICIT
+            return False
+        self._append(directory_id, _encode(name), _EXPLICIT if explicit else 0, mtime, name_hash, slot)
+        return True
+
+    def add(self, path: str, explicit: bool = False, mtime: float = 0.0) -> bool:
+        """
+        Adds a file by its path. Returns False if the file is already in the table.
+        """
+        directory, name = os.path.split(path)
+        return self.add_file(directory, name, explicit, mtime)
+
+    def contains_file(self, directory: str, name: str) -> bool:
+        directory_id = self.interner.find(directory)
+        if directory_id is None:
+            return False
+        return self._find(directory_id, name, self._hash(directory_id, name))[1] != _EMPTY
+
+    def take(self, positions: Iterable[int]) -> "PathTable":
+        """
+        Returns a new table with the files at the given positions in that order, sharing
+        the interned directories. Files are copied without decoding their names.
+        """
+        table = PathTable(self.interner)
+        # Entries of this table are unique, only repeated positions need to be skipped
+        taken = bytearray(len(self))
+        for position in positions:
+            if taken[position]:
+                continue
+            taken[position] = 1
+            start, end = self._name_offsets[position], self._name_offsets[position + 1]
+            name_hash = self._hashes[position]
+            table._append(
+                self._directory_ids[position],
+                self._name_data[start:end],
+                self._flags[position],
+                self._mtimes[position],
+                name_hash,
+                table._find_free_slot(name_hash),
+            )
+        return table
@@ -0,0 +1,296 @@
+import os
+from array import array
+from typing import TYPE_CHECKING, Iterable, List, Optional
+from phototag_settings import METADATA_SKIP_COMPLETE, METADATA_WRITE, PhototagSettingsSnapshot
+from phototag_paths import PathTable
+from supported_extensions import SUPPORTED_EXTENSIONS
+
+if TYPE_CHECKING:
+    from phototag_fingerprint import FingerprintIndex
+
+
+class FileSelection:
+    """
+    The files of a selection after filtering unsupported extensions and removing
+    files that are selected more than once.
+    """
+
+    def __init__(self):
+        # Files selected directly rather than through a folder are marked explicit
+        self.files = PathTable()
+        self.unsupported = 0
+        # Same path reached through a selected file and a selected folder, or nested folders
+        self.overlapping = 0
+        # Same file on disk reached through different paths, e.g. symlinks
+        self.duplicates = 0
+        # Whether the files were stat'ed and their modification times are known
+        self.has_mtimes = False
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+
+class TaggingPlan:
+    """
+    The result of planning a tagging run without uploading anything.
+    """
+
+    def __init__(self, selection: FileSelection, presets: List[PhototagSettingsSnapshot]):
+        self.selection = selection
+        self.presets = presets
+        self.files = PathTable(selection.files.interner)
+        self.already_tagged = 0
+        # Tagged with the same settings by an earlier run and not modified since
+        self.unchanged = 0
+        # Requests not sent because the embedded metadata already covers the preset
+        self.covered_by_metadata = 0
+        self.credits: Optional[int] = None
+        self.seconds_per_request: Optional[float] = None
+
+    @property
+    def request_count(self) -> int:
+        """
+        Number of API requests, one per file and preset unless the embedded metadata
+        already covers the preset. Each request costs one credit.
+        """
+        return len(self.files) * len(self.presets) - self.covered_by_metadata
+
+    @property
+    def estimated_seconds(self) -> Optional[float]:
+        if self.seconds_per_request is None:
+            return None
+        return self.request_count * self.seconds_per_request
+
+    @property
+    def exceeds_credits(self) -> bool:
+        return self.credits is not None and self.request_count > self.credits
+
+    def get_report(self) -> str:
+        """
+        Returns a human readable summary of the plan, lines are separated with <br>.
+        """
+        lines = [
+            f"Supported files: {len(self.selection) + self.selection.duplicates + self.selection.overlapping}",
+            f"Unsupported files skipped: {self.selection.unsupported}",
+            f"Selected more than once: {self.selection.overlapping}",
+            f"Duplicate files skipped: {self.selection.duplicates}",
+            f"Unchanged since last run{'' if self.skips_tagged_files() else ' (not skipped)'}: {self.unchanged}",
+            f"Already tagged{'' if self.skips_tagged_files() else ' (not skipped)'}: {self.already_tagged}",
+            f"Files to send: {len(self.files)}",
+            f"Covered by embedded metadata: {self.covered_by_metadata}",
+            f"Requests ({len(self.presets)} settings): {self.request_count}",
+        ]
+        if self.credits is not None:
+            lines.append(f"Available credits: {self.credits}")
+        estimated = self.estimated_seconds
+        if estimated is not None:
+            lines.append(f"Estimated duration: {format_duration(estimated)}")
+        return "<br>".join(lines)
+
+    def skips_tagged_files(self) -> bool:
+        return any(settings.skip_tagged_files for settings in self.presets)
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Formats a duration in seconds as e.g. "1h 05m" or "42s".
+    """
+    seconds = int(round(seconds))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+def collect_files(
+    selected_files: Iterable[str], selected_folders: Iterable[str], stat_files: bool = False
+) -> FileSelection:
+    """
+    Collects all supported files from the selected files and folders.
+    Files that are selected more than once are only returned once.
+
+    Files are only stat'ed with stat_files, e.g. for a dry run. Then files reached through
+    different paths are recognized by their inode, including hard links, and the
+    modification times are recorded. Otherwise only paths that may lead through a symlink
+    are resolved, i.e. selected files, symlinks and the contents of symlinked folders.
+
+    Args:
+        selected_files: Paths of the selected files
+        selected_folders: Paths of the selected folders, scanned recursively
+        stat_files: Whether to stat every file
+
+    Returns:
+        FileSelection with the files in selection order and the skip counts
+    """
+    selection = FileSelection()
+    selection.has_mtimes = stat_files
+    files = selection.files
+    # Device and inode packed into one int, much smaller than a tuple per file
+    seen_files = set()
+    # Resolved paths of the files reached through a path that may contain a symlink
+    resolved_paths = set()
+
+    def add(directory: str, name: str, explicit: bool = False, indirect: bool = False):
+        if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+            selection.unsupported += 1
+            return
+        if files.contains_file(directory, name):
+            selection.overlapping += 1
+            return
+        mtime = 0.0
+        if stat_files:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+                # st_ino is 0 on file systems that don't support it
+                file_id = (stat.st_dev << 64) | stat.st_ino if stat.st_ino else None
+                mtime = stat.st_mtime
+            except OSError:
+                file_id = None
+            if file_id is not None:
+                if file_id in seen_files:
+                    selection.duplicates += 1
+                    return
+                seen_files.add(file_id)
+        elif indirect:
+            path = os.path.realpath(os.path.join(directory, name))
+            resolved = os.path.normcase(path)
+            if resolved in resolved_paths or path in files:
+                selection.duplicates += 1
+                return
+            resolved_paths.add(resolved)
+        elif resolved_paths and os.path.normcase(os.path.join(directory, name)) in resolved_paths:
+            selection.duplicates += 1
+            return
+        # Kept for the scheduler, so ordering by date doesn't stat every file again
+        files.add_file(directory, name, explicit, mtime)
+
+    for file_path in selected_files:
+        add(*os.path.split(file_path), explicit=True, indirect=True)
+    for folder in selected_folders:
+        linked = os.path.normcase(os.path.realpath(folder)) != os.path.normcase(os.path.abspath(folder))
+        # Like os.walk, but the entries tell which files are symlinks without a stat
+        folders = [folder]
+        while folders:
+            directory = folders.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            subfolders = []
+            for entry in entries:
+                try:
+                    is_symlink = entry.is_symlink()
+                    if entry.is_dir():
+                        # Symlinked folders are not followed, like os.walk does by default
+                        if not is_symlink:
+                            subfolders.append(entry.path)
+                        continue
+                except OSError:
+                    is_symlink = False
+                add(directory, entry.name, indirect=linked or is_symlink)
+            # Top-down in the order of the entries, like os.walk
+            folders.extend(reversed(subfolders))
+    return selection
+
+
+def read_mtimes(files: PathTable):
+    """
+    Records the modification times of files collected without stat_files, e.g. before
+    ordering the files of a plan by date.
+    """
+    for position, file_path in enumerate(files):
+        try:
+            files.set_mtime(position, os.path.getmtime(file_path))
+        except OSError:
+            pass
+
+
+def is_tagged(database, file_path: str, attribute_names: List[str]) -> bool:
+    """
+    Returns True if all given attributes already have a value on the file.
+    """
+    for attribute_name in attribute_names:
+        try:
+            if not database.attributes.get_attribute_value(file_path, attribute_name):
+                return False
+        except Exception:
+            return False
+    return True
+
+
+def is_unchanged(index: "FingerprintIndex", file_path: str, presets: List[PhototagSettingsSnapshot]) -> bool:
+    """
+    Returns True if the file was tagged with all presets and not modified since.
+    Only memoized fingerprints are used, so no file content is read.
+    """
+    fingerprint = index.get_fingerprint(file_path, read_content=False)
+    if not fingerprint:
+        return False
+    return all(index.is_tagged(file_path, fingerprint, settings.fingerprint) for settings in presets)
+
+
+def plan_tagging(
+    selection: FileSelection,
+    presets: List[PhototagSettingsSnapshot],
+    database,
+    tagged_attribute_names: List[str],
+    check_tagged: bool,
+    credits: Optional[int] = None,
+    seconds_per_request: Optional[float] = None,
+    index: Optional["FingerprintIndex"] = None,
+) -> TaggingPlan:
+    """
+    Runs the selection and filter pipeline of a tagging run without uploading anything.
+    The embedded metadata of the files is read if a preset skips files it covers.
+
+    Args:
+        selection: Files collected with collect_files
+        presets: Settings presets that will be applied
+        database: Anchorpoint database instance to check for existing attributes
+        tagged_attribute_names: Attributes a file must have to count as already tagged
+        check_tagged: Whether to look up existing attributes at all
+        credits: Available credits, if known
+        seconds_per_request: Recent throughput, used to estimate the duration
+        index: Fingerprint index to recognize files tagged by earlier runs without reading them
+
+    Returns:
+        TaggingPlan with the files that would be sent
+    """
+    plan = TaggingPlan(selection, presets)
+    plan.credits = credits
+    plan.seconds_per_request = seconds_per_request
+    skip_tagged = plan.skips_tagged_files()
+
+    # Positions in the selection, the plan shares its interned directories
+    positions = array("I")
+    for position, file_path in enumerate(selection.files):
+        if check_tagged and index and is_unchanged(index, file_path, presets):
+            plan.unchanged += 1
+            if skip_tagged:
+                continue
+            positions.append(position)
+            continue
+        if check_tagged and tagged_attribute_names and is_tagged(
+            database, file_path, tagged_attribute_names
+        ):
+            plan.already_tagged += 1
+            if skip_tagged:
+                continue
+        positions.append(position)
+    plan.files = selection.files.take(positions)
+
+    # Presets that skip the request when the embedded metadata is complete
+    skipping = [
+        settings for settings in presets if settings.embedded_metadata in (METADATA_WRITE, METADATA_SKIP_COMPLETE)
+    ]
+    if skipping:
+        from phototag_metadata import read_embedded_metadata
+
+        for file_path in plan.files:
+            metadata = read_embedded_metadata(file_path)
+            if metadata:
+                plan.covered_by_metadata += sum(1 for settings in skipping if metadata.is_complete(settings))
+    return plan
@@ -0,0 +1,355 @@
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING, Optional, Union
+import apsync as aps
+from phototag_embedded_preview import extract_embedded_preview, has_embedded_preview_format
+from phototag_mesh_preview import (
+    MAX_MESH_BYTES,
+    get_render_timeout,
+    has_mesh_preview_format,
+    is_3d_file,
+    render_mesh_preview,
+)
+
+if TYPE_CHECKING:
+    from phototag_compute import ComputeBackend
+    from phototag_fingerprint import FingerprintIndex
+
+PREVIEW_DIR = os.path.join(tempfile.gettempdir(), "anchorpoint", "phototag_ai", "previews")
+PREVIEW_CACHE_DIR = os.path.join(tempfile.gettempdir(), "anchorpoint", "phototag_ai", "preview_cache")
+# The least recently used previews are removed above this size, unused ones after this age
+PREVIEW_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+PREVIEW_CACHE_MAX_AGE = 30 * 24 * 3600
+
+# aps.generate_thumbnail is much slower for 3D files, they are rendered with a timeout
+RENDER_WORKERS = 2
+RENDER_BYTES_PER_SECOND = 5 * 1024 * 1024
+
+_render_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_render_pool_lock = threading.Lock()
+
+
+class Preview:
+    """
+    An encoded preview image held in memory. The buffer is passed between the pipeline
+    stages and into the multipart body without being copied or written to disk.
+    """
+
+    __slots__ = ("name", "data", "content_type", "source")
+
+    def __init__(
+        self,
+        name: str,
+        data: Union[bytes, bytearray, memoryview],
+        content_type: str = "image/png",
+        source: str = "rendered",
+    ):
+        self.name = name
+        self.data = memoryview(data)
+        self.content_type = content_type
+        # "thumbnail", "cache", "embedded" or "rendered", only rendered previews are
+        # not reported as cache hits in the progress
+        self.source = source
+
+    def __len__(self) -> int:
+        return self.data.nbytes
+
+
+def get_preview_name(file_path: str, extension: str = ".png") -> str:
+    """
+    Returns the file name sent with a preview. It is derived from the original file so that
+    "Use File Name for Context" sees the same name however the preview was produced.
+    """
+    return os.path.splitext(os.path.basename(file_path))[0] + extension
+
+
+def read_buffer(file_path: str) -> bytearray:
+    """
+    Reads a file into a preallocated buffer with a single readinto call.
+    """
+    with open(file_path, "rb", buffering=0) as f:
+        buffer = bytearray(os.fstat(f.fileno()).st_size)
+        view = memoryview(buffer)
+        read = 0
+        while read < len(buffer):
+            count = f.readinto(view[read:])
+            if not count:
+                break
+            read += count
+    return buffer if read == len(buffer) else buffer[:read]
+
+
+class PreviewCache:
+    """
+    Persists generated previews so that files without an Anchorpoint thumbnail don't need
+    to be rendered again on the next run. Entries are keyed by the content fingerprint if
+    an index is given, so moved and copied files reuse the preview. Otherwise they are keyed
+    by path, size and modification time. Either way a changed file gets a new preview.
+
+    The modification time of an entry is its last use. The cache is pruned to max_bytes
+    with the least recently used entries removed first, and entries unused for max_age
+    seconds are removed, when the first preview of a run is stored and after every
+    quarter of max_bytes written.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = PREVIEW_CACHE_DIR,
+        max_preview_size: int = 4 * 1024 * 1024,
+        index: Optional["FingerprintIndex"] = None,
+        max_bytes: int = PREVIEW_CACHE_MAX_BYTES,
+        max_age: float = PREVIEW_CACHE_MAX_AGE,
+    ):
+        self.cache_dir = cache_dir
+        self.max_preview_size = max_preview_size
+        self.index = index
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Bytes written since the last prune, None until the first preview is stored
+        self._written: Optional[int] = None
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_key(self, file_path: str) -> Optional[str]:
+        if self.index:
+            fingerprint = self.index.get_fingerprint(file_path)
+            return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest() if fingerprint else None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        key = f"{os.path.normcase(os.path.abspath(file_path))}|{stat.st_size}|{stat.st_mtime_ns}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".png")
+
+    def get(self, file_path: str) -> Optional[Preview]:
+        key = self._get_key(file_path)
+        if not key:
+            return None
+        path = self._get_path(key)
+        try:
+            data = read_buffer(path)
+        except OSError:
+            return None
+        try:
+            # Marks the entry as recently used, access times are often not updated
+            os.utime(path)
+        except OSError:
+            pass
+        return Preview(get_preview_name(file_path), data, source="cache")
+
+    def put(self, file_path: str, preview: Preview) -> bool:
+        """
+        Persists a preview. Returns False if the preview is not worth caching.
+        """
+        key = self._get_key(file_path)
+        if not key or len(preview) == 0 or len(preview) > self.max_preview_size:
+            return False
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(preview.data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Failed to cache preview for {file_path}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False
+
+        with self._lock:
+            prune = self._written is None or self._written + len(preview) >= self.max_bytes // 4
+            self._written = 0 if prune else self._written + len(preview)
+        if prune:
+            self.prune()
+        return True
+
+    def prune(self) -> int:
+        """
+        Removes entries unused for max_age seconds, then the least recently used ones
+        until the cache fits into max_bytes. Returns the number of removed entries.
+        """
+        entries = []
+        try:
+            folders = [entry.path for entry in os.scandir(self.cache_dir) if entry.is_dir()]
+            for folder in folders:
+                for entry in os.scandir(folder):
+                    # Also left over temporary files of crashed runs
+                    if entry.is_file():
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            print(f"Failed to prune preview cache: {e}")
+            return 0
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        expired = time.time() - self.max_age
+        removed = 0
+        for mtime, size, path in entries:
+            if mtime >= expired and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        return removed
+
+
+def generate_preview(file_path: str, temp_dir: str = PREVIEW_DIR) -> Optional[Preview]:
+    """
+    Renders a preview with aps.generate_thumbnail into a private folder, loads it into
+    memory and removes the rendered files again.
+    """
+    os.makedirs(temp_dir, exist_ok=True)
+    output_dir = tempfile.mkdtemp(dir=temp_dir)
+    try:
+        if not aps.generate_thumbnail(file_path, output_dir, with_detail=True, with_preview=True):
+            return None
+        # The detail thumbnail is named <name>_dt.png, fall back to any rendered image
+        rendered = sorted(os.listdir(output_dir), key=lambda name: not name.endswith("_dt.png"))
+        if not rendered:
+            return None
+        return Preview(get_preview_name(file_path), read_buffer(os.path.join(output_dir, rendered[0])))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def get_render_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Returns the process-wide threads that render 3D previews, created on first use.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = concurrent.futures.ThreadPoolExecutor(
+                RENDER_WORKERS, thread_name_prefix="phototag_render"
+            )
+        return _render_pool
+
+
+def replace_render_pool(pool: concurrent.futures.ThreadPoolExecutor):
+    """
+    Drops a pool with a hung render, so later renders start on new threads instead of
+    waiting behind it. The hung thread exits when aps.generate_thumbnail returns.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False)
+
+
+def generate_3d_preview(file_path: str) -> Optional[Preview]:
+    """
+    Renders the preview of a 3D file with a timeout that grows with the file size.
+    A render that times out can't be stopped, its pool is replaced so it only blocks
+    the thread it runs on.
+    """
+    try:
+        timeout = get_render_timeout(os.path.getsize(file_path), RENDER_BYTES_PER_SECOND)
+    except OSError:
+        return None
+    pool = get_render_pool()
+    future = pool.submit(generate_preview, file_path)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        # Also when the render didn't start, then the renders ahead of it are stuck
+        future.cancel()
+        replace_render_pool(pool)
+        print(f"Rendering the preview of {file_path} timed out after {int(timeout)} seconds")
+        return None
+
+
+def submit_mesh_preview(file_path: str, backend) -> Optional[concurrent.futures.Future]:
+    """
+    Starts rendering the contact sheet of an OBJ, STL, PLY or GLB file on a compute backend.
+    Returns None if the file is too large or can't be read.
+    """
+    try:
+        if os.path.getsize(file_path) > MAX_MESH_BYTES:
+            return None
+        data = read_buffer(file_path)
+    except OSError as e:
+        print(f"Failed to read {file_path}: {e}")
+        return None
+    return backend.submit(render_mesh_preview, data, os.path.splitext(file_path)[1])
+
+
+def finish_mesh_preview(
+    file_path: str,
+    future: Optional[concurrent.futures.Future],
+    cache: Optional[PreviewCache] = None,
+    backend: Optional["ComputeBackend"] = None,
+) -> Optional[Preview]:
+    """
+    Waits for a contact sheet from submit_mesh_preview, with a timeout that grows with the
+    file size, and caches it. Falls back to aps.generate_thumbnail if the mesh couldn't be
+    parsed, but not if it timed out. A render that timed out while running can't be
+    cancelled, then the workers of the backend it was submitted to are recycled.
+    """
+    data = None
+    if future:
+        try:
+            timeout = get_render_timeout(os.path.getsize(file_path))
+            data = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            if not future.cancel() and backend:
+                backend.recycle()
+            print(f"Rendering the preview of {file_path} timed out")
+            return None
+        except Exception as e:
+            print(f"Failed to render preview of {file_path}: {e}")
+    if data:
+        preview = Preview(get_preview_name(file_path), data)
+    else:
+        preview = generate_3d_preview(file_path)
+    if preview and cache:
+        cache.put(file_path, preview)
+    return preview
+
+
+def load_preview(file_path: str, cache: Optional[PreviewCache] = None, render: bool = True) -> Optional[Preview]:
+    """
+    Returns the preview of a file as an in-memory buffer. Existing Anchorpoint thumbnails
+    are used first, then the preview cache, then the JPEG preview embedded in RAW, PSD and
+    HEIC files, and only then a new preview is rendered. With render disabled, None is
+    returned instead, e.g. to render a mesh with submit_mesh_preview.
+    """
+    thumbnail_path = aps.get_thumbnail(file_path, False)
+    if thumbnail_path:
+        try:
+            return Preview(get_preview_name(file_path), read_buffer(thumbnail_path), source="thumbnail")
+        except OSError:
+            pass
+
+    if cache:
+        preview = cache.get(file_path)
+        if preview:
+            return preview
+
+    if has_embedded_preview_format(file_path):
+        data = extract_embedded_preview(file_path)
+        if data:
+            # Cheap to extract again, so it isn't written to the preview cache
+            return Preview(get_preview_name(file_path, ".jpg"), data, "image/jpeg", source="embedded")
+
+    if not render:
+        return None
+    preview = generate_3d_preview(file_path) if is_3d_file(file_path) else generate_preview(file_path)
+    if preview and cache:
+        cache.put(file_path, preview)
+    return preview
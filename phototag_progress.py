@@ -0,0 +1,129 @@
+import collections
+import json
+import time
+from typing import Callable, Optional, TextIO
+from phototag_planner import format_duration
+
+
+class ProgressReporter:
+    """
+    Collects the progress of a tagging run and forwards it to the Anchorpoint progress
+    dialog at most a few times per second. Throughput and ETA are computed from a moving
+    window, so they follow the current speed rather than the average of the whole run.
+    The same updates can be written as JSON lines for headless runs.
+    """
+
+    def __init__(
+        self,
+        total: int,
+        progress=None,
+        stream: Optional[TextIO] = None,
+        min_interval: float = 0.25,
+        window: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.total = total
+        self.progress = progress
+        self.stream = stream
+        self.min_interval = min_interval
+        self.window = window
+        self.clock = clock
+
+        self.stage = "Starting"
+        self.done = 0
+        self.cache_hits = 0
+        self.skipped = 0
+        self.errors = 0
+
+        self.start_time = clock()
+        self._last_update = 0.0
+        self._samples = collections.deque([(self.start_time, 0)])
+
+    def set_stage(self, stage: str):
+        """
+        Sets the stage shown with the next update. Doesn't send an update by itself,
+        since the stage changes several times per file.
+        """
+        self.stage = stage
+
+    def file_done(self, count: int = 1):
+        self.done += count
+        self.update()
+
+    def add_cache_hit(self):
+        self.cache_hits += 1
+
+    def add_skip(self):
+        self.skipped += 1
+
+    def add_error(self):
+        self.errors += 1
+
+    def get_rate(self) -> float:
+        """
+        Returns the files per second over the moving window.
+        """
+        now = self.clock()
+        while len(self._samples) > 1 and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        start_time, start_done = self._samples[0]
+        elapsed = now - start_time
+        if elapsed <= 0:
+            return 0.0
+        return (self.done - start_done) / elapsed
+
+    def get_eta(self) -> Optional[float]:
+        """
+        Returns the estimated remaining seconds, or None while the rate is unknown.
+        """
+        rate = self.get_rate()
+        if rate <= 0:
+            return None
+        return (self.total - self.done) / rate
+
+    def get_message(self) -> str:
+        eta = self.get_eta()
+        parts = [
+            f"{self.stage}: {self.done}/{self.total}",
+            f"{self.get_rate():.1f} files/s",
+            f"ETA {format_duration(eta) if eta is not None else '-'}",
+            f"{self.cache_hits} cached, {self.skipped} skipped, {self.errors} errors",
+        ]
+        return " | ".join(parts)
+
+    def to_dict(self) -> dict:
+        eta = self.get_eta()
+        return {
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "files_per_second": round(self.get_rate(), 3),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "cache_hits": self.cache_hits,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "elapsed_seconds": round(self.clock() - self.start_time, 1),
+        }
+
+    def update(self, force: bool = False):
+        """
+        Sends the current state to the progress dialog and the stream, unless the last
+        update was less than min_interval seconds ago.
+        """
+        now = self.clock()
+        if not force and now - self._last_update < self.min_interval:
+            return
+        self._last_update = now
+        self._samples.append((now, self.done))
+
+        if self.progress:
+            if self.total:
+                self.progress.report_progress(self.done / self.total)
+            self.progress.set_text(self.get_message())
+        if self.stream:
+            self.stream.write(json.dumps(self.to_dict()) + "\n")
+            self.stream.flush()
+
+    def finish(self, stage: str = "Finished"):
+        self.stage = stage
+        self.update(force=True)
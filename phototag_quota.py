@@ -0,0 +1,291 @@
+import datetime
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+import anchorpoint as ap
+import apsync as aps
+from phototag_lock import FileLock
+from phototag_settings import SNAPSHOT_MAX_AGE
+from phototag_settings_list import get_settings_list
+
+QUOTA_DIR = os.path.join(tempfile.gettempdir(), "anchorpoint", "phototag_ai", "quota")
+
+# Seconds the bucket of a member can fill up, allows short bursts after a pause
+BURST_SECONDS = 10.0
+# Seconds between publishing the daily count of this machine to the workspace
+SHARED_SYNC_INTERVAL = 30.0
+USAGE_SETTINGS = "phototag_ai_usage"
+
+_quota: Optional["MemberQuota"] = None
+_quota_loaded_at = 0.0
+_quota_lock = threading.Lock()
+
+
+def parse_member_quotas(text: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Parses per-member limits like "anna@studio.com = 120, 5000; ben@studio.com = 30, 500"
+    into a map of lowercase email to requests per minute and daily budget. 0 means unlimited.
+    """
+    quotas = {}
+    for entry in text.replace("\n", ";").split(";"):
+        if "=" not in entry:
+            continue
+        user, limits = entry.split("=", 1)
+        values = [value.strip() for value in limits.split(",")]
+        try:
+            rate = int(values[0] or 0)
+            budget = int(values[1] or 0) if len(values) > 1 else 0
+        except ValueError:
+            print(f"Invalid member quota: {entry.strip()}")
+            continue
+        quotas[user.strip().lower()] = (max(0, rate), max(0, budget))
+    return quotas
+
+
+def get_user_key(user: str) -> str:
+    return hashlib.sha1(user.lower().encode("utf-8")).hexdigest()
+
+
+class SharedUsage:
+    """
+    Daily request counts of the members in the workspace shared settings, so the budget
+    of a member covers all machines they use. Each machine writes its count to its own key,
+    "<user key>:<machine>", so machines updating at the same time don't overwrite each
+    other. The names of the machines of a member are listed under "<user key>:machines".
+    """
+
+    def __init__(self, workspace_id: str):
+        self.workspace_id = workspace_id
+
+    def exchange(self, user: str, machine: str, day: str, used: int) -> int:
+        """
+        Publishes the count of this machine and returns the sum of the other machines.
+        """
+        shared_settings = aps.SharedSettings(self.workspace_id, USAGE_SETTINGS)
+        user_key = get_user_key(user)
+        changed = False
+
+        machines = shared_settings.get(f"{user_key}:machines", [])
+        machines = [str(name) for name in machines] if isinstance(machines, list) else []
+        if machine not in machines:
+            # Lost if another machine adds itself at the same time, then it is added
+            # again on the next exchange. The counts themselves are never lost.
+            machines.append(machine)
+            shared_settings.set(f"{user_key}:machines", machines)
+            changed = True
+
+        count = json.dumps({"day": day, "used": used})
+        if shared_settings.get(f"{user_key}:{machine}", "") != count:
+            shared_settings.set(f"{user_key}:{machine}", count)
+            changed = True
+        if changed:
+            shared_settings.store()
+
+        others = 0
+        for name in machines:
+            if name == machine:
+                continue
+            try:
+                usage = json.loads(str(shared_settings.get(f"{user_key}:{name}", "") or "{}"))
+            except ValueError:
+                continue
+            if isinstance(usage, dict) and usage.get("day") == day:
+                others += int(usage.get("used", 0))
+        return others
+
+
+class MemberQuota:
+    """
+    Fair-share limits for one workspace member: a token bucket for the request rate and
+    a budget of requests per day. The state is a small file guarded by a cross-process
+    lock, so all actions of the member on this machine, e.g. a manual run and a watched
+    folder, share the same limits.
+
+    The request rate applies per machine. With shared usage, the daily counts of all
+    machines of the member are exchanged every SHARED_SYNC_INTERVAL seconds, so the budget
+    covers all of them, give or take the requests of one interval.
+    """
+
+    def __init__(
+        self,
+        user: str,
+        requests_per_minute: int = 0,
+        daily_budget: int = 0,
+        state_dir: str = QUOTA_DIR,
+        shared: Optional[SharedUsage] = None,
+        machine: Optional[str] = None,
+    ):
+        self.user = user
+        self.requests_per_minute = requests_per_minute
+        self.daily_budget = daily_budget
+        self.shared = shared if daily_budget else None
+        self.machine = machine or platform.node() or "local"
+        self.state_path = os.path.join(state_dir, get_user_key(user) + ".json")
+        self._lock = FileLock(self.state_path + ".lock")
+        # The FileLock object is not reentrant, threads of this process queue here first
+        self._thread_lock = threading.Lock()
+        self._synced_at = 0.0
+
+    @property
+    def unlimited(self) -> bool:
+        return not self.requests_per_minute and not self.daily_budget
+
+    @property
+    def capacity(self) -> float:
+        return max(1.0, self.requests_per_minute * BURST_SECONDS / 60)
+
+    def _update(self, function: Callable[[dict, float], object]):
+        """
+        Runs function(state, now) under the lock and stores the changed state.
+        """
+        with self._thread_lock:
+            if not self._lock.acquire(timeout=10):
+                raise TimeoutError(f"Lock {self._lock.path} is held by another process")
+            try:
+                try:
+                    with open(self.state_path, "r", encoding="utf-8") as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    state = {}
+                now = time.time()
+                today = datetime.date.today().isoformat()
+                if state.get("day") != today:
+                    state["day"] = today
+                    state["used"] = 0
+                    # Requests of the member on other machines, see SharedUsage
+                    state["others"] = 0
+                state.setdefault("others", 0)
+                state.setdefault("tokens", self.capacity)
+                state.setdefault("updated", now)
+                result = function(state, now)
+                temp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(temp_path, self.state_path)
+                return result
+            finally:
+                self._lock.release()
+
+    def reserve(self) -> Optional[float]:
+        """
+        Takes one request from the quota. Returns 0 if it may be sent now, the seconds to
+        wait before trying again if the rate is exceeded, or None if the daily budget is used up.
+        """
+        if self.unlimited:
+            return 0
+
+        def take(state: dict, now: float) -> Optional[float]:
+            if self.daily_budget and state["used"] + state["others"] >= self.daily_budget:
+                return None
+            if self.requests_per_minute:
+                rate = self.requests_per_minute / 60
+                elapsed = max(0.0, now - state["updated"])
+                state["tokens"] = min(self.capacity, state["tokens"] + elapsed * rate)
+                state["updated"] = now
+                if state["tokens"] < 1:
+                    return (1 - state["tokens"]) / rate
+                state["tokens"] -= 1
+            state["used"] += 1
+            return 0
+
+        try:
+            if not self._synced_at:
+                # Learn the usage of the other machines before the first request
+                self.sync()
+            wait = self._update(take)
+            self.sync()
+            return wait
+        except (OSError, TimeoutError) as e:
+            # The quota must not stop a run if its state can't be written
+            print(f"Failed to update member quota: {e}")
+            return 0
+
+    def sync(self, force: bool = False):
+        """
+        Exchanges the daily counts with the other machines of the member, at most once per
+        SHARED_SYNC_INTERVAL unless forced.
+        """
+        if not self.shared:
+            return
+        now = time.monotonic()
+        if not force and now - self._synced_at < SHARED_SYNC_INTERVAL:
+            return
+        self._synced_at = now
+        used, day = self._update(lambda state, _: (state["used"], state["day"]))
+        try:
+            others = self.shared.exchange(self.user, self.machine, day, used)
+        except Exception as e:
+            # Offline, the budget of this machine is still enforced
+            print(f"Failed to share member quota: {e}")
+            return
+
+        def store(state: dict, _: float):
+            if state["day"] == day:
+                state["others"] = others
+
+        self._update(store)
+
+    def refund(self):
+        """
+        Returns a reserved request to the daily budget, e.g. after it failed.
+        """
+        if not self.daily_budget:
+            return
+
+        def give_back(state: dict, now: float):
+            state["used"] = max(0, state["used"] - 1)
+
+        try:
+            self._update(give_back)
+        except (OSError, TimeoutError) as e:
+            print(f"Failed to update member quota: {e}")
+
+    def acquire(self, cancel: Optional[Callable[[], bool]] = None) -> bool:
+        """
+        Waits until a request may be sent. Returns False if the daily budget is used up
+        or cancel() returned True while waiting.
+        """
+        while True:
+            wait = self.reserve()
+            if wait is None:
+                return False
+            if wait <= 0:
+                return True
+            if cancel and cancel():
+                return False
+            time.sleep(min(wait, 1.0))
+
+    def get_error(self) -> str:
+        return f"The daily budget of {self.daily_budget} requests for {self.user} is used up"
+
+
+def get_member_quota(max_age: float = SNAPSHOT_MAX_AGE) -> MemberQuota:
+    """
+    Returns the limits of the current user from the workspace settings. Admins and owners
+    are unlimited unless they are listed in the per-member quotas.
+    The result is reloaded when it is older than max_age seconds.
+    """
+    global _quota, _quota_loaded_at
+    with _quota_lock:
+        now = time.monotonic()
+        if _quota is not None and now - _quota_loaded_at < max_age:
+            return _quota
+
+        ctx = ap.get_context()
+        user = str(getattr(ctx, "email", "") or getattr(ctx, "username", "") or "unknown")
+        settings_list = get_settings_list()
+        quotas = parse_member_quotas(settings_list.member_quotas)
+        if user.lower() in quotas:
+            rate, budget = quotas[user.lower()]
+        elif aps.get_workspace_access(ctx.workspace_id) == aps.AccessLevel.Member:
+            rate, budget = settings_list.member_requests_per_minute, settings_list.member_daily_budget
+        else:
+            rate, budget = 0, 0
+        _quota = MemberQuota(user, rate, budget, shared=SharedUsage(ctx.workspace_id))
+        _quota_loaded_at = now
+        return _quota
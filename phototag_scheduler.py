@@ -0,0 +1,83 @@
+from array import array
+from typing import Callable, Dict, List, Sequence
+from phototag_paths import PathTable
+
+# The queue is a sequence of positions in the PathTable of the selection, policies read
+# the properties they sort by from the table, so no object is created per file
+
+
+def selected_first(files: PathTable, order: Sequence[int]) -> Sequence[int]:
+    """
+    Explicitly selected files before the contents of selected folders.
+    """
+    selected = array("I", (position for position in order if files.is_explicit(position)))
+    selected.extend(position for position in order if not files.is_explicit(position))
+    return selected
+
+
+def newest_first(files: PathTable, order: Sequence[int]) -> Sequence[int]:
+    """
+    Most recently modified files first.
+    """
+    # Sorting in reverse keeps the order of files with the same mtime
+    return array("I", sorted(order, key=files.get_mtime, reverse=True))
+
+
+def group_by_directory(files: PathTable, order: Sequence[int]) -> Sequence[int]:
+    """
+    Keeps the files of a folder together for I/O locality. Folders are ordered by their
+    first file in the current order, so this can be combined with the other policies.
+    """
+    # Counting sort by the rank of the folder, a selection has far fewer folders than files
+    ranks: Dict[int, int] = {}
+    for position in order:
+        ranks.setdefault(files.get_directory_id(position), len(ranks))
+    starts = array("I", [0]) * (len(ranks) + 1)
+    for position in order:
+        starts[ranks[files.get_directory_id(position)] + 1] += 1
+    for rank in range(len(ranks)):
+        starts[rank + 1] += starts[rank]
+    grouped = array("I", [0]) * len(order)
+    for position in order:
+        rank = ranks[files.get_directory_id(position)]
+        grouped[starts[rank]] = position
+        starts[rank] += 1
+    return grouped
+
+
+# Policies are functions that stably reorder the queue, new ones can be registered here
+SCHEDULING_POLICIES: Dict[str, Callable[[PathTable, Sequence[int]], Sequence[int]]] = {
+    "selected_first": selected_first,
+    "newest_first": newest_first,
+    "group_by_directory": group_by_directory,
+}
+
+# File orders offered in the settings, each a list of policies from highest to lowest priority
+FILE_ORDERS: Dict[str, List[str]] = {
+    "Selection order": [],
+    "Selected files first": ["selected_first"],
+    "Newest first": ["selected_first", "newest_first"],
+    "Grouped by folder": ["selected_first", "group_by_directory"],
+}
+DEFAULT_FILE_ORDER = "Selection order"
+
+
+def schedule_files(files: PathTable, policies: List[str]) -> PathTable:
+    """
+    Orders the work queue of a tagging run.
+
+    Args:
+        files: Files to tag in selection order, files the user selected directly rather
+            than through a folder are marked explicit
+        policies: Names of SCHEDULING_POLICIES, from highest to lowest priority
+
+    Returns:
+        The files in the order they should be tagged
+    """
+    if not policies:
+        return files
+    order: Sequence[int] = range(len(files))
+    # Stable reorderings applied from the lowest to the highest priority policy
+    for name in reversed(policies):
+        order = SCHEDULING_POLICIES[name](files, order)
+    return files.take(order)
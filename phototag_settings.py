@@ -1,15 +1,119 @@
 import apsync as aps
 import anchorpoint as ap
-from typing import Optional
+import hashlib
+import json
+import threading
+import time
+import types
+from typing import Any, Dict, Optional, Tuple, Union
+
+# Seconds a cached snapshot is reused before SharedSettings are read again,
+# so that changes made by other workspace members are picked up
+SNAPSHOT_MAX_AGE = 60.0
+
+# Where the results of a run are exported to, besides the Anchorpoint attributes
+EXPORT_NONE = "Don't Export"
+EXPORT_SIDECARS = "XMP Sidecars"
+EXPORT_MANIFEST = "JSON Manifest"
+EXPORT_MODES = [EXPORT_NONE, EXPORT_SIDECARS, EXPORT_MANIFEST]
+
+# How title, description and keywords already embedded in a file are used,
+# see phototag_metadata
+METADATA_IGNORE = "Ignore"
+METADATA_WRITE = "Write to Attributes"
+METADATA_CONTEXT = "Use as Context"
+METADATA_SKIP_COMPLETE = "Skip When Complete"
+METADATA_POLICIES = [METADATA_IGNORE, METADATA_WRITE, METADATA_CONTEXT, METADATA_SKIP_COMPLETE]
+DEFAULT_METADATA_POLICY = METADATA_IGNORE
+
+SNAPSHOT_FIELDS = (
+    "max_keywords",
+    "min_keywords",
+    "required_keywords",
+    "excluded_keywords",
+    "custom_context",
+    "prohibited_characters",
+    "max_description_chars",
+    "min_description_chars",
+    "max_title_chars",
+    "min_title_chars",
+    "use_file_name_for_context",
+    "single_word_keywords_only",
+    "be_creative",
+    "title_case_title",
+    "normalize_keywords",
+    "max_new_keywords",
+    "skip_tagged_files",
+    "embedded_metadata",
+    "export_results",
+    "enable_ai_title",
+    "enable_ai_description",
+    "enable_ai_tags",
+)
+
+_snapshot_cache: Dict[str, Tuple[float, "PhototagSettingsSnapshot"]] = {}
+_snapshot_lock = threading.Lock()
+
+
+def build_payload(settings) -> Optional[Dict[str, Any]]:
+    """
+    Builds the API request payload for a settings preset. The payload only depends on the
+    settings, so it is built once per run and reused for every file.
+    Only keywords are requested when neither AI-Title nor AI-Description is enabled.
+
+    Args:
+        settings: PhototagSettings or PhototagSettingsSnapshot containing API settings
+
+    Returns:
+        Dictionary with the request fields, or None if no AI attribute is enabled
+    """
+    wants_text = settings.enable_ai_title or settings.enable_ai_description
+    if not wants_text and not settings.enable_ai_tags:
+        return None
+
+    # Prepare API request payload with settings
+    payload = {
+        "keywordsOnly": not wants_text,
+        "saveFile": False,
+        "maxKeywords": settings.max_keywords,
+        "minKeywords": settings.min_keywords,
+        "requiredKeywords": settings.required_keywords,
+        "excludedKeywords": settings.excluded_keywords,
+        "customContext": settings.custom_context,
+        "prohibitedCharacters": settings.prohibited_characters,
+        "useFileNameForContext": settings.use_file_name_for_context,
+        "singleWordKeywordsOnly": settings.single_word_keywords_only,
+    }
+    if wants_text:
+        payload.update(
+            {
+                "maxDescriptionCharacters": settings.max_description_chars,
+                "minDescriptionCharacters": settings.min_description_chars,
+                "maxTitleCharacters": settings.max_title_chars,
+                "minTitleCharacters": settings.min_title_chars,
+                "beCreative": settings.be_creative,
+                "titleCaseTitle": settings.title_case_title,
+            }
+        )
+
+    # Remove None values from payload
+    return {k: v for k, v in payload.items() if v is not None}
 
 
 class PhototagSettings:
-    def __init__(self, name: str = "default"):
+    def __init__(self, name: str = "default", load: bool = True):
+        """
+        Args:
+            name: Name of the settings preset
+            load: Whether to read the values from SharedSettings. Disable it when all
+                values are assigned before storing, e.g. with copy()
+        """
         self.name = name
         self.settings = aps.SharedSettings(
             ap.get_context().workspace_id, f"phototag_ai_{name}"
         )
-        self.load()
+        if load:
+            self.load()
 
     def get(self, key: str, default: object = "") -> object:
         return self.settings.get(key, default)
@@ -17,7 +121,7 @@ class PhototagSettings:
     def set(self, key: str, value: object):
         self.settings.set(key, value)
         
-    def copy(self, another: "PhototagSettings"):
+    def copy(self, another: Union["PhototagSettings", "PhototagSettingsSnapshot"]):
         self.max_keywords = another.max_keywords
         self.min_keywords = another.min_keywords
         self.required_keywords = another.required_keywords
@@ -32,6 +136,11 @@ class PhototagSettings:
         self.single_word_keywords_only = another.single_word_keywords_only
         self.be_creative = another.be_creative
         self.title_case_title = another.title_case_title
+        self.normalize_keywords = another.normalize_keywords
+        self.max_new_keywords = another.max_new_keywords
+        self.skip_tagged_files = another.skip_tagged_files
+        self.embedded_metadata = another.embedded_metadata
+        self.export_results = another.export_results
 
         self.enable_ai_title = another.enable_ai_title
         self.enable_ai_description = another.enable_ai_description
@@ -55,6 +164,17 @@ class PhototagSettings:
     be_creative: bool
     title_case_title: bool
 
+    # Local keyword post-processing
+    normalize_keywords: bool
+    max_new_keywords: Optional[int]
+
+    # File selection
+    skip_tagged_files: bool
+    # One of METADATA_POLICIES, how XMP/IPTC/EXIF metadata in the files is used
+    embedded_metadata: str
+    # One of EXPORT_MODES
+    export_results: str
+
     # Attribute settings
     enable_ai_title: bool
     enable_ai_description: bool
@@ -82,6 +202,13 @@ class PhototagSettings:
         )
         self.be_creative = bool(self.get("be_creative", False))
         self.title_case_title = bool(self.get("title_case_title", True))
+        self.normalize_keywords = bool(self.get("normalize_keywords", False))
+        self.max_new_keywords = self.get("max_new_keywords")
+        self.skip_tagged_files = bool(self.get("skip_tagged_files", False))
+        self.embedded_metadata = str(
+            self.get("embedded_metadata", DEFAULT_METADATA_POLICY)
+        )
+        self.export_results = str(self.get("export_results", EXPORT_NONE))
 
         self.enable_ai_title = bool(self.get("enable_ai_title", True))
         self.enable_ai_description = bool(self.get("enable_ai_description", True))
@@ -105,18 +232,31 @@ class PhototagSettings:
         self.set("single_word_keywords_only", self.single_word_keywords_only)
         self.set("be_creative", self.be_creative)
         self.set("title_case_title", self.title_case_title)
+        self.set("normalize_keywords", self.normalize_keywords)
+        self.set("max_new_keywords", self.max_new_keywords)
+        self.set("skip_tagged_files", self.skip_tagged_files)
+        self.set("embedded_metadata", self.embedded_metadata)
+        self.set("export_results", self.export_results)
 
         self.set("enable_ai_title", self.enable_ai_title)
         self.set("enable_ai_description", self.enable_ai_description)
         self.set("enable_ai_tags", self.enable_ai_tags)
 
         self.settings.store()
+        invalidate_settings_snapshot(self.name)
+
+    def snapshot(self, api_key: str = "") -> "PhototagSettingsSnapshot":
+        """
+        Returns an immutable copy of the settings that can be shared with worker threads.
+        """
+        return PhototagSettingsSnapshot(self, api_key)
 
     def rename(self, new_name: str):
         """
         Renames the settings and updates the SharedSettings.
         """
         old_settings = self.settings
+        invalidate_settings_snapshot(self.name)
         self.name = new_name
         self.settings = aps.SharedSettings(
             ap.get_context().workspace_id, f"phototag_ai_{new_name}"
@@ -129,3 +269,75 @@ class PhototagSettings:
         """
         self.settings.clear()
         self.settings.store()
+        invalidate_settings_snapshot(self.name)
+
+
+class PhototagSettingsSnapshot:
+    """
+    Frozen copy of a PhototagSettings preset, taken once per run.
+    Holds the API key, the prebuilt request payload and a fingerprint of everything that
+    affects the tagging result, so workers only read plain attributes. The payload is a
+    read-only view, it is shared by all requests of the preset.
+    """
+
+    __slots__ = ("name", "api_key", "payload", "fingerprint") + SNAPSHOT_FIELDS
+
+    def __init__(self, settings: PhototagSettings, api_key: str = ""):
+        set_value = object.__setattr__
+        set_value(self, "name", settings.name)
+        set_value(self, "api_key", api_key)
+        for field in SNAPSHOT_FIELDS:
+            set_value(self, field, getattr(settings, field))
+        payload = build_payload(self)
+        set_value(self, "payload", types.MappingProxyType(payload) if payload is not None else None)
+
+        values = {field: getattr(self, field) for field in SNAPSHOT_FIELDS}
+        encoded = json.dumps(values, sort_keys=True, default=str).encode("utf-8")
+        set_value(self, "fingerprint", hashlib.sha1(encoded).hexdigest())
+
+    def __setattr__(self, name: str, value: object):
+        raise AttributeError("PhototagSettingsSnapshot is immutable")
+
+    def __delattr__(self, name: str):
+        raise AttributeError("PhototagSettingsSnapshot is immutable")
+
+
+def get_settings_snapshot(
+    name: str, api_key: str = "", max_age: float = SNAPSHOT_MAX_AGE
+) -> PhototagSettingsSnapshot:
+    """
+    Returns a snapshot of the named preset from the process-wide cache.
+    SharedSettings are only read if the preset changed or the cached snapshot is too old.
+    """
+    now = time.monotonic()
+    with _snapshot_lock:
+        cached = _snapshot_cache.get(name)
+    if cached and now - cached[0] < max_age and cached[1].api_key == api_key:
+        return cached[1]
+
+    snapshot = PhototagSettings(name).snapshot(api_key)
+    with _snapshot_lock:
+        _snapshot_cache[name] = (now, snapshot)
+    return snapshot
+
+
+def cache_settings_snapshot(settings: PhototagSettings, api_key: str = "") -> PhototagSettingsSnapshot:
+    """
+    Caches a snapshot of settings that were just stored, so the next get_settings_snapshot()
+    doesn't read them back from SharedSettings.
+    """
+    snapshot = settings.snapshot(api_key)
+    with _snapshot_lock:
+        _snapshot_cache[settings.name] = (time.monotonic(), snapshot)
+    return snapshot
+
+
+def invalidate_settings_snapshot(name: Optional[str] = None):
+    """
+    Drops the cached snapshot of a preset, or of all presets if no name is given.
+    """
+    with _snapshot_lock:
+        if name is None:
+            _snapshot_cache.clear()
+        else:
+            _snapshot_cache.pop(name, None)
@@ -1,7 +1,13 @@
 import apsync as aps
 import anchorpoint as ap
+import time
 from typing import Optional, List
-from phototag_settings import PhototagSettings
+from phototag_settings import PhototagSettings, SNAPSHOT_MAX_AGE
+
+DEFAULT_MAX_CONCURRENT_UPLOADS = 16
+
+_settings_list: Optional["PhototagSettingsList"] = None
+_settings_list_loaded_at = 0.0
 
 
 class PhototagSettingsList:
@@ -17,6 +23,15 @@ class PhototagSettingsList:
         self.enabled_for_members = bool(
             self.shared_settings.get("enabled_for_members", True)
         )
+        self.keyword_synonyms = str(self.shared_settings.get("keyword_synonyms", ""))
+        self.max_concurrent_uploads = int(
+            self.shared_settings.get("max_concurrent_uploads", DEFAULT_MAX_CONCURRENT_UPLOADS)
+        )
+        # Fair-share limits for members, 0 means unlimited
+        self.member_requests_per_minute = int(self.shared_settings.get("member_requests_per_minute", 0))
+        self.member_daily_budget = int(self.shared_settings.get("member_daily_budget", 0))
+        # Overrides for single users, see phototag_quota.parse_member_quotas
+        self.member_quotas = str(self.shared_settings.get("member_quotas", ""))
 
     def get_settings_count(self) -> int:
         """
@@ -62,7 +77,7 @@ class PhototagSettingsList:
         """
         if name in self.settings_names:
             # Delete the settings data
-            settings = PhototagSettings(name)
+            settings = PhototagSettings(name, load=False)
             settings.delete()
             # Remove from list
             self.settings_names.remove(name)
@@ -118,3 +133,50 @@ class PhototagSettingsList:
         Returns whether Phototag is enabled for users.
         """
         return self.enabled_for_members
+
+    def set_keyword_synonyms(self, synonyms: str):
+        """
+        Sets the workspace synonym map used to normalize keywords.
+        """
+        self.keyword_synonyms = synonyms
+        self.shared_settings.set("keyword_synonyms", synonyms)
+        self.shared_settings.store()
+
+    def get_keyword_synonyms(self) -> str:
+        """
+        Returns the workspace synonym map used to normalize keywords.
+        """
+        return self.keyword_synonyms
+
+    def set_max_concurrent_uploads(self, count: int):
+        """
+        Sets how many uploads may be in flight at the same time.
+        """
+        self.max_concurrent_uploads = count
+        self.shared_settings.set("max_concurrent_uploads", count)
+        self.shared_settings.store()
+
+    def set_member_limits(self, requests_per_minute: int, daily_budget: int, quotas: str):
+        """
+        Sets the fair-share limits of members and the overrides for single users.
+        """
+        self.member_requests_per_minute = requests_per_minute
+        self.member_daily_budget = daily_budget
+        self.member_quotas = quotas
+        self.shared_settings.set("member_requests_per_minute", requests_per_minute)
+        self.shared_settings.set("member_daily_budget", daily_budget)
+        self.shared_settings.set("member_quotas", quotas)
+        self.shared_settings.store()
+
+
+def get_settings_list(max_age: float = SNAPSHOT_MAX_AGE) -> PhototagSettingsList:
+    """
+    Returns the process-wide settings list. It is created on first use and reloaded from
+    SharedSettings when it is older than max_age seconds.
+    """
+    global _settings_list, _settings_list_loaded_at
+    now = time.monotonic()
+    if _settings_list is None or now - _settings_list_loaded_at >= max_age:
+        _settings_list = PhototagSettingsList()
+        _settings_list_loaded_at = now
+    return _settings_list
@@ -0,0 +1,185 @@
+import itertools
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from phototag_lock import FileLock
+from phototag_preview import Preview, read_buffer
+
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), "anchorpoint", "phototag_ai", "spool")
+
+# Jobs that still fail after this many attempts or this many seconds are given up
+MAX_ATTEMPTS = 100
+MAX_AGE = 7 * 24 * 3600
+
+_counter = itertools.count()
+
+
+class SpoolJob:
+    """
+    One queued request: the preview of a file and the payload of a settings preset.
+    """
+
+    __slots__ = (
+        "id",
+        "file_path",
+        "preset",
+        "settings_fingerprint",
+        "payload",
+        "attribute_names",
+        "covered",
+        "fingerprint",
+        "export",
+        "preview_name",
+        "content_type",
+        "created",
+        "attempts",
+        "error",
+    )
+
+    def __init__(self, values: Dict[str, Any]):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+        self.covered = set(self.covered or [])
+        self.attempts = self.attempts or 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values["covered"] = sorted(self.covered)
+        return values
+
+
+class Spool:
+    """
+    Durable queue of prepared requests on the local disk. Each job is a preview file and a
+    JSON file that is written last, so a job only becomes visible once it is complete.
+    Jobs are ordered by creation time and survive restarts of Anchorpoint.
+    """
+
+    def __init__(self, spool_dir: str = SPOOL_DIR, max_attempts: int = MAX_ATTEMPTS, max_age: float = MAX_AGE):
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        self.failed_dir = os.path.join(spool_dir, "failed")
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def get_drain_lock(self) -> FileLock:
+        """
+        Returns the lock that makes sure only one process drains the spool.
+        """
+        return FileLock(os.path.join(self.spool_dir, "drain.lock"))
+
+    def _get_paths(self, job_id: str):
+        return (
+            os.path.join(self.spool_dir, job_id + ".json"),
+            os.path.join(self.spool_dir, job_id + ".bin"),
+        )
+
+    def _write_json(self, path: str, values: Dict[str, Any]):
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(values, f)
+        os.replace(temp_path, path)
+
+    def enqueue(
+        self,
+        file_path: str,
+        preview: Preview,
+        settings,
+        payload: Dict[str, Any],
+        attribute_names: Dict[str, str],
+        covered: Iterable[str] = (),
+        fingerprint: Optional[str] = None,
+        export: bool = True,
+    ) -> SpoolJob:
+        """
+        Queues a request for a file and settings preset. The result is only exported if
+        export is set, jobs queued before it was added are exported.
+        """
+        # Sortable by creation time, unique across processes
+        job_id = f"{time.time_ns():016x}-{os.getpid():x}-{next(_counter):x}"
+        job = SpoolJob(
+            {
+                "id": job_id,
+                "file_path": file_path,
+                "preset": settings.name,
+                "settings_fingerprint": settings.fingerprint,
+                "payload": dict(payload),
+                "attribute_names": attribute_names,
+                "covered": list(covered),
+                "fingerprint": fingerprint,
+                "export": export,
+                "preview_name": preview.name,
+                "content_type": preview.content_type,
+                "created": time.time(),
+            }
+        )
+        json_path, data_path = self._get_paths(job_id)
+        with open(data_path, "wb") as f:
+            f.write(preview.data)
+        self._write_json(json_path, job.to_dict())
+        return job
+
+    def get_job_ids(self) -> List[str]:
+        """
+        Returns the ids of all queued jobs, oldest first.
+        """
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith(".json"))
+
+    def __len__(self) -> int:
+        return len(self.get_job_ids())
+
+    def load(self, job_id: str) -> Optional[SpoolJob]:
+        json_path, _ = self._get_paths(job_id)
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                return SpoolJob(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def load_preview(self, job: SpoolJob) -> Optional[Preview]:
+        _, data_path = self._get_paths(job.id)
+        try:
+            return Preview(job.preview_name, read_buffer(data_path), job.content_type, source="cache")
+        except OSError:
+            return None
+
+    def retry_later(self, job: SpoolJob, error: str) -> bool:
+        """
+        Keeps a job in the queue after a failed attempt. Returns False if the job failed
+        too often or is too old and was moved to the failed folder instead.
+        """
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            self.fail(job, f"Gave up after {job.attempts} attempts: {error}")
+            return False
+        if time.time() - (job.created or 0) >= self.max_age:
+            self.fail(job, f"Gave up after {int(self.max_age / 86400)} days: {error}")
+            return False
+        job.error = error
+        json_path, _ = self._get_paths(job.id)
+        self._write_json(json_path, job.to_dict())
+        return True
+
+    def complete(self, job: SpoolJob):
+        """
+        Removes a job after its result was applied.
+        """
+        for path in self._get_paths(job.id):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def fail(self, job: SpoolJob, error: str):
+        """
+        Moves a job that can't succeed to the failed folder, without its preview.
+        """
+        job.error = error
+        self._write_json(os.path.join(self.failed_dir, job.id + ".json"), job.to_dict())
+        self.complete(job)
@@ -0,0 +1,218 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+# Irregular plurals that the suffix rules below would get wrong
+IRREGULAR_PLURALS = {
+    "people": "person",
+    "children": "child",
+    "men": "man",
+    "women": "woman",
+    "mice": "mouse",
+    "geese": "goose",
+    "teeth": "tooth",
+    "feet": "foot",
+    "leaves": "leaf",
+    "knives": "knife",
+    "wolves": "wolf",
+    "shelves": "shelf",
+    "quizzes": "quiz",
+    "movies": "movie",
+    "cookies": "cookie",
+    "zombies": "zombie",
+    "selfies": "selfie",
+}
+
+# Words ending in "s" that are not plurals. Their plurals add "es", e.g. buses -> bus
+SINGULAR_EXCEPTIONS = {
+    "news", "series", "species", "glasses", "jeans", "pants", "clothes",
+    "scissors", "physics", "mathematics", "canvas", "bus", "gas", "lens",
+    "chaos", "cosmos", "christmas", "tennis", "bias", "atlas", "iris",
+    "virus", "bonus", "campus", "census", "circus", "chorus", "genius",
+    "octopus", "status", "walrus", "cactus", "corpus",
+}
+
+# "es" is only part of the plural suffix after these endings, e.g. boxes, dishes, buzzes
+SIBILANT_ENDINGS = ("x", "ss", "sh", "ch", "zz")
+
+# Singulars that end in a sibilant and "e", so their plural only adds "s", e.g. niches
+E_SINGULARS = {"niche", "quiche", "cliche", "avalanche", "psyche", "panache", "douche"}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def parse_keyword_list(value: Optional[str]) -> List[str]:
+    """
+    Splits a comma-separated keyword setting into a list of stripped keywords.
+    """
+    if not value:
+        return []
+    return [keyword.strip() for keyword in str(value).split(",") if keyword.strip()]
+
+
+def parse_synonyms(value: Optional[str]) -> Dict[str, str]:
+    """
+    Parses the workspace synonym map.
+    The format is "canonical = synonym, synonym; canonical = synonym".
+
+    Returns:
+        Dictionary mapping each normalized synonym to its canonical keyword
+    """
+    synonyms = {}
+    if not value:
+        return synonyms
+    for entry in str(value).split(";"):
+        if "=" not in entry:
+            continue
+        canonical, aliases = entry.split("=", 1)
+        canonical = _WHITESPACE.sub(" ", canonical).strip().lower()
+        if not canonical:
+            continue
+        for alias in aliases.split(","):
+            alias = _WHITESPACE.sub(" ", alias).strip().lower()
+            if alias and alias != canonical:
+                synonyms[alias] = canonical
+    return synonyms
+
+
+def _keeps_e(singular: str) -> bool:
+    # caches, headaches and moustaches keep the "e", beaches and coaches don't
+    if singular in E_SINGULARS:
+        return True
+    return singular.endswith("ache") and (len(singular) == 4 or singular[-5] not in "aeiou")
+
+
+def singularize(word: str) -> str:
+    """
+    Reduces an English plural noun to its singular form using a small rule set.
+    """
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    if len(word) <= 3 or word in SINGULAR_EXCEPTIONS or not word.isalpha():
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("es"):
+        stem = word[:-2]
+        if stem in SINGULAR_EXCEPTIONS:
+            return stem
+        if stem.endswith(SIBILANT_ENDINGS) and not _keeps_e(word[:-1]):
+            return stem
+    if word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+class KeywordNormalizer:
+    """
+    Normalizes keywords returned by Phototag.ai before they are written as tags.
+    All matchers are compiled once per run so that normalizing a file is a few
+    dictionary lookups per keyword.
+    """
+
+    def __init__(
+        self,
+        required_keywords: Optional[str] = None,
+        excluded_keywords: Optional[str] = None,
+        prohibited_characters: Optional[str] = None,
+        synonyms: Optional[str] = None,
+        max_keywords: Optional[int] = None,
+        max_new_keywords: Optional[int] = None,
+        vocabulary: Optional[Iterable[str]] = None,
+    ):
+        self.synonyms = parse_synonyms(synonyms)
+        self.prohibited = (
+            re.compile("[" + re.escape(prohibited_characters) + "]")
+            if prohibited_characters
+            else None
+        )
+        self.max_keywords = max_keywords or None
+        self.max_new_keywords = max_new_keywords or None
+
+        # Cache of raw keyword -> normalized keyword, shared by all files of a run
+        self._cache: Dict[str, str] = {}
+        self.required = self._unique(
+            self.normalize(k) for k in parse_keyword_list(required_keywords)
+        )
+        self.excluded: Set[str] = {
+            self.normalize(k) for k in parse_keyword_list(excluded_keywords)
+        }
+        self.excluded.discard("")
+
+        # Normalized keyword -> spelling of the existing tag, so "Car" stays "Car"
+        self.vocabulary: Dict[str, str] = {}
+        for keyword in vocabulary or []:
+            normalized = self.normalize(keyword)
+            if normalized:
+                self.vocabulary.setdefault(normalized, _WHITESPACE.sub(" ", keyword).strip())
+        for keyword in self.required:
+            self.vocabulary.setdefault(keyword, keyword)
+        self.new_keywords_count = 0
+
+    @staticmethod
+    def _unique(keywords: Iterable[str]) -> List[str]:
+        seen = set()
+        result = []
+        for keyword in keywords:
+            if keyword and keyword not in seen:
+                seen.add(keyword)
+                result.append(keyword)
+        return result
+
+    def normalize(self, keyword: str) -> str:
+        """
+        Returns the canonical form of a single keyword: prohibited characters removed,
+        lowercased, whitespace collapsed, plurals reduced and synonyms resolved.
+        """
+        cached = self._cache.get(keyword)
+        if cached is not None:
+            return cached
+
+        value = keyword
+        if self.prohibited:
+            value = self.prohibited.sub("", value)
+        value = _WHITESPACE.sub(" ", value).strip().lower()
+        value = self.synonyms.get(value, value)
+        if value:
+            words = value.split(" ")
+            words[-1] = singularize(words[-1])
+            value = " ".join(words)
+            value = self.synonyms.get(value, value)
+
+        self._cache[keyword] = value
+        return value
+
+    def normalize_keywords(self, keywords: Iterable[str]) -> List[str]:
+        """
+        Normalizes the keywords of one file and enforces required keywords, excluded
+        keywords, the keyword limit and the vocabulary growth limit.
+        Keywords that match an existing tag are returned in the spelling of that tag.
+        """
+        result = [self.vocabulary[keyword] for keyword in self.required]
+        seen = set(self.required)
+        for keyword in keywords:
+            keyword = self.normalize(str(keyword))
+            if not keyword or keyword in seen or keyword in self.excluded:
+                continue
+            if self.max_keywords and len(result) >= self.max_keywords:
+                break
+            if keyword not in self.vocabulary:
+                if (
+                    self.max_new_keywords
+                    and self.new_keywords_count >= self.max_new_keywords
+                ):
+                    continue
+                self.vocabulary[keyword] = keyword
+                self.new_keywords_count += 1
+            seen.add(keyword)
+            result.append(self.vocabulary[keyword])
+        return result
+
+    def clean_text(self, text: str) -> str:
+        """
+        Removes prohibited characters and collapses whitespace in a title or description.
+        """
+        if self.prohibited:
+            text = self.prohibited.sub("", text)
+        return _WHITESPACE.sub(" ", text).strip()
@@ -0,0 +1,394 @@
+import os
+import select
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Set, Tuple
+import anchorpoint as ap
+import apsync as aps
+from phototag_ai import get_snapshots, process_files
+from phototag_local_settings import get_local_settings
+from phototag_settings_list import get_settings_list
+from supported_extensions import SUPPORTED_EXTENSIONS
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_supported_file(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+class PollingWatcher:
+    """
+    Detects new and modified files by comparing directory snapshots.
+    Used where inotify is not available.
+
+    Only the folders are checked every interval, new, renamed and deleted files change the
+    modification time of their folder. The whole tree is scanned when a folder changed and
+    otherwise to find files modified in place, less often the longer the folder is idle.
+    """
+
+    def __init__(self, folder_path: str, interval: float = 5.0, max_interval: float = 60.0):
+        self.folder_path = folder_path
+        self.interval = interval
+        self.max_interval = max_interval
+        self.scan_interval = interval
+        self.snapshot, self.directories = self._scan()
+        self.next_check = time.monotonic() + interval
+        self.next_scan = self.next_check
+
+    def _scan(self) -> Tuple[Dict[str, Tuple[int, int]], Dict[str, int]]:
+        """
+        Returns the size and mtime of every supported file and the mtime of every folder.
+        """
+        snapshot = {}
+        directory_mtimes = {}
+        directories = [self.folder_path]
+        while directories:
+            directory = directories.pop()
+            try:
+                directory_mtimes[directory] = os.stat(directory).st_mtime_ns
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                directories.append(entry.path)
+                            elif is_supported_file(entry.name):
+                                stat = entry.stat()
+                                snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return snapshot, directory_mtimes
+
+    def _directories_changed(self) -> bool:
+        for directory, mtime in self.directories.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def wait(self, timeout: float) -> Set[str]:
+        """
+        Waits up to timeout seconds and returns the files that changed since the last call.
+        """
+        remaining = self.next_check - time.monotonic()
+        if remaining > 0:
+            time.sleep(min(timeout, remaining))
+            if time.monotonic() < self.next_check:
+                return set()
+
+        now = time.monotonic()
+        self.next_check = now + self.interval
+        if now < self.next_scan and not self._directories_changed():
+            return set()
+
+        snapshot, self.directories = self._scan()
+        changed = {
+            path
+            for path, signature in snapshot.items()
+            if self.snapshot.get(path) != signature
+        }
+        self.snapshot = snapshot
+        self.scan_interval = (
+            self.interval if changed else min(self.max_interval, self.scan_interval * 2)
+        )
+        self.next_scan = time.monotonic() + self.scan_interval
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Detects new and modified files with inotify on Linux. The process sleeps in select()
+    while the folder is idle, so watching costs no CPU.
+    """
+
+    def __init__(self, folder_path: str):
+        import ctypes
+        import ctypes.util
+
+        self.folder_path = folder_path
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: Dict[int, str] = {}
+        self.start_time = time.time()
+        self._add_tree(folder_path)
+
+    def _add_watch(self, directory: str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def _add_tree(self, folder_path: str) -> Set[str]:
+        """
+        Watches a folder and all its subfolders and returns the supported files in it.
+        """
+        files = set()
+        for root, _, file_names in os.walk(folder_path):
+            self._add_watch(root)
+            for file_name in file_names:
+                if is_supported_file(file_name):
+                    files.add(os.path.join(root, file_name))
+        return files
+
+    def _rescan(self) -> Set[str]:
+        """
+        Returns the files modified since watching started, used when the event queue overflowed.
+        """
+        changed = set()
+        for path in self._add_tree(self.folder_path):
+            try:
+                if os.path.getmtime(path) >= self.start_time:
+                    changed.add(path)
+            except OSError:
+                continue
+        return changed
+
+    def wait(self, timeout: float) -> Set[str]:
+        """
+        Waits up to timeout seconds and returns the files that changed since the last call.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not buffer:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(buffer[offset : offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    changed |= self._rescan()
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                directory = self.watches.get(wd)
+                if not directory or not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    # Folders moved or copied into the watched tree bring their files along
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed |= self._add_tree(path)
+                elif is_supported_file(name):
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(folder_path: str, poll_interval: float = 5.0):
+    """
+    Returns an inotify based watcher on Linux and a polling watcher everywhere else.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder_path)
+        except Exception as e:
+            print(f"inotify not available, falling back to polling: {e}")
+    return PollingWatcher(folder_path, poll_interval)
+
+
+class DebouncedBatcher:
+    """
+    Collects changed files until they are fully written and groups them into micro-batches.
+    A file is considered written when its size and modification time didn't change for
+    settle_seconds.
+    """
+
+    def __init__(self, settle_seconds: float = 3.0, batch_size: int = 20, max_delay: float = 10.0):
+        self.settle_seconds = settle_seconds
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        # path -> (size, mtime, time of last change)
+        self.pending: Dict[str, Tuple[int, int, float]] = {}
+        self.ready: List[str] = []
+        self.ready_since: Optional[float] = None
+
+    def add(self, paths: Set[str]):
+        now = time.monotonic()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.pending.pop(path, None)
+                continue
+            self.pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+
+    def _check_pending(self, now: float):
+        for path, (size, mtime, changed_at) in list(self.pending.items()):
+            if now - changed_at < self.settle_seconds:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                self.pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+                continue
+            del self.pending[path]
+            if path not in self.ready:
+                self.ready.append(path)
+                if self.ready_since is None:
+                    self.ready_since = now
+
+    def next_timeout(self, idle_timeout: float) -> float:
+        """
+        Returns how long the watcher may sleep before the batcher needs to check again.
+        """
+        if not self.pending and not self.ready:
+            return idle_timeout
+        return min(idle_timeout, 1.0)
+
+    def take_batch(self, force: bool = False) -> List[str]:
+        """
+        Returns the next batch of written files, or an empty list if the batch is not due yet.
+        """
+        now = time.monotonic()
+        self._check_pending(now)
+        if not self.ready:
+            return []
+        due = (
+            force
+            or len(self.ready) >= self.batch_size
+            or now - self.ready_since >= self.max_delay
+            or not self.pending
+        )
+        if not due:
+            return []
+        batch = self.ready[: self.batch_size]
+        self.ready = self.ready[self.batch_size :]
+        self.ready_since = now if self.ready else None
+        return batch
+
+
+def watch_folder(folder_path: str, database, presets, settle_seconds: float = 3.0):
+    """
+    Watches a folder and tags new or modified supported files until canceled.
+
+    Args:
+        folder_path: Root folder to watch, including subfolders
+        database: Anchorpoint database instance for attribute updates
+        presets: Snapshots of the settings presets to apply to every batch
+        settle_seconds: How long a file must stay unchanged before it is tagged
+    """
+    progress = ap.Progress(
+        "Watching Folder",
+        f"Waiting for new files in {os.path.basename(folder_path)}",
+        infinite=True,
+        cancelable=True,
+    )
+    watcher = create_watcher(folder_path)
+    batcher = DebouncedBatcher(settle_seconds=settle_seconds)
+    tagged = 0
+    # The out of credits message is shown once per session, not for every batch
+    out_of_credits = False
+    try:
+        while not progress.canceled:
+            batcher.add(watcher.wait(batcher.next_timeout(1.0)))
+            batch = batcher.take_batch()
+            if not batch:
+                continue
+            progress.set_text(f"Tagging {len(batch)} new files")
+            has_credits = process_files(
+                batch, database, presets, notify=False, notify_out_of_credits=not out_of_credits
+            )
+            out_of_credits = out_of_credits or not has_credits
+            tagged += len(batch)
+            progress.set_text(
+                f"Waiting for new files in {os.path.basename(folder_path)} ({tagged} tagged"
+                + (", out of credits)" if out_of_credits else ")")
+            )
+    finally:
+        watcher.close()
+        progress.finish()
+
+
+def start_watch_callback(dialog: ap.Dialog, folder_path: str):
+    """
+    Starts watching the folder with the selected settings.
+    """
+    name = dialog.get_value("settings_name")
+    if name not in get_settings_list().get_settings_names():
+        ap.UI().show_error("Failed to load settings")
+        return
+    try:
+        settle_seconds = float(dialog.get_value("settle_seconds") or 3)
+    except ValueError:
+        ap.UI().show_error("Settle time must be a number of seconds")
+        return
+
+    local_settings = get_local_settings()
+    local_settings.last_selected = name
+    local_settings.store()
+    dialog.close()
+    ctx = ap.get_context()
+    ctx.run_async(watch_folder, folder_path, ap.get_api(), get_snapshots([name]), settle_seconds)
+
+
+def main():
+    ctx = ap.get_context()
+    access_level = aps.get_workspace_access(ctx.workspace_id)
+    if not get_settings_list().enabled_for_members and access_level == aps.AccessLevel.Member:
+        ap.UI().show_info("Restricted for members", "To better control credit usage, this feature is only available for admins. Please reach out to your workspace admin.")
+        return
+
+    folder_path = ctx.path if os.path.isdir(ctx.path) else ctx.folder
+    names = get_settings_list().get_settings_names()
+    last_selected = get_local_settings().last_selected
+    default_name = last_selected if last_selected in names else names[0]
+
+    dialog = ap.Dialog()
+    dialog.title = "Watch Folder with Phototag.ai"
+    dialog.icon = ctx.icon
+    dialog.add_text("Select Settings:").add_dropdown(
+        default_name, names, var="settings_name"
+    )
+    dialog.add_text("Settle Time (seconds):").add_input("3", var="settle_seconds", width=100)
+    dialog.add_info(
+        "New or modified files are tagged once they didn't change for the settle time.<br>"
+        "Cancel the progress to stop watching."
+    )
+    (
+        dialog.add_button("Start Watching", callback=lambda d: start_watch_callback(d, folder_path))
+        .add_button("Cancel", primary=False, callback=lambda d: d.close())
+    )
+    dialog.show()
+
+
+if __name__ == "__main__":
+    main()
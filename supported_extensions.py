@@ -3,11 +3,17 @@ SUPPORTED_EXTENSIONS = {
     '.exr', '.hdr', '.rgbe', '.ico', '.zfile', '.webp', '.pic', '.pbm', '.pgm', '.ppm', '.pnm', '.pfm',
     '.iff', '.fits', '.f3d', '.dpx', '.dcm', '.dds', '.cin', '.tx', '.tga',
     '.sgi', '.rgb', '.rgba', '.bw', '.int', '.inta', '.rla',
-    '.crw', '.cs1', '.dc2', '.dcr', '.dng', '.erf', '.fff', '.k25', '.kdc', '.mdc', '.mos', '.mrw', '.orf', '.pef', '.pxn',
+    '.cr2', '.nef', '.arw', '.crw', '.cs1', '.dc2', '.dcr', '.dng', '.erf', '.fff', '.k25', '.kdc', '.mdc', '.mos', '.mrw', '.orf', '.pef', '.pxn',
     '.raf', '.raw', '.rdc', '.sr2', '.srf', '.x3f', '.3fr', '.cine', '.ia', '.kc2', '.mef', '.nrw', '.qtk', '.rw2', '.sti', '.rwl',
     '.srw', '.drf', '.dsc', '.ptx', '.cap', '.iiq', '.rwz',
     '.max', '.obj', '.ply', '.stl', '.pts', '.step', '.stp', '.iges', '.igs', '.brep', '.abc', '.3ds', '.wrl', '.fbx', '.glb', '.gltf', '.dae', '.3mf', '.usd',
     '.usda', '.usdc', '.usdz', '.dxf',
     '.png', '.jpg', '.jpeg', '.svg', '.tiff', '.heic', '.heif',
     '.mp4','.mov','.avi','.mkv','.webm','.wmv','.flv','.mpeg','.mpg',
-} 
\ No newline at end of file
+} 
+# Camera RAW formats, their XMP sidecars replace the extension instead of adding to it
+RAW_EXTENSIONS = {
+    '.cr2', '.nef', '.arw', '.crw', '.cs1', '.dc2', '.dcr', '.dng', '.erf', '.fff', '.k25', '.kdc', '.mdc', '.mos',
+    '.mrw', '.orf', '.pef', '.pxn', '.raf', '.raw', '.rdc', '.sr2', '.srf', '.x3f', '.3fr', '.kc2', '.mef', '.nrw',
+    '.rw2', '.sti', '.rwl', '.srw', '.drf', '.dsc', '.ptx', '.cap', '.iiq', '.rwz',
+}
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+import types
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+import phototag_async_api  # noqa: E402
+from phototag_async_api import AsyncPhototagClient  # noqa: E402
+
+
+class StubServer:
+    """
+    Phototag.ai API on localhost. Answers with the next of statuses, or 200 and a result,
+    after waiting delay seconds.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = []
+        self.delay = 0.0
+        self.released = None
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    async def _handle(self, request):
+        form = await request.post()
+        upload = form["file"]
+        self.requests.append(
+            {
+                "authorization": request.headers.get("Authorization"),
+                "fields": {key: value for key, value in form.items() if key != "file"},
+                "file_name": upload.filename,
+                "content_type": upload.content_type,
+                "data": upload.file.read(),
+            }
+        )
+        if self.delay:
+            # Released early when the server is closed
+            try:
+                await asyncio.wait_for(self.released.wait(), self.delay)
+            except asyncio.TimeoutError:
+                pass
+        status = self.statuses.pop(0) if self.statuses else 200
+        if status != 200:
+            return web.Response(status=status)
+        return web.json_response({"data": {"title": "Title", "keywords": ["beach"]}})
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.released = asyncio.Event()
+        app = web.Application()
+        app.router.add_post("/api", self._handle)
+        self._runner = web.AppRunner(app)
+        self.loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self.loop.run_forever()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.released.set)
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=10)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = StubServer()
+    monkeypatch.setattr(phototag_async_api, "API_URL", f"http://127.0.0.1:{server.port}/api")
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client():
+    client = AsyncPhototagClient(max_concurrency=2)
+    yield client
+    client.close()
+
+
+SETTINGS = types.SimpleNamespace(api_key="key", payload={"maxKeywords": 10, "keywordsOnly": True})
+
+
+def test_upload_sends_payload_and_content_type(server, client):
+    result = client.submit("photo.png", memoryview(b"png data"), SETTINGS, content_type="image/png").result(10)
+    assert result["data"]["keywords"] == ["beach"]
+    request = server.requests[0]
+    assert request["authorization"] == "Bearer key"
+    assert request["fields"] == {"maxKeywords": "10", "keywordsOnly": "True"}
+    assert (request["file_name"], request["content_type"], request["data"]) == ("photo.png", "image/png", b"png data")
+
+
+def test_server_errors_are_retryable(server, client):
+    server.statuses = [503, 429, 400]
+    results = [client.submit("photo.jpg", b"jpg", SETTINGS).result(10) for _ in range(3)]
+    assert [result.get("retryable") for result in results] == [True, True, False]
+    assert all(result["error"] for result in results)
+
+
+def test_connection_errors_are_retryable(monkeypatch, client):
+    # Nothing listens on the discard port
+    monkeypatch.setattr(phototag_async_api, "API_URL", "http://127.0.0.1:9/api")
+    result = client.submit("photo.jpg", b"jpg", SETTINGS).result(10)
+    assert result["retryable"]
+
+
+def test_missing_api_key(client):
+    settings = types.SimpleNamespace(api_key="", payload={})
+    assert client.submit("photo.jpg", b"jpg", settings).result(10)["error"] == "API Key Required"
+
+
+def test_hung_request_times_out(server, monkeypatch):
+    monkeypatch.setattr(phototag_async_api, "REQUEST_TIMEOUT", 0.2)
+    server.delay = 5
+    client = AsyncPhototagClient(max_concurrency=1)
+    try:
+        result = client.submit("photo.jpg", b"jpg", SETTINGS).result(5)
+    finally:
+        client.close()
+    assert result["retryable"]
+
+
+def test_cancel_aborts_in_flight_requests(server, client):
+    server.delay = 5
+    futures = [client.submit("photo.jpg", b"jpg", SETTINGS) for _ in range(4)]
+    time.sleep(0.2)
+    start = time.monotonic()
+    client.cancel()
+    for future in futures:
+        with pytest.raises(Exception):
+            future.result(2)
+        assert future.cancelled()
+    assert time.monotonic() - start < 2
+
+
+def test_quota_exceeded(server):
+    quota = types.SimpleNamespace(
+        unlimited=False, reserve=lambda: None, refund=lambda: None, get_error=lambda: "Daily budget used up"
+    )
+    client = AsyncPhototagClient(max_concurrency=1, quota=quota)
+    try:
+        result = client.submit("photo.jpg", b"jpg", SETTINGS).result(10)
+    finally:
+        client.close()
+    assert result["quota_exceeded"]
+    assert not server.requests
+
+
+def test_close_is_idempotent(client):
+    client.close()
+    client.close()
+    assert client.loop.is_closed()
@@ -0,0 +1,138 @@
+import concurrent.futures
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import phototag_compute
+from phototag_compute import (
+    COMPUTE_PROCESSES,
+    COMPUTE_THREADS,
+    ComputeBackend,
+    ProcessComputeBackend,
+    acquire_compute_backend,
+    close_compute_backends,
+    content_hash,
+    downscale_image,
+    perceptual_hash,
+    release_compute_backend,
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_backends():
+    yield
+    close_compute_backends()
+    phototag_compute._active_runs = 0
+
+
+def test_backends_are_reused_while_in_use():
+    backend = acquire_compute_backend(COMPUTE_THREADS)
+    assert acquire_compute_backend(COMPUTE_THREADS) is backend
+    release_compute_backend(idle_seconds=0)
+    time.sleep(0.1)
+    # Still acquired by the second run
+    assert phototag_compute._backends[COMPUTE_THREADS] is backend
+    release_compute_backend(idle_seconds=60)
+    assert acquire_compute_backend(COMPUTE_THREADS) is backend
+    release_compute_backend(idle_seconds=0.01)
+    time.sleep(0.2)
+    assert not phototag_compute._backends
+
+
+def test_process_backend_reads_shared_memory():
+    backend = ProcessComputeBackend(max_workers=1)
+    try:
+        assert backend.submit(bytes, b"shared buffer").result(timeout=60) == b"shared buffer"
+        assert backend.submit(bytes, b"").result(timeout=60) == b""
+    finally:
+        backend.close()
+
+
+def hang(data: memoryview, seconds: float) -> bool:
+    time.sleep(seconds)
+    return True
+
+
+def test_recycle_thread_backend():
+    backend = ComputeBackend(max_workers=1)
+    released = threading.Event()
+    try:
+        hung = backend.submit(lambda data: released.wait(10), b"")
+        backend.recycle()
+        # Not queued behind the hung task
+        assert backend.submit(len, b"data").result(timeout=1) == 4
+        released.set()
+        assert hung.result(timeout=10)
+    finally:
+        backend.close()
+
+
+def test_recycle_process_backend():
+    backend = ProcessComputeBackend(max_workers=1)
+    try:
+        hung = backend.submit(hang, b"", 60)
+        while not hung.running():
+            time.sleep(0.05)
+        start = time.monotonic()
+        backend.recycle()
+        with pytest.raises(concurrent.futures.process.BrokenProcessPool):
+            hung.result(timeout=30)
+        assert backend.submit(len, b"data").result(timeout=60) == 4
+        assert time.monotonic() - start < 30
+    finally:
+        backend.close()
+
+
+def test_acquire_processes_backend():
+    backend = acquire_compute_backend(COMPUTE_PROCESSES)
+    assert backend.submit(len, bytearray(1000)).result(timeout=60) == 1000
+    release_compute_backend()
+
+
+def test_downscale_image():
+    Image = pytest.importorskip("PIL.Image")
+    output = io.BytesIO()
+    Image.new("RGB", (3200, 1600), "red").save(output, "PNG")
+    data = downscale_image(memoryview(output.getvalue()), max_edge=1600)
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.size == (1600, 800)
+        assert image.format == "JPEG"
+    small = io.BytesIO()
+    Image.new("RGB", (100, 100)).save(small, "PNG")
+    assert downscale_image(memoryview(small.getvalue()), max_edge=1600) is None
+
+
+def test_content_hash_on_backend():
+    backend = acquire_compute_backend(COMPUTE_THREADS)
+    first = backend.submit(content_hash, b"preview").result(timeout=60)
+    assert first == content_hash(memoryview(bytearray(b"preview")))
+    assert first != content_hash(memoryview(b"other preview"))
+    release_compute_backend()
+
+
+def test_perceptual_hash_matches_resized_copies():
+    Image = pytest.importorskip("PIL.Image")
+
+    def encode(image, image_format):
+        output = io.BytesIO()
+        image.save(output, image_format)
+        return memoryview(output.getvalue())
+
+    image = Image.linear_gradient("L").convert("RGB").resize((640, 480))
+    original = perceptual_hash(encode(image, "PNG"))
+    assert perceptual_hash(encode(image.resize((320, 240)), "JPEG")) == original
+    assert perceptual_hash(encode(image.transpose(Image.Transpose.ROTATE_90), "PNG")) != original
+    assert perceptual_hash(memoryview(b"not an image")) is None
+
+
+def test_settings_dont_load_multiprocessing():
+    code = (
+        "import sys, tests.conftest, phototag_local_settings, package_settings;"
+        "print('multiprocessing' in sys.modules)"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "False"
@@ -0,0 +1,41 @@
+import phototag_credits
+from phototag_credits import CreditsService
+
+
+def test_has_credits_rate_limits_reconciles(monkeypatch):
+    calls = []
+
+    def get_credits():
+        calls.append(1)
+        return {"error": None, "data": {"credits": 3}}
+
+    monkeypatch.setattr(phototag_credits, "get_phototag_credits", get_credits)
+    service = CreditsService(min_reconcile_interval=60.0)
+    assert service.get_balance() == 3
+    assert service.has_credits(2)
+    service.debit(2)
+    for _ in range(20):
+        assert not service.has_credits(2)
+    # The balance was fetched just now, the low estimate is trusted
+    assert len(calls) == 1
+
+
+def test_has_credits_reconciles_stale_balance(monkeypatch):
+    balances = [1, 50]
+    monkeypatch.setattr(
+        phototag_credits,
+        "get_phototag_credits",
+        lambda: {"error": None, "data": {"credits": balances.pop(0)}},
+    )
+    service = CreditsService(min_reconcile_interval=0.0)
+    assert service.get_balance() == 1
+    assert service.has_credits(10)
+    assert service.get_cached_balance() == 50
+
+
+def test_unknown_balance_does_not_block(monkeypatch):
+    monkeypatch.setattr(phototag_credits, "get_phototag_credits", lambda: {"error": "offline", "data": None})
+    service = CreditsService()
+    assert service.get_balance() is None
+    assert service.has_credits(100)
+    assert service.error == "offline"
@@ -0,0 +1,104 @@
+import struct
+from phototag_embedded_preview import (
+    extract_embedded_preview,
+    find_psd_previews,
+    find_raf_previews,
+    find_tiff_previews,
+    get_jpeg_size,
+    select_preview,
+)
+from supported_extensions import SUPPORTED_EXTENSIONS
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + bytes(9)
+    sof0 = b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 1) + b"\x01\x11\x00"
+    return b"\xff\xd8" + app0 + sof0 + b"\xff\xd9"
+
+
+def make_tiff(thumbnail: bytes, preview: bytes) -> bytes:
+    """
+    Little endian TIFF with a JPEG thumbnail in IFD0 and a JPEG compressed strip in a SubIFD.
+    """
+    ifd0_offset = 8
+    ifd0_size = 2 + 3 * 12 + 4
+    sub_ifd_offset = ifd0_offset + ifd0_size
+    sub_ifd_size = 2 + 3 * 12 + 4
+    thumbnail_offset = sub_ifd_offset + sub_ifd_size
+    preview_offset = thumbnail_offset + len(thumbnail)
+
+    def entry(tag, value_type, value):
+        return struct.pack("<HHII", tag, value_type, 1, value)
+
+    ifd0 = struct.pack("<H", 3)
+    ifd0 += entry(0x0201, 4, thumbnail_offset)
+    ifd0 += entry(0x0202, 4, len(thumbnail))
+    ifd0 += entry(0x014A, 4, sub_ifd_offset)
+    ifd0 += struct.pack("<I", 0)
+    sub_ifd = struct.pack("<H", 3)
+    sub_ifd += entry(0x0103, 3, 7)
+    sub_ifd += entry(0x0111, 4, preview_offset)
+    sub_ifd += entry(0x0117, 4, len(preview))
+    sub_ifd += struct.pack("<I", 0)
+    return b"II" + struct.pack("<HI", 42, ifd0_offset) + ifd0 + sub_ifd + thumbnail + preview
+
+
+def make_psd(thumbnail: bytes) -> bytes:
+    header = b"8BPS" + struct.pack(">H6xHIIHH", 1, 3, 100, 100, 8, 3)
+    # 28 byte thumbnail header with format 1 (JFIF)
+    resource_data = struct.pack(">IIIIIIHH", 1, 160, 160, 480, 480 * 160, len(thumbnail), 24, 1) + thumbnail
+    resource = b"8BIM" + struct.pack(">H", 1036) + b"\x00\x00" + struct.pack(">I", len(resource_data))
+    resource += resource_data + b"\x00" * (len(resource_data) % 2)
+    return header + struct.pack(">I", 0) + struct.pack(">I", len(resource)) + resource
+
+
+def test_get_jpeg_size():
+    data = make_jpeg(640, 480)
+    assert get_jpeg_size(data, 0, len(data)) == (640, 480)
+    assert get_jpeg_size(b"not a jpeg", 0, 10) is None
+
+
+def test_find_tiff_previews():
+    thumbnail, preview = make_jpeg(160, 120), make_jpeg(6000, 4000)
+    data = make_tiff(thumbnail, preview)
+    candidates = find_tiff_previews(data)
+    assert sorted(candidates) == sorted(
+        [(data.index(thumbnail), len(thumbnail)), (data.index(preview), len(preview))]
+    )
+    assert select_preview(data, candidates) == (data.index(preview), len(preview))
+
+
+def test_find_raf_previews():
+    jpeg = make_jpeg(1920, 1280)
+    data = bytearray(b"FUJIFILMCCD-RAW " + bytes(84))
+    struct.pack_into(">II", data, 84, len(data), len(jpeg))
+    data += jpeg
+    assert find_raf_previews(bytes(data)) == [(100, len(jpeg))]
+    assert find_raf_previews(b"FUJIFILM") == []
+
+
+def test_find_psd_previews():
+    jpeg = make_jpeg(160, 120)
+    data = make_psd(jpeg)
+    assert find_psd_previews(data) == [(data.index(jpeg), len(jpeg))]
+
+
+def test_small_psd_thumbnail_is_ignored(tmp_path):
+    small = tmp_path / "small.psd"
+    small.write_bytes(make_psd(make_jpeg(160, 120)))
+    assert extract_embedded_preview(str(small)) is None
+    large = tmp_path / "large.psb"
+    jpeg = make_jpeg(1024, 768)
+    large.write_bytes(make_psd(jpeg))
+    assert extract_embedded_preview(str(large)) == jpeg
+
+
+def test_extract_raw_preview(tmp_path):
+    preview = make_jpeg(6000, 4000)
+    path = tmp_path / "photo.cr2"
+    path.write_bytes(make_tiff(make_jpeg(160, 120), preview))
+    assert extract_embedded_preview(str(path)) == preview
+
+
+def test_common_raw_formats_are_supported():
+    assert {".cr2", ".nef", ".arw"} <= SUPPORTED_EXTENSIONS
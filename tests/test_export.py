@@ -0,0 +1,114 @@
+import json
+import os
+import xml.etree.ElementTree as ElementTree
+from phototag_export import ResultExporter, build_sidecar, get_sidecar_path, write_sidecar
+from phototag_settings import EXPORT_MANIFEST, EXPORT_SIDECARS
+
+NAMESPACES = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "crs": "http://ns.adobe.com/camera-raw-settings/1.0/",
+}
+
+LIGHTROOM_SIDECAR = b"""<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="" xmlns:crs="http://ns.adobe.com/camera-raw-settings/1.0/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/" crs:Exposure2012="+0.50">
+   <dc:subject><rdf:Bag><rdf:li>old</rdf:li></rdf:Bag></dc:subject>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+
+def read_sidecar(path):
+    root = ElementTree.parse(path).getroot()
+    description = root.find(".//rdf:Description", NAMESPACES)
+    return {
+        "title": [li.text for li in root.findall(".//dc:title//rdf:li", NAMESPACES)],
+        "keywords": [li.text for li in root.findall(".//dc:subject//rdf:li", NAMESPACES)],
+        "exposure": description.get("{%s}Exposure2012" % NAMESPACES["crs"]),
+    }
+
+
+def test_get_sidecar_path():
+    assert get_sidecar_path(os.path.join("shoot", "photo.CR2")) == os.path.join("shoot", "photo.xmp")
+    assert get_sidecar_path(os.path.join("shoot", "photo.jpg")) == os.path.join("shoot", "photo.jpg.xmp")
+    assert get_sidecar_path("photo.tif") != get_sidecar_path("photo.jpg")
+
+
+def test_build_sidecar_keeps_existing_values(tmp_path):
+    path = tmp_path / "photo.xmp"
+    path.write_bytes(build_sidecar({"title": "Beach", "keywords": ["sand", "sea"]}, LIGHTROOM_SIDECAR))
+    assert read_sidecar(path) == {"title": ["Beach"], "keywords": ["sand", "sea"], "exposure": "+0.50"}
+
+
+def test_write_sidecar_skips_unchanged_files(tmp_path):
+    file_path = str(tmp_path / "photo.jpg")
+    assert write_sidecar(file_path, {"keywords": ["sea"]})
+    assert not write_sidecar(file_path, {"keywords": ["sea"]})
+    assert read_sidecar(file_path + ".xmp")["keywords"] == ["sea"]
+
+
+def test_sidecars_of_raw_and_jpeg_pairs(tmp_path):
+    exporter = ResultExporter(EXPORT_SIDECARS, max_workers=8)
+    for index in range(50):
+        for extension, keyword in ((".cr2", "raw"), (".jpg", "jpeg")):
+            file_path = str(tmp_path / f"{index}{extension}")
+            exporter.update(file_path, {"keywords": [keyword]})
+            exporter.flush(file_path)
+    stats = exporter.close()
+    assert (stats.written, stats.failed) == (100, 0)
+    assert read_sidecar(tmp_path / "7.xmp")["keywords"] == ["raw"]
+    assert read_sidecar(tmp_path / "7.jpg.xmp")["keywords"] == ["jpeg"]
+
+
+def test_shared_sidecar_updates_are_not_lost(tmp_path):
+    # Both RAW files map to the same sidecar, each write must see the previous one
+    exporter = ResultExporter(EXPORT_SIDECARS, max_workers=8)
+    for index in range(20):
+        file_path = str(tmp_path / ("photo.nef" if index % 2 else "photo.cr2"))
+        exporter.update(file_path, {"title": f"title {index}"} if index % 2 else {"keywords": [str(index)]})
+        exporter.flush(file_path)
+    stats = exporter.close()
+    assert stats.failed == 0
+    values = read_sidecar(tmp_path / "photo.xmp")
+    assert values["title"] and values["keywords"]
+
+
+def test_manifest(tmp_path):
+    manifest_path = tmp_path / "manifest.jsonl"
+    manifest_path.write_text(json.dumps({"path": "old.jpg", "title": "Old"}) + "\n")
+    exporter = ResultExporter(EXPORT_MANIFEST, str(manifest_path))
+    exporter.update(str(tmp_path / "sub" / "new.jpg"), {"title": "New", "keywords": ["a"]})
+    exporter.flush(str(tmp_path / "sub" / "new.jpg"))
+    assert exporter.close().written == 1
+    records = [json.loads(line) for line in manifest_path.read_text().splitlines()]
+    assert records == [
+        {"path": "old.jpg", "title": "Old"},
+        {"keywords": ["a"], "path": "sub/new.jpg", "title": "New"},
+    ]
+
+
+def test_manifest_keeps_paths_on_other_drives(tmp_path, monkeypatch):
+    other_drive = str(tmp_path / "other_drive")
+    relpath = os.path.relpath
+
+    def windows_relpath(path, start=os.curdir):
+        # Like ntpath.relpath for paths on different drives
+        if path.startswith(other_drive) != start.startswith(other_drive):
+            raise ValueError("path is on mount 'D:', start on mount 'C:'")
+        return relpath(path, start)
+
+    monkeypatch.setattr(os.path, "relpath", windows_relpath)
+    first = str(tmp_path / "photos" / "a.jpg")
+    second = os.path.join(other_drive, "b.jpg")
+    manifest_path = tmp_path / "photos" / "phototag_manifest.jsonl"
+    manifest_path.parent.mkdir()
+    exporter = ResultExporter(EXPORT_MANIFEST, str(manifest_path))
+    for file_path in (first, second):
+        exporter.update(file_path, {"title": "Title"})
+        exporter.flush(file_path)
+    assert exporter.close().written == 2
+    records = [json.loads(line) for line in manifest_path.read_text().splitlines()]
+    assert sorted(record["path"] for record in records) == sorted(["a.jpg", second.replace(os.sep, "/")])
@@ -0,0 +1,115 @@
+import os
+import shutil
+import pytest
+from phototag_fingerprint import FingerprintIndex
+
+BLOCK_SIZE = 16
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = FingerprintIndex(str(tmp_path / "index" / "fingerprints.db"), block_size=BLOCK_SIZE)
+    yield index
+    index.close()
+
+
+def write(path, data, mtime=None):
+    path.write_bytes(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_small_files_use_full_hash(index, tmp_path):
+    path = tmp_path / "small.jpg"
+    write(path, b"x" * (3 * BLOCK_SIZE))
+    fingerprint = index.get_fingerprint(str(path))
+    assert fingerprint.startswith("f:")
+    write(path, b"y" * (3 * BLOCK_SIZE), 1000)
+    assert index.get_fingerprint(str(path)) != fingerprint
+
+
+def test_touched_file_is_compared_exactly(index, tmp_path):
+    path = tmp_path / "large.psb"
+    write(path, bytes(range(256)) * 4, 1000)
+    assert index.get_fingerprint(str(path)).startswith("s:")
+    write(path, bytes(range(256)) * 4, 2000)
+    fingerprint = index.get_fingerprint(str(path))
+    assert fingerprint.startswith("f:")
+    # The full hash is stored now, so further touches keep the fingerprint
+    write(path, bytes(range(256)) * 4, 3000)
+    assert index.get_fingerprint(str(path)) == fingerprint
+
+
+def test_edit_outside_sampled_blocks_changes_fingerprint(index, tmp_path):
+    path = tmp_path / "large.tif"
+    data = bytearray(range(256)) * 4
+    write(path, data, 1000)
+    index.get_fingerprint(str(path))
+    write(path, data, 2000)
+    fingerprint = index.get_fingerprint(str(path))
+    # Same size, the head, middle and tail blocks are unchanged
+    data[100] ^= 0xFF
+    write(path, data, 3000)
+    assert index.get_fingerprint(str(path)) != fingerprint
+
+
+def test_first_edit_outside_sampled_blocks_changes_fingerprint(index, tmp_path):
+    path = tmp_path / "large.exr"
+    data = bytearray(range(256)) * 4
+    write(path, data, 1000)
+    fingerprint = index.get_fingerprint(str(path))
+    data[700] ^= 0xFF
+    write(path, data, 2000)
+    assert index.get_fingerprint(str(path)) != fingerprint
+
+
+def test_changed_blocks_change_fingerprint(index, tmp_path):
+    path = tmp_path / "large.psb"
+    data = bytearray(range(256)) * 4
+    write(path, data, 1000)
+    fingerprint = index.get_fingerprint(str(path))
+    data[0] ^= 0xFF
+    write(path, data, 2000)
+    assert index.get_fingerprint(str(path)) != fingerprint
+
+
+def test_memoized_fingerprints_without_reading(index, tmp_path):
+    path = tmp_path / "large.psb"
+    write(path, bytes(1024), 1000)
+    assert index.get_fingerprint(str(path), read_content=False) is None
+    fingerprint = index.get_fingerprint(str(path))
+    assert index.get_fingerprint(str(path), read_content=False) == fingerprint
+    write(path, bytes(1024), 2000)
+    assert index.get_fingerprint(str(path), read_content=False) is None
+
+
+def test_sampled_conflicts_use_full_hash(index, tmp_path):
+    data = bytearray(range(256)) * 4
+    first = tmp_path / "first.psb"
+    write(first, data)
+    copy = tmp_path / "copy.psb"
+    shutil.copyfile(first, copy)
+    # Differs outside of the sampled head, middle and tail blocks
+    data[100] ^= 0xFF
+    other = tmp_path / "other.psb"
+    write(other, data)
+
+    fingerprint = index.get_fingerprint(str(first))
+    assert index.get_fingerprint(str(copy)) == fingerprint
+    other_fingerprint = index.get_fingerprint(str(other))
+    assert other_fingerprint.startswith("f:")
+    assert other_fingerprint != fingerprint
+    # Touching a file that needed the full hash compares it again
+    os.utime(other, (5000, 5000))
+    assert index.get_fingerprint(str(other)) == other_fingerprint
+
+
+def test_tagged(index, tmp_path):
+    path = tmp_path / "photo.jpg"
+    write(path, b"photo")
+    fingerprint = index.get_fingerprint(str(path))
+    assert not index.is_tagged(str(path), fingerprint, "settings")
+    index.mark_tagged(str(path), fingerprint, "settings")
+    assert index.is_tagged(str(path), fingerprint, "settings")
+    assert not index.is_tagged(str(path), fingerprint, "other settings")
+    assert not index.is_tagged(str(path), "f:changed", "settings")
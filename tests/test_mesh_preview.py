@@ -0,0 +1,125 @@
+import struct
+import threading
+import pytest
+import phototag_preview
+from phototag_mesh_preview import (
+    get_render_timeout,
+    read_glb_points,
+    read_obj_points,
+    read_ply_points,
+    read_stl_points,
+    render_mesh_preview,
+    RENDER_TIMEOUT_MAX,
+)
+
+
+def make_obj(count):
+    lines = [f"v {i} {i + 0.5} {-i}" for i in range(count)]
+    lines += ["vn 0 0 1", "f 1 2 3"]
+    return memoryview(("# model\n" + "\n".join(lines) + "\n").encode())
+
+
+def make_binary_stl(count):
+    data = bytearray(80) + struct.pack("<I", count)
+    for i in range(count):
+        data += struct.pack("<12fH", 0, 0, 1, i, 0, 0, i, 1, 0, i, 0, 1, 0)
+    return memoryview(data)
+
+
+def test_obj_points():
+    points = read_obj_points(make_obj(3))
+    assert list(points) == [0, 0.5, 0, 1, 1.5, -1, 2, 2.5, -2]
+
+
+def test_obj_points_are_sampled_evenly():
+    points = read_obj_points(make_obj(1000), max_points=100)
+    assert len(points) == 300
+    assert list(points[:6]) == [0, 0.5, 0, 10, 10.5, -10]
+
+
+def test_ascii_stl_points():
+    text = b"solid cube\nfacet normal 0 0 1\nouter loop\n"
+    text += b"vertex 1 2 3\nvertex 4 5 6\nvertex 7 8 9\nendloop\nendfacet\nendsolid cube\n"
+    assert list(read_stl_points(memoryview(text))) == list(range(1, 10))
+    assert len(read_stl_points(memoryview(text), max_points=2)) == 6
+
+
+def test_binary_stl_points():
+    points = read_stl_points(make_binary_stl(100), max_points=30)
+    assert len(points) == 90
+    assert list(points[:3]) == [0, 0, 0]
+    assert list(points[9:12]) == [10, 0, 0]
+
+
+def test_ascii_ply_points():
+    text = (
+        b"ply\nformat ascii 1.0\nelement vertex 4\nproperty float x\nproperty float y\n"
+        b"property float z\nelement face 1\nproperty list uchar int vertex_indices\nend_header\n"
+        b"0 1 2\n3 4 5\n6 7 8\n9 10 11\n3 0 1 2\n"
+    )
+    assert list(read_ply_points(memoryview(text))) == list(range(12))
+    assert list(read_ply_points(memoryview(text), max_points=2)) == [0, 1, 2, 6, 7, 8]
+
+
+def test_binary_ply_points():
+    header = (
+        b"ply\nformat binary_little_endian 1.0\nelement vertex 2\nproperty float x\n"
+        b"property float y\nproperty float z\nproperty uchar red\nend_header\n"
+    )
+    data = header + struct.pack("<3fB", 1, 2, 3, 255) + struct.pack("<3fB", 4, 5, 6, 0)
+    assert list(read_ply_points(memoryview(data))) == [1, 2, 3, 4, 5, 6]
+
+
+def test_glb_points_use_node_transform():
+    positions = struct.pack("<6f", 0, 0, 0, 1, 2, 3)
+    document = (
+        b'{"scene":0,"scenes":[{"nodes":[0]}],"nodes":[{"mesh":0,"translation":[10,0,0]}],'
+        b'"meshes":[{"primitives":[{"attributes":{"POSITION":0}}]}],'
+        b'"accessors":[{"bufferView":0,"componentType":5126,"count":2,"type":"VEC3"}],'
+        b'"bufferViews":[{"buffer":0,"byteLength":24}]}'
+    )
+    document += b" " * (-len(document) % 4)
+    data = struct.pack("<4sII", b"glTF", 2, 12 + 8 + len(document) + 8 + len(positions))
+    data += struct.pack("<II", len(document), 0x4E4F534A) + document
+    data += struct.pack("<II", len(positions), 0x004E4942) + positions
+    assert list(read_glb_points(memoryview(data))) == [10, 0, 0, 11, 2, 3]
+
+
+def test_render_timeout_grows_with_size():
+    assert get_render_timeout(0) < get_render_timeout(100 * 1024 * 1024)
+    assert get_render_timeout(10 ** 12) == RENDER_TIMEOUT_MAX
+
+
+def test_unsupported_format_is_not_rendered():
+    assert render_mesh_preview(make_obj(3), ".fbx") is None
+
+
+def test_contact_sheet_is_png():
+    pytest.importorskip("PIL.Image")
+    assert render_mesh_preview(make_obj(100), ".obj").startswith(b"\x89PNG")
+
+
+def test_timed_out_render_replaces_pool(monkeypatch, tmp_path):
+    path = tmp_path / "model.fbx"
+    path.write_bytes(b"")
+    other = tmp_path / "other.fbx"
+    other.write_bytes(b"")
+    release = threading.Event()
+
+    def generate_preview(file_path):
+        if file_path == str(path):
+            release.wait(10)
+            return None
+        return phototag_preview.Preview("model.png", b"png")
+
+    monkeypatch.setattr(phototag_preview, "generate_preview", generate_preview)
+    monkeypatch.setattr(phototag_preview, "get_render_timeout", lambda size, bytes_per_second: 0.05)
+    monkeypatch.setattr(phototag_preview, "_render_pool", None)
+    try:
+        # More hung renders than render threads
+        for _ in range(phototag_preview.RENDER_WORKERS + 1):
+            assert phototag_preview.generate_3d_preview(str(path)) is None
+        preview = phototag_preview.generate_3d_preview(str(other))
+    finally:
+        release.set()
+    assert preview.data == b"png"
@@ -0,0 +1,288 @@
+import struct
+import types
+import pytest
+import phototag_ai
+from phototag_metadata import EmbeddedMetadata, build_context_payload, read_embedded_metadata
+from phototag_settings import (
+    METADATA_CONTEXT,
+    METADATA_IGNORE,
+    METADATA_SKIP_COMPLETE,
+    METADATA_WRITE,
+)
+
+
+def make_xmp(title=None, description=None, keywords=()) -> bytes:
+    properties = ""
+    if title:
+        properties += f'<dc:title><rdf:Alt><rdf:li xml:lang="x-default">{title}</rdf:li></rdf:Alt></dc:title>'
+    if description:
+        properties += (
+            f'<dc:description><rdf:Alt><rdf:li xml:lang="x-default">{description}</rdf:li></rdf:Alt></dc:description>'
+        )
+    if keywords:
+        items = "".join(f"<rdf:li>{keyword}</rdf:li>" for keyword in keywords)
+        properties += f"<dc:subject><rdf:Bag>{items}</rdf:Bag></dc:subject>"
+    return (
+        '<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f"{properties}</rdf:Description></rdf:RDF></x:xmpmeta>"
+        '<?xpacket end="w"?>'
+    ).encode("utf-8")
+
+
+def make_iptc(headline=None, caption=None, keywords=()) -> bytes:
+    def dataset(number, value):
+        value = value.encode("utf-8")
+        return struct.pack(">BBBH", 0x1C, 2, number, len(value)) + value
+
+    data = b""
+    if headline:
+        data += dataset(105, headline)
+    if caption:
+        data += dataset(120, caption)
+    for keyword in keywords:
+        data += dataset(25, keyword)
+    return data
+
+
+def make_resource(resource_id: int, data: bytes) -> bytes:
+    return b"8BIM" + struct.pack(">H", resource_id) + b"\x00\x00" + struct.pack(">I", len(data)) + data + b"\x00" * (len(data) % 2)
+
+
+def make_tiff(description=None, xp_keywords=None, xmp=None, iptc=None) -> bytes:
+    """
+    Little endian TIFF structure with the metadata tags in IFD0, values follow the IFD.
+    """
+    entries = []
+    if description:
+        entries.append((0x010E, 2, description.encode("ascii") + b"\x00"))
+    if xmp:
+        entries.append((0x02BC, 1, xmp))
+    if iptc:
+        entries.append((0x83BB, 7, iptc))
+    if xp_keywords:
+        entries.append((0x9C9E, 1, xp_keywords.encode("utf-16-le") + b"\x00\x00"))
+    offset = 8 + 2 + len(entries) * 12 + 4
+    ifd = struct.pack("<H", len(entries))
+    values = b""
+    for tag, value_type, value in entries:
+        if len(value) <= 4:
+            ifd += struct.pack("<HHI", tag, value_type, len(value)) + value.ljust(4, b"\x00")
+        else:
+            ifd += struct.pack("<HHII", tag, value_type, len(value), offset + len(values))
+            values += value
+    return b"II*\x00" + struct.pack("<I", 8) + ifd + struct.pack("<I", 0) + values
+
+
+def make_jpeg(*segments) -> bytes:
+    data = b"\xff\xd8"
+    for marker, payload in segments:
+        data += bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+    # Image data, the reader must stop before it
+    return data + b"\xff\xda" + struct.pack(">H", 8) + bytes(6) + b"\xff\xd9"
+
+
+def make_png(*chunks) -> bytes:
+    data = b"\x89PNG\r\n\x1a\n"
+    for chunk_type, payload in chunks + ((b"IDAT", bytes(16)), (b"IEND", b"")):
+        data += struct.pack(">I4s", len(payload), chunk_type) + payload + bytes(4)
+    return data
+
+
+def make_webp(*chunks) -> bytes:
+    body = b"WEBP"
+    for chunk_type, payload in chunks:
+        body += struct.pack("<4sI", chunk_type, len(payload)) + payload + b"\x00" * (len(payload) % 2)
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def make_psd(*resources) -> bytes:
+    header = b"8BPS" + struct.pack(">H6xHIIHH", 1, 3, 100, 100, 8, 3)
+    data = b"".join(make_resource(resource_id, payload) for resource_id, payload in resources)
+    return header + struct.pack(">I", 0) + struct.pack(">I", len(data)) + data
+
+
+def read(tmp_path, name: str, data: bytes):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return read_embedded_metadata(str(path))
+
+
+def test_jpeg_prefers_xmp_over_iptc_over_exif(tmp_path):
+    data = make_jpeg(
+        (0xE1, b"Exif\x00\x00" + make_tiff(description="EXIF description", xp_keywords="exif;keywords")),
+        (0xE1, b"http://ns.adobe.com/xap/1.0/\x00" + make_xmp(title="XMP title", keywords=["beach", "sunset"])),
+        (0xED, b"Photoshop 3.0\x00" + make_resource(0x0404, make_iptc("IPTC headline", "IPTC caption", ["iptc"]))),
+    )
+    metadata = read(tmp_path, "photo.jpg", data)
+    assert metadata.title == "XMP title"
+    assert metadata.description == "IPTC caption"
+    assert metadata.keywords == ["beach", "sunset"]
+
+
+def test_jpeg_exif_fallback(tmp_path):
+    data = make_jpeg((0xE1, b"Exif\x00\x00" + make_tiff(description="EXIF description", xp_keywords="a;b")))
+    metadata = read(tmp_path, "photo.jpg", data)
+    assert metadata.title is None
+    assert metadata.description == "EXIF description"
+    assert metadata.keywords == ["a", "b"]
+
+
+def test_jpeg_without_metadata(tmp_path):
+    assert read(tmp_path, "photo.jpg", make_jpeg((0xE0, b"JFIF\x00" + bytes(9)))) is None
+
+
+def test_png_xmp_and_exif(tmp_path):
+    itxt = b"XML:com.adobe.xmp\x00\x00\x00\x00\x00" + make_xmp(title="PNG title")
+    data = make_png((b"iTXt", itxt), (b"eXIf", make_tiff(description="PNG description")))
+    metadata = read(tmp_path, "image.png", data)
+    assert metadata.title == "PNG title"
+    assert metadata.description == "PNG description"
+
+
+def test_webp_xmp_and_exif(tmp_path):
+    data = make_webp(
+        (b"VP8X", bytes(10)),
+        (b"XMP ", make_xmp(keywords=["webp"])),
+        (b"EXIF", b"Exif\x00\x00" + make_tiff(description="WebP description")),
+    )
+    metadata = read(tmp_path, "image.webp", data)
+    assert metadata.keywords == ["webp"]
+    assert metadata.description == "WebP description"
+
+
+def test_psd_xmp_and_iptc(tmp_path):
+    data = make_psd(
+        (0x0404, make_iptc("IPTC headline", "IPTC caption", ["psd"])),
+        (0x0424, make_xmp(title="PSD title")),
+    )
+    metadata = read(tmp_path, "design.psd", data)
+    assert metadata.title == "PSD title"
+    assert metadata.description == "IPTC caption"
+    assert metadata.keywords == ["psd"]
+
+
+def test_tiff_xmp_iptc_and_exif(tmp_path):
+    data = make_tiff(
+        description="EXIF description",
+        xmp=make_xmp(title="TIFF title"),
+        iptc=make_iptc(caption="IPTC caption", keywords=["tiff", "scan"]),
+    )
+    metadata = read(tmp_path, "scan.tif", data)
+    assert metadata.title == "TIFF title"
+    # IPTC takes precedence over EXIF
+    assert metadata.description == "IPTC caption"
+    assert metadata.keywords == ["tiff", "scan"]
+
+
+def test_truncated_file_is_ignored(tmp_path):
+    data = make_jpeg((0xE1, b"http://ns.adobe.com/xap/1.0/\x00" + make_xmp(title="title")))
+    assert read(tmp_path, "broken.jpg", data[:40]) is None
+
+
+def test_context_payload():
+    metadata = EmbeddedMetadata()
+    metadata.merge("Title", "Description", ["Beach", "sun"])
+    payload = {"customContext": "Travel", "requiredKeywords": "beach, sea"}
+    context = build_context_payload(payload, metadata, max_keywords=3)
+    assert context["customContext"] == "Travel. Title: Title. Description: Description"
+    assert context["requiredKeywords"] == "beach, sea, sun"
+    assert payload == {"customContext": "Travel", "requiredKeywords": "beach, sea"}
+
+
+class Database:
+    def __init__(self):
+        self.values = {}
+        self.attributes = self
+
+    def set_attribute_value(self, file_path, name, value):
+        self.values[name] = value
+
+
+class Exporter:
+    def __init__(self):
+        self.values = {}
+
+    def update(self, file_path, values):
+        self.values.update(values)
+
+
+@pytest.fixture
+def policy_run(monkeypatch):
+    # Keyword attributes are written as plain lists outside of Anchorpoint
+    monkeypatch.setattr(phototag_ai, "aps", types.SimpleNamespace(AttributeTagList=list, AttributeTag=str))
+
+    def create(policy):
+        settings = types.SimpleNamespace(
+            embedded_metadata=policy,
+            enable_ai_title=True,
+            enable_ai_description=True,
+            enable_ai_tags=True,
+            max_keywords=None,
+        )
+        attribute_names = {"title": "AI-Title", "description": "AI-Description", "keywords": "AI-Keywords"}
+        return settings, {"customContext": ""}, attribute_names, None
+
+    return create
+
+
+def make_metadata(title=None, description=None, keywords=()):
+    metadata = EmbeddedMetadata()
+    metadata.merge(title, description, list(keywords))
+    return metadata
+
+
+def test_policy_ignore(policy_run):
+    database = Database()
+    run = policy_run(METADATA_IGNORE)
+    assert phototag_ai.apply_metadata_policy(database, "a.jpg", make_metadata("Title"), run) == (run[1], set())
+    assert not database.values
+
+
+def test_policy_without_metadata(policy_run):
+    run = policy_run(METADATA_WRITE)
+    assert phototag_ai.apply_metadata_policy(Database(), "a.jpg", None, run) == (run[1], set())
+
+
+def test_policy_write_requests_missing_fields(policy_run):
+    database = Database()
+    exporter = Exporter()
+    request = phototag_ai.apply_metadata_policy(
+        database, "a.jpg", make_metadata("Title"), policy_run(METADATA_WRITE), exporter
+    )
+    payload, covered = request
+    assert covered == {"title"}
+    assert payload["customContext"] == "Title: Title"
+    assert database.values == {"AI-Title": "Title"}
+    assert exporter.values == {"title": "Title"}
+
+
+def test_policy_write_skips_complete_files(policy_run):
+    database = Database()
+    metadata = make_metadata("Title", "Description", ["beach"])
+    assert phototag_ai.apply_metadata_policy(database, "a.jpg", metadata, policy_run(METADATA_WRITE)) is None
+    assert database.values == {"AI-Title": "Title", "AI-Description": "Description", "AI-Keywords": ["beach"]}
+
+
+def test_policy_context(policy_run):
+    database = Database()
+    payload, covered = phototag_ai.apply_metadata_policy(
+        database, "a.jpg", make_metadata("Title", keywords=["beach"]), policy_run(METADATA_CONTEXT)
+    )
+    assert payload["customContext"] == "Title: Title"
+    assert payload["requiredKeywords"] == "beach"
+    assert covered == set()
+    assert not database.values
+
+
+def test_policy_skip_when_complete(policy_run):
+    run = policy_run(METADATA_SKIP_COMPLETE)
+    database = Database()
+    # Incomplete metadata is neither written nor sent as context
+    assert phototag_ai.apply_metadata_policy(database, "a.jpg", make_metadata("Title"), run) == (run[1], set())
+    assert not database.values
+    metadata = make_metadata("Title", "Description", ["beach"])
+    assert phototag_ai.apply_metadata_policy(database, "a.jpg", metadata, run) is None
+    assert database.values["AI-Keywords"] == ["beach"]
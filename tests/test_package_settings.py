@@ -0,0 +1,140 @@
+import types
+import pytest
+import package_settings
+from phototag_settings import EXPORT_NONE, METADATA_IGNORE, METADATA_WRITE, SNAPSHOT_FIELDS
+
+
+class Dialog:
+    """
+    Holds the field values like ap.Dialog and records every change.
+    """
+
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+        self.changes = []
+        self.dropdowns = []
+
+    def get_value(self, var):
+        return self.values.get(var)
+
+    def set_value(self, var, value):
+        self.values[var] = value
+        self.changes.append((var, value))
+
+    def set_dropdown_values(self, var, value, values):
+        self.values[var] = value
+        self.dropdowns.append((var, value, list(values)))
+
+
+def make_settings(name="default", **values):
+    settings = dict.fromkeys(SNAPSHOT_FIELDS)
+    settings.update(
+        max_keywords=20,
+        required_keywords="beach",
+        use_file_name_for_context=True,
+        single_word_keywords_only=False,
+        be_creative=False,
+        title_case_title=True,
+        normalize_keywords=False,
+        skip_tagged_files=False,
+        embedded_metadata=METADATA_IGNORE,
+        export_results=EXPORT_NONE,
+        enable_ai_title=True,
+        enable_ai_description=True,
+        enable_ai_tags=True,
+    )
+    settings.update(values)
+    return types.SimpleNamespace(name=name, **settings)
+
+
+@pytest.fixture
+def dialog(monkeypatch):
+    """
+    A dialog that shows the default preset.
+    """
+    settings = make_settings()
+    dialog = Dialog(package_settings.get_dialog_values(settings))
+    dialog.values.update(rename_field="default", settings_name="default")
+    monkeypatch.setattr(package_settings, "settings_dialog", dialog)
+    monkeypatch.setattr(package_settings, "current_settings", settings)
+    monkeypatch.setattr(
+        package_settings,
+        "settings_list",
+        types.SimpleNamespace(get_settings_names=lambda: ["default", "stock"], get_api_key=lambda: "key"),
+    )
+    return dialog
+
+
+def test_update_sets_only_changed_fields(dialog, monkeypatch):
+    stock = make_settings("stock", max_keywords=40, embedded_metadata=METADATA_WRITE, enable_ai_title=False)
+    monkeypatch.setattr(package_settings, "current_settings", stock)
+    package_settings.update_settings_dialog()
+    assert dialog.changes == [
+        ("max_keywords", "40"),
+        ("enable_ai_title", False),
+        ("embedded_metadata", METADATA_WRITE),
+        ("rename_field", "stock"),
+        ("settings_name", "stock"),
+    ]
+    assert not dialog.dropdowns
+
+
+def test_update_without_changes(dialog):
+    package_settings.update_settings_dialog()
+    # The rename field is always reset, e.g. after a canceled rename
+    assert dialog.changes == [("rename_field", "default")]
+
+
+def test_update_with_changed_names(dialog):
+    package_settings.update_settings_dialog(names_changed=True)
+    assert dialog.dropdowns == [("settings_name", "default", ["default", "stock"])]
+    assert ("settings_name", "default") not in dialog.changes
+
+
+def test_unknown_policies_are_shown_as_default(dialog, monkeypatch):
+    monkeypatch.setattr(
+        package_settings, "current_settings", make_settings(embedded_metadata="Removed", export_results="Removed")
+    )
+    package_settings.update_settings_dialog()
+    assert dialog.changes == [("rename_field", "default")]
+
+
+@pytest.fixture
+def credits(monkeypatch):
+    """
+    Counts the balance requests, the cached balance is empty unless set.
+    """
+    state = types.SimpleNamespace(requests=0, cached=None)
+
+    def get_balance():
+        state.requests += 1
+        return 42
+
+    monkeypatch.setattr(package_settings, "CREDITS_CHECK_DELAY", 0.05)
+    monkeypatch.setattr(package_settings.credits_service, "get_cached_balance", lambda max_age: state.cached)
+    monkeypatch.setattr(package_settings.credits_service, "get_balance", get_balance)
+    return state
+
+
+def test_quick_edits_start_one_credits_request(dialog, credits):
+    for _ in range(5):
+        package_settings.check_credits_callback(dialog)
+    assert dialog.values["credits"] == "loading..."
+    timer = package_settings._credits_timer
+    timer.join(timeout=5)
+    assert dialog.values["credits"] == "42"
+    assert credits.requests == 1
+
+
+def test_cached_balance_is_shown_without_request(dialog, credits):
+    credits.cached = 7
+    package_settings.check_credits_callback(dialog)
+    assert dialog.values["credits"] == "7"
+    assert credits.requests == 0
+
+
+def test_no_credits_check_without_api_key(dialog, credits, monkeypatch):
+    monkeypatch.setattr(package_settings, "settings_list", types.SimpleNamespace(get_api_key=lambda: ""))
+    package_settings.check_credits_callback(dialog)
+    assert "credits" not in dialog.values
+    assert credits.requests == 0
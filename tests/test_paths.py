@@ -0,0 +1,76 @@
+import os
+from phototag_paths import DirectoryInterner, PathTable
+
+
+def test_add_keeps_order_and_skips_duplicates():
+    files = PathTable()
+    assert files.add(os.path.join("photos", "a.jpg"))
+    assert files.add(os.path.join("photos", "b.jpg"), mtime=5.0)
+    assert not files.add(os.path.join("photos", "a.jpg"))
+    assert list(files) == [os.path.join("photos", "a.jpg"), os.path.join("photos", "b.jpg")]
+    assert files.get_mtime(1) == 5.0
+    assert files.get_directory_id(0) == files.get_directory_id(1)
+
+
+def test_directory_spellings_share_an_id():
+    interner = DirectoryInterner()
+    directory = os.path.join("photos", "shoot")
+    assert interner.intern(directory) == interner.intern(directory + os.sep)
+    assert interner.find(os.path.abspath(directory)) == 0
+    assert interner.find("elsewhere") is None
+
+
+def test_contains():
+    files = PathTable()
+    files.add_file("photos", "a.jpg")
+    assert os.path.join("photos", "a.jpg") in files
+    assert files.contains_file("photos", "a.jpg")
+    assert not files.contains_file("photos", "b.jpg")
+    assert os.path.join("other", "a.jpg") not in files
+
+
+def test_case_follows_the_file_system():
+    files = PathTable()
+    files.add_file("photos", "a.jpg")
+    added = files.add_file("photos", "A.JPG")
+    assert added == (os.path.normcase("A") != "a")
+
+
+def test_duplicate_keeps_explicit_flag():
+    files = PathTable()
+    files.add_file("photos", "a.jpg")
+    assert not files.is_explicit(0)
+    files.add_file("photos", "a.jpg", explicit=True)
+    assert files.is_explicit(0)
+    assert len(files) == 1
+
+
+def test_undecodable_names_round_trip():
+    files = PathTable()
+    name = "caf\udce9.jpg"
+    files.add_file("photos", name)
+    assert files.get_name(0) == name
+    assert files.contains_file("photos", name)
+
+
+def test_growth_keeps_all_entries():
+    files = PathTable()
+    for number in range(1000):
+        assert files.add_file(f"folder{number % 7}", f"{number}.jpg")
+    assert len(files) == 1000
+    assert all(files.contains_file(f"folder{number % 7}", f"{number}.jpg") for number in range(1000))
+    assert len(files.interner.directories) == 7
+
+
+def test_take_copies_entries_in_order():
+    files = PathTable()
+    files.add_file("a", "1.jpg", mtime=1.0)
+    files.add_file("b", "2.jpg", explicit=True, mtime=2.0)
+    files.add_file("a", "3.jpg", mtime=3.0)
+    taken = files.take([2, 1, 2])
+    assert taken.interner is files.interner
+    assert [taken.get_name(position) for position in range(len(taken))] == ["3.jpg", "2.jpg"]
+    assert taken.get_mtime(0) == 3.0
+    assert taken.is_explicit(1)
+    assert taken.contains_file("b", "2.jpg")
+    assert not taken.contains_file("a", "1.jpg")
@@ -0,0 +1,91 @@
+import os
+import types
+import pytest
+from phototag_planner import collect_files, plan_tagging, read_mtimes
+from phototag_settings import METADATA_CONTEXT, METADATA_SKIP_COMPLETE, METADATA_WRITE
+from test_metadata import make_jpeg, make_xmp
+
+
+@pytest.fixture
+def photos(tmp_path):
+    folder = tmp_path / "photos"
+    (folder / "nested").mkdir(parents=True)
+    for path in [folder / "a.jpg", folder / "nested" / "b.jpg"]:
+        path.write_bytes(b"")
+        os.utime(path, (1000, 1000))
+    return folder
+
+
+@pytest.fixture
+def stat_calls(monkeypatch):
+    calls = []
+    stat = os.stat
+
+    def record(path, *args, **kwargs):
+        calls.append(str(path))
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", record)
+    yield calls
+    monkeypatch.undo()
+
+
+def names(selection):
+    return [os.path.basename(path) for path in selection.files]
+
+
+def test_collect_files_without_stat(photos, stat_calls):
+    selection = collect_files([], [str(photos)])
+    assert not [path for path in stat_calls if path.endswith(".jpg")]
+    assert names(selection) == ["a.jpg", "b.jpg"]
+    assert not selection.has_mtimes
+    assert selection.files.get_mtime(0) == 0
+
+
+def test_collect_files_resolves_symlinks_without_stat(photos, tmp_path, stat_calls):
+    os.symlink(photos / "a.jpg", photos / "link.jpg")
+    os.symlink(photos, tmp_path / "linked")
+    selection = collect_files([str(photos / "nested" / "b.jpg")], [str(tmp_path / "linked"), str(photos)])
+    assert sorted(names(selection)) == ["a.jpg", "b.jpg"]
+    # Through the folder link only a.jpg is new, link.jpg and b.jpg are duplicates. In the
+    # folder itself a.jpg and link.jpg are duplicates and b.jpg was selected before
+    assert selection.duplicates == 4
+    assert selection.overlapping == 1
+    assert not [path for path in stat_calls if path.endswith(".jpg")]
+
+
+def test_collect_files_with_stat_finds_hard_links(photos):
+    os.link(photos / "a.jpg", photos / "hard.jpg")
+    selection = collect_files([], [str(photos)], stat_files=True)
+    assert selection.duplicates == 1
+    assert selection.has_mtimes
+    assert selection.files.get_mtime(0) == 1000
+
+
+def test_read_mtimes(photos):
+    selection = collect_files([], [str(photos)])
+    read_mtimes(selection.files)
+    assert [selection.files.get_mtime(position) for position in range(2)] == [1000, 1000]
+
+
+def make_settings(policy):
+    return types.SimpleNamespace(
+        skip_tagged_files=False,
+        embedded_metadata=policy,
+        enable_ai_title=True,
+        enable_ai_description=False,
+        enable_ai_tags=True,
+    )
+
+
+def test_request_count_excludes_files_covered_by_metadata(photos):
+    xmp = b"http://ns.adobe.com/xap/1.0/\x00" + make_xmp(title="Title", keywords=["beach"])
+    (photos / "complete.jpg").write_bytes(make_jpeg((0xE1, xmp)))
+    (photos / "partial.jpg").write_bytes(make_jpeg((0xE1, b"http://ns.adobe.com/xap/1.0/\x00" + make_xmp(title="Title"))))
+    selection = collect_files([], [str(photos)])
+    presets = [make_settings(METADATA_WRITE), make_settings(METADATA_SKIP_COMPLETE), make_settings(METADATA_CONTEXT)]
+    plan = plan_tagging(selection, presets, None, [], check_tagged=False)
+    assert len(plan.files) == 4
+    assert plan.covered_by_metadata == 2
+    assert plan.request_count == 4 * 3 - 2
+    assert "Covered by embedded metadata: 2" in plan.get_report()
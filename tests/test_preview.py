@@ -0,0 +1,182 @@
+import concurrent.futures
+import os
+import time
+import types
+import pytest
+import phototag_preview
+from phototag_preview import Preview, PreviewCache, finish_mesh_preview, load_preview
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / "photo.exr"
+    path.write_bytes(b"image data")
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PreviewCache(str(tmp_path / "cache"))
+
+
+def set_mtime(path: str, mtime: float):
+    os.utime(path, (mtime, mtime))
+
+
+def get_entries(cache: PreviewCache):
+    return sorted(
+        name for folder in os.listdir(cache.cache_dir) for name in os.listdir(os.path.join(cache.cache_dir, folder))
+    )
+
+
+def test_cache_miss_and_hit(cache, photo):
+    assert cache.get(photo) is None
+    assert cache.put(photo, Preview("photo.png", b"preview"))
+    preview = cache.get(photo)
+    assert bytes(preview.data) == b"preview"
+    assert (preview.name, preview.source, preview.content_type) == ("photo.png", "cache", "image/png")
+
+
+def test_changed_file_invalidates_entry(cache, photo):
+    cache.put(photo, Preview("photo.png", b"preview"))
+    with open(photo, "ab") as f:
+        f.write(b"changed")
+    assert cache.get(photo) is None
+
+
+def test_empty_and_large_previews_are_not_cached(tmp_path, photo):
+    cache = PreviewCache(str(tmp_path / "cache"), max_preview_size=4)
+    assert not cache.put(photo, Preview("photo.png", b""))
+    assert not cache.put(photo, Preview("photo.png", b"too large"))
+    assert cache.get(photo) is None
+
+
+def test_fingerprint_key_is_shared_by_copies(tmp_path, photo):
+    index = types.SimpleNamespace(get_fingerprint=lambda path: "same content")
+    cache = PreviewCache(str(tmp_path / "cache"), index=index)
+    cache.put(photo, Preview("photo.png", b"preview"))
+    preview = cache.get(str(tmp_path / "copy.exr"))
+    assert (bytes(preview.data), preview.name) == (b"preview", "copy.png")
+
+
+def test_prune_removes_least_recently_used(tmp_path):
+    cache = PreviewCache(str(tmp_path / "cache"))
+    now = time.time()
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"photo{i}.exr"
+        path.write_bytes(b"image data")
+        paths.append(str(path))
+        cache.put(paths[-1], Preview("photo.png", b"0123456789"))
+        set_mtime(cache._get_path(cache._get_key(paths[-1])), now - 100 + i)
+
+    # Reading the oldest entry makes it the most recently used
+    assert cache.get(paths[0])
+    cache.max_bytes = 25
+    assert cache.prune() == 1
+    assert cache.get(paths[1]) is None
+    assert cache.get(paths[0]) and cache.get(paths[2])
+
+
+def test_prune_removes_expired_entries(tmp_path, photo):
+    cache = PreviewCache(str(tmp_path / "cache"), max_age=60)
+    cache.put(photo, Preview("photo.png", b"preview"))
+    set_mtime(cache._get_path(cache._get_key(photo)), time.time() - 120)
+    assert cache.prune() == 1
+    assert get_entries(cache) == []
+
+
+def test_put_prunes_after_a_quarter_of_max_bytes(tmp_path, monkeypatch):
+    cache = PreviewCache(str(tmp_path / "cache"), max_bytes=40)
+    prunes = []
+    monkeypatch.setattr(cache, "prune", lambda: prunes.append(1))
+    for i in range(4):
+        path = tmp_path / f"photo{i}.exr"
+        path.write_bytes(b"image data")
+        cache.put(str(path), Preview("photo.png", b"01234"))
+    # On the first put, then once 10 bytes were written since
+    assert len(prunes) == 2
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    """
+    Records which preview sources load_preview tries, nothing is found unless set.
+    """
+    calls = []
+    found = {}
+
+    def get_thumbnail(file_path, detail):
+        calls.append("thumbnail")
+        return found.get("thumbnail")
+
+    def extract(file_path):
+        calls.append("embedded")
+        return found.get("embedded")
+
+    def generate(file_path):
+        calls.append("rendered")
+        data = found.get("rendered")
+        return Preview("photo.png", data) if data else None
+
+    monkeypatch.setattr(phototag_preview, "aps", types.SimpleNamespace(get_thumbnail=get_thumbnail))
+    monkeypatch.setattr(phototag_preview, "has_embedded_preview_format", lambda file_path: True)
+    monkeypatch.setattr(phototag_preview, "extract_embedded_preview", extract)
+    monkeypatch.setattr(phototag_preview, "generate_preview", generate)
+    return calls, found
+
+
+def test_load_preview_prefers_thumbnail(tmp_path, photo, cache, sources):
+    calls, found = sources
+    thumbnail = tmp_path / "photo_dt.png"
+    thumbnail.write_bytes(b"thumbnail")
+    found["thumbnail"] = str(thumbnail)
+    preview = load_preview(photo, cache)
+    assert (bytes(preview.data), preview.source) == (b"thumbnail", "thumbnail")
+    assert calls == ["thumbnail"]
+
+
+def test_load_preview_uses_embedded_preview(photo, cache, sources):
+    calls, found = sources
+    found["embedded"] = b"jpeg"
+    preview = load_preview(photo, cache)
+    assert (preview.name, preview.content_type, preview.source) == ("photo.jpg", "image/jpeg", "embedded")
+    # Not cached, it is cheap to extract again
+    assert cache.get(photo) is None
+
+
+def test_load_preview_caches_rendered_preview(photo, cache, sources):
+    calls, found = sources
+    found["rendered"] = b"rendered"
+    assert load_preview(photo, cache).source == "rendered"
+    calls.clear()
+    preview = load_preview(photo, cache)
+    assert (bytes(preview.data), preview.source) == (b"rendered", "cache")
+    assert calls == ["thumbnail"]
+
+
+def test_load_preview_without_render(photo, cache, sources):
+    calls, found = sources
+    found["rendered"] = b"rendered"
+    assert load_preview(photo, cache, render=False) is None
+    assert "rendered" not in calls
+
+
+class Backend:
+    def __init__(self):
+        self.recycled = 0
+
+    def recycle(self):
+        self.recycled += 1
+
+
+def test_mesh_render_timeout_recycles_backend(photo, monkeypatch):
+    monkeypatch.setattr(phototag_preview, "get_render_timeout", lambda size: 0.01)
+    backend = Backend()
+    running = concurrent.futures.Future()
+    running.set_running_or_notify_cancel()
+    assert finish_mesh_preview(photo, running, backend=backend) is None
+    assert backend.recycled == 1
+    # A render that didn't start yet is cancelled instead
+    assert finish_mesh_preview(photo, concurrent.futures.Future(), backend=backend) is None
+    assert backend.recycled == 1
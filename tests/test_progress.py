@@ -0,0 +1,106 @@
+import io
+import json
+import pytest
+from phototag_progress import ProgressReporter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Progress:
+    def __init__(self):
+        self.values = []
+        self.texts = []
+
+    def report_progress(self, value):
+        self.values.append(value)
+
+    def set_text(self, text):
+        self.texts.append(text)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_updates_are_throttled(clock):
+    progress = Progress()
+    reporter = ProgressReporter(10, progress, min_interval=0.25, clock=clock)
+    reporter.update()
+    reporter.file_done()
+    clock.now += 0.1
+    reporter.file_done()
+    assert progress.values == [0.0]
+    clock.now += 0.2
+    reporter.file_done()
+    assert progress.values == [0.0, 0.3]
+    # Forced updates ignore the interval
+    reporter.finish()
+    assert progress.values == [0.0, 0.3, 0.3]
+    assert progress.texts[-1].startswith("Finished: 3/10")
+
+
+def test_counters_in_message(clock):
+    progress = Progress()
+    reporter = ProgressReporter(4, progress, clock=clock)
+    reporter.set_stage("Uploading")
+    reporter.add_cache_hit()
+    reporter.add_skip()
+    reporter.add_skip()
+    reporter.add_error()
+    # Changing the stage doesn't send an update
+    assert not progress.texts
+    reporter.update(force=True)
+    assert progress.texts == ["Uploading: 0/4 | 0.0 files/s | ETA - | 1 cached, 2 skipped, 1 errors"]
+
+
+def test_rate_and_eta_follow_the_window(clock):
+    reporter = ProgressReporter(100, window=30, clock=clock)
+    assert reporter.get_eta() is None
+    clock.now += 10
+    reporter.file_done(20)
+    assert reporter.get_rate() == 2
+    assert reporter.get_eta() == 40
+    # Slower for the next 40 seconds, the first samples drop out of the window
+    for _ in range(4):
+        clock.now += 10
+        reporter.file_done(5)
+    assert reporter.get_rate() == pytest.approx(15 / 30)
+    assert reporter.get_eta() == pytest.approx(60 / 0.5)
+
+
+def test_json_lines(clock):
+    stream = io.StringIO()
+    reporter = ProgressReporter(2, stream=stream, clock=clock)
+    clock.now += 4
+    reporter.file_done()
+    reporter.add_error()
+    reporter.finish("Canceled")
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(lines) == 2
+    assert lines[-1] == {
+        "stage": "Canceled",
+        "done": 1,
+        "total": 2,
+        "files_per_second": 0.25,
+        "eta_seconds": 4.0,
+        "cache_hits": 0,
+        "skipped": 0,
+        "errors": 1,
+        "elapsed_seconds": 4.0,
+    }
+
+
+def test_empty_run(clock):
+    progress = Progress()
+    reporter = ProgressReporter(0, progress, clock=clock)
+    reporter.finish()
+    # No progress fraction without files
+    assert progress.values == []
+    assert progress.texts == ["Finished: 0/0 | 0.0 files/s | ETA - | 0 cached, 0 skipped, 0 errors"]
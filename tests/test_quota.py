@@ -0,0 +1,152 @@
+import multiprocessing
+import time
+import types
+import pytest
+import phototag_quota
+from phototag_quota import MemberQuota, SharedUsage, get_user_key, parse_member_quotas
+
+
+class FakeSharedUsage:
+    """
+    Workspace shared usage held in memory, exchanged like SharedUsage.
+    """
+
+    def __init__(self):
+        self.machines = {}
+
+    def exchange(self, user, machine, day, used):
+        self.machines[machine] = used
+        return sum(count for name, count in self.machines.items() if name != machine)
+
+
+def test_parse_member_quotas():
+    quotas = parse_member_quotas("Anna@Studio.com = 120, 5000;\nben@studio.com = 30; bad = x, 1; invalid")
+    assert quotas == {"anna@studio.com": (120, 5000), "ben@studio.com": (30, 0)}
+
+
+def test_unlimited(tmp_path):
+    quota = MemberQuota("anna@studio.com", state_dir=str(tmp_path))
+    assert quota.unlimited
+    assert all(quota.reserve() == 0 for _ in range(1000))
+
+
+def test_rate_limit(tmp_path):
+    quota = MemberQuota("anna@studio.com", requests_per_minute=60, state_dir=str(tmp_path))
+    # The bucket holds BURST_SECONDS worth of requests
+    assert [quota.reserve() for _ in range(10)] == [0] * 10
+    wait = quota.reserve()
+    assert 0 < wait <= 1
+
+
+def test_daily_budget_and_refund(tmp_path):
+    quota = MemberQuota("anna@studio.com", daily_budget=3, state_dir=str(tmp_path))
+    assert [quota.reserve() for _ in range(3)] == [0, 0, 0]
+    assert quota.reserve() is None
+    assert not quota.acquire()
+    quota.refund()
+    assert quota.acquire()
+    # Another process of the same user on this machine shares the state
+    assert MemberQuota("Anna@Studio.com", daily_budget=3, state_dir=str(tmp_path)).reserve() is None
+
+
+def test_budget_is_shared_by_machines(tmp_path, monkeypatch):
+    monkeypatch.setattr(phototag_quota, "SHARED_SYNC_INTERVAL", 0)
+    shared = FakeSharedUsage()
+    laptop = MemberQuota("anna@studio.com", daily_budget=5, state_dir=str(tmp_path / "laptop"), shared=shared, machine="laptop")
+    desktop = MemberQuota("anna@studio.com", daily_budget=5, state_dir=str(tmp_path / "desktop"), shared=shared, machine="desktop")
+    assert [laptop.reserve() for _ in range(3)] == [0, 0, 0]
+    assert [desktop.reserve() for _ in range(3)] == [0, 0, None]
+    laptop.sync(force=True)
+    assert laptop.reserve() is None
+    assert shared.machines == {"laptop": 3, "desktop": 2}
+
+
+@pytest.fixture
+def shared_settings(monkeypatch):
+    """
+    Workspace shared settings held in memory. Like SharedSettings, only the keys that
+    were set are written on store.
+    """
+    values = {}
+
+    class SharedSettings:
+        def __init__(self, workspace_id, name):
+            self.values = dict(values)
+            self.changed = {}
+
+        def get(self, key, default=None):
+            return self.values.get(key, default)
+
+        def set(self, key, value):
+            self.values[key] = value
+            self.changed[key] = value
+
+        def store(self):
+            values.update(self.changed)
+
+    monkeypatch.setattr(phototag_quota, "aps", types.SimpleNamespace(SharedSettings=SharedSettings))
+    return values
+
+
+def test_shared_usage_keeps_one_key_per_machine(shared_settings):
+    usage = SharedUsage("workspace")
+    assert usage.exchange("anna@studio.com", "laptop", "2026-10-19", 3) == 0
+    assert usage.exchange("anna@studio.com", "desktop", "2026-10-19", 2) == 3
+    assert usage.exchange("anna@studio.com", "laptop", "2026-10-19", 4) == 2
+    user_key = get_user_key("anna@studio.com")
+    assert shared_settings[f"{user_key}:machines"] == ["laptop", "desktop"]
+    assert f"{user_key}:laptop" in shared_settings and f"{user_key}:desktop" in shared_settings
+    # Counts of other days and users are not added
+    assert usage.exchange("anna@studio.com", "desktop", "2026-10-20", 1) == 0
+    assert usage.exchange("ben@studio.com", "laptop", "2026-10-20", 1) == 0
+
+
+def test_shared_usage_machine_lost_from_list_adds_itself_again(shared_settings):
+    usage = SharedUsage("workspace")
+    user_key = get_user_key("anna@studio.com")
+    usage.exchange("anna@studio.com", "laptop", "2026-10-19", 3)
+    # Another machine stored the list at the same time without the laptop
+    shared_settings[f"{user_key}:machines"] = ["desktop"]
+    assert usage.exchange("anna@studio.com", "desktop", "2026-10-19", 2) == 0
+    usage.exchange("anna@studio.com", "laptop", "2026-10-19", 3)
+    assert usage.exchange("anna@studio.com", "desktop", "2026-10-19", 2) == 3
+
+
+def test_failed_sync_keeps_local_budget(tmp_path, monkeypatch):
+    class OfflineUsage:
+        def exchange(self, *args):
+            raise ConnectionError("offline")
+
+    monkeypatch.setattr(phototag_quota, "SHARED_SYNC_INTERVAL", 0)
+    quota = MemberQuota("anna@studio.com", daily_budget=2, state_dir=str(tmp_path), shared=OfflineUsage())
+    assert [quota.reserve() for _ in range(3)] == [0, 0, None]
+
+
+def reserve_all(state_dir, results):
+    quota = MemberQuota("anna@studio.com", requests_per_minute=600, daily_budget=40, state_dir=state_dir)
+    granted = 0
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        wait = quota.reserve()
+        if wait is None:
+            break
+        if wait == 0:
+            granted += 1
+        else:
+            time.sleep(wait)
+    results.put(granted)
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="Needs the test modules in the workers"
+)
+def test_budget_is_shared_by_processes(tmp_path):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=reserve_all, args=(str(tmp_path), results)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    granted = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join()
+    assert sum(granted) == 40
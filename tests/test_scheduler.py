@@ -0,0 +1,55 @@
+import os
+from phototag_paths import PathTable
+from phototag_planner import collect_files
+from phototag_scheduler import DEFAULT_FILE_ORDER, FILE_ORDERS, schedule_files
+
+
+def make_files():
+    files = PathTable()
+    files.add_file("b", "old.jpg", mtime=100)
+    files.add_file("a", "new.jpg", mtime=300)
+    files.add_file("b", "selected.jpg", explicit=True, mtime=200)
+    files.add_file("a", "unknown.jpg")
+    return files
+
+
+def names(files):
+    return [files.get_name(position) for position in range(len(files))]
+
+
+def test_default_order_is_selection_order():
+    files = make_files()
+    assert FILE_ORDERS[DEFAULT_FILE_ORDER] == []
+    assert names(schedule_files(files, FILE_ORDERS[DEFAULT_FILE_ORDER])) == names(files)
+
+
+def test_newest_first():
+    files = schedule_files(make_files(), FILE_ORDERS["Newest first"])
+    assert names(files) == ["selected.jpg", "new.jpg", "old.jpg", "unknown.jpg"]
+
+
+def test_grouped_by_folder():
+    files = schedule_files(make_files(), FILE_ORDERS["Grouped by folder"])
+    assert names(files) == ["selected.jpg", "old.jpg", "new.jpg", "unknown.jpg"]
+    assert files.is_explicit(0)
+
+
+def test_collect_files_records_mtime(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"")
+    os.utime(path, (1000, 1000))
+    (tmp_path / "notes.txt").write_text("")
+    selection = collect_files([str(path)], [str(tmp_path)], stat_files=True)
+    assert len(selection) == 1
+    assert selection.unsupported == 1
+    assert selection.overlapping == 1
+    assert selection.files.get_mtime(0) == 1000
+    assert selection.files.is_explicit(0)
+
+
+def test_grouping_keeps_first_seen_folder_order():
+    files = PathTable()
+    for directory, name in [("b", "1.jpg"), ("a", "2.jpg"), ("b", "3.jpg"), ("c", "4.jpg"), ("a", "5.jpg")]:
+        files.add_file(directory, name)
+    grouped = schedule_files(files, ["group_by_directory"])
+    assert names(grouped) == ["1.jpg", "3.jpg", "2.jpg", "5.jpg", "4.jpg"]
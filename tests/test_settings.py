@@ -0,0 +1,179 @@
+import itertools
+import json
+import types
+import pytest
+import phototag_settings
+from phototag_settings import (
+    SNAPSHOT_FIELDS,
+    PhototagSettings,
+    build_payload,
+    cache_settings_snapshot,
+    get_settings_snapshot,
+    invalidate_settings_snapshot,
+)
+
+TEXT_FIELDS = {
+    "maxDescriptionCharacters",
+    "minDescriptionCharacters",
+    "maxTitleCharacters",
+    "minTitleCharacters",
+    "beCreative",
+    "titleCaseTitle",
+}
+
+
+def make_settings(**values):
+    settings = dict.fromkeys(SNAPSHOT_FIELDS)
+    settings.update(
+        max_keywords=20,
+        required_keywords="beach",
+        use_file_name_for_context=True,
+        single_word_keywords_only=False,
+        max_title_chars=60,
+        be_creative=False,
+        title_case_title=True,
+        enable_ai_title=True,
+        enable_ai_description=True,
+        enable_ai_tags=True,
+    )
+    settings.update(values)
+    return types.SimpleNamespace(**settings)
+
+
+@pytest.mark.parametrize(
+    "title, description, tags", [flags for flags in itertools.product([True, False], repeat=3) if any(flags)]
+)
+def test_payload_for_enabled_attributes(title, description, tags):
+    payload = build_payload(make_settings(enable_ai_title=title, enable_ai_description=description, enable_ai_tags=tags))
+    wants_text = title or description
+    assert payload["keywordsOnly"] is not wants_text
+    assert payload["saveFile"] is False
+    assert payload["maxKeywords"] == 20
+    assert payload["requiredKeywords"] == "beach"
+    # Title and description limits are only sent when text is requested
+    assert bool(TEXT_FIELDS & set(payload)) is wants_text
+    if wants_text:
+        assert payload["maxTitleCharacters"] == 60
+        assert payload["titleCaseTitle"] is True
+
+
+def test_keywords_only_payload():
+    payload = build_payload(make_settings(enable_ai_title=False, enable_ai_description=False))
+    assert payload == {
+        "keywordsOnly": True,
+        "saveFile": False,
+        "maxKeywords": 20,
+        "requiredKeywords": "beach",
+        "useFileNameForContext": True,
+        "singleWordKeywordsOnly": False,
+    }
+
+
+def test_no_payload_without_enabled_attributes():
+    settings = make_settings(enable_ai_title=False, enable_ai_description=False, enable_ai_tags=False)
+    assert build_payload(settings) is None
+
+
+def test_unset_values_are_left_out():
+    payload = build_payload(make_settings())
+    assert None not in payload.values()
+    assert "minKeywords" not in payload and "customContext" not in payload
+    # False is a value, not an unset one
+    assert payload["beCreative"] is False
+
+
+@pytest.fixture
+def shared_settings(monkeypatch):
+    """
+    Workspace shared settings held in memory. Yields the stored values per settings name,
+    the names SharedSettings were opened with and the clock of the snapshot cache, which
+    only moves when the test advances it.
+    """
+    stored = {}
+    reads = []
+
+    class SharedSettings:
+        def __init__(self, workspace_id, name):
+            reads.append(name)
+            self.values = stored.setdefault(name, {})
+
+        def get(self, key, default=None):
+            return self.values.get(key, default)
+
+        def set(self, key, value):
+            self.values[key] = value
+
+        def store(self):
+            pass
+
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(phototag_settings, "aps", types.SimpleNamespace(SharedSettings=SharedSettings))
+    monkeypatch.setattr(
+        phototag_settings, "ap", types.SimpleNamespace(get_context=lambda: types.SimpleNamespace(workspace_id="ws"))
+    )
+    monkeypatch.setattr(phototag_settings, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    invalidate_settings_snapshot()
+    yield types.SimpleNamespace(stored=stored, reads=reads, clock=clock)
+    invalidate_settings_snapshot()
+
+
+def test_snapshot_is_cached_until_it_expires(shared_settings):
+    snapshot = get_settings_snapshot("default", "key", max_age=60)
+    shared_settings.clock.now += 30
+    assert get_settings_snapshot("default", "key", max_age=60) is snapshot
+    assert len(shared_settings.reads) == 1
+    shared_settings.clock.now += 31
+    assert get_settings_snapshot("default", "key", max_age=60) is not snapshot
+    assert len(shared_settings.reads) == 2
+
+
+def test_snapshot_is_reloaded_for_another_api_key(shared_settings):
+    snapshot = get_settings_snapshot("default", "key")
+    other = get_settings_snapshot("default", "other key")
+    assert other is not snapshot and other.api_key == "other key"
+
+
+def test_storing_settings_invalidates_snapshot(shared_settings):
+    snapshot = get_settings_snapshot("default")
+    settings = PhototagSettings("default")
+    settings.max_keywords = 5
+    settings.store()
+    changed = get_settings_snapshot("default")
+    assert changed is not snapshot
+    assert changed.payload["maxKeywords"] == 5
+    assert changed.fingerprint != snapshot.fingerprint
+
+
+def test_cached_snapshot_of_stored_settings(shared_settings):
+    settings = PhototagSettings("default")
+    settings.max_keywords = 7
+    settings.store()
+    reads = len(shared_settings.reads)
+    snapshot = cache_settings_snapshot(settings)
+    assert get_settings_snapshot("default") is snapshot
+    assert len(shared_settings.reads) == reads
+
+
+def test_invalidate_single_and_all_presets(shared_settings):
+    default = get_settings_snapshot("default")
+    stock = get_settings_snapshot("stock")
+    invalidate_settings_snapshot("default")
+    assert get_settings_snapshot("stock") is stock
+    assert get_settings_snapshot("default") is not default
+    invalidate_settings_snapshot()
+    assert get_settings_snapshot("stock") is not stock
+
+
+def test_snapshot_is_immutable(shared_settings):
+    snapshot = get_settings_snapshot("default")
+    with pytest.raises(AttributeError):
+        snapshot.max_keywords = 10
+    with pytest.raises(AttributeError):
+        del snapshot.payload
+    with pytest.raises(TypeError):
+        snapshot.payload["maxKeywords"] = 10
+    # Copies are mutable and can be serialized
+    payload = dict(snapshot.payload)
+    payload["maxKeywords"] = 10
+    assert json.loads(json.dumps(payload))["maxKeywords"] == 10
+    assert snapshot.payload["maxKeywords"] != 10
@@ -0,0 +1,80 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+import pytest
+from phototag_preview import Preview
+from phototag_spool import Spool
+
+SETTINGS = SimpleNamespace(name="default", fingerprint="settings")
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(str(tmp_path / "spool"), max_attempts=3)
+
+
+def enqueue(spool, file_path="photo.jpg", data=b"preview"):
+    return spool.enqueue(
+        file_path,
+        Preview("photo.jpg", data, "image/jpeg"),
+        SETTINGS,
+        {"maxKeywords": 10},
+        {"keywords": "AI-Keywords"},
+        covered={"title"},
+        fingerprint="s:1",
+        export=False,
+    )
+
+
+def test_jobs_are_loaded_in_order(spool):
+    jobs = [enqueue(spool, f"{index}.jpg") for index in range(5)]
+    assert spool.get_job_ids() == [job.id for job in jobs]
+    assert len(spool) == 5
+
+    job = spool.load(jobs[0].id)
+    assert job.file_path == "0.jpg"
+    assert job.preset == "default"
+    assert job.payload == {"maxKeywords": 10}
+    assert job.covered == {"title"}
+    assert job.export is False
+    preview = spool.load_preview(job)
+    assert bytes(preview.data) == b"preview"
+    assert preview.content_type == "image/jpeg"
+
+
+def test_complete_and_fail(spool):
+    first, second = enqueue(spool), enqueue(spool)
+    spool.complete(first)
+    spool.fail(second, "Invalid image")
+    assert len(spool) == 0
+    with open(os.path.join(spool.failed_dir, second.id + ".json")) as f:
+        assert json.load(f)["error"] == "Invalid image"
+    assert not os.path.exists(os.path.join(spool.spool_dir, second.id + ".bin"))
+
+
+def test_retry_gives_up_after_max_attempts(spool):
+    job = enqueue(spool)
+    assert spool.retry_later(job, "offline")
+    assert spool.load(job.id).attempts == 1
+    assert spool.retry_later(job, "offline")
+    assert not spool.retry_later(job, "offline")
+    assert spool.get_job_ids() == []
+    assert os.listdir(spool.failed_dir) == [job.id + ".json"]
+
+
+def test_retry_gives_up_old_jobs(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), max_age=60)
+    job = enqueue(spool)
+    job.created = time.time() - 120
+    assert not spool.retry_later(job, "offline")
+    assert len(spool) == 0
+
+
+def test_unreadable_jobs(spool):
+    job = enqueue(spool)
+    os.remove(os.path.join(spool.spool_dir, job.id + ".bin"))
+    assert spool.load_preview(spool.load(job.id)) is None
+    with open(os.path.join(spool.spool_dir, job.id + ".json"), "w") as f:
+        f.write("{")
+    assert spool.load(job.id) is None
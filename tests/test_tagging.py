@@ -0,0 +1,147 @@
+import concurrent.futures
+import types
+import pytest
+import phototag_ai
+import phototag_async_api
+import phototag_fingerprint
+from phototag_compute import COMPUTE_THREADS
+from phototag_preview import Preview, PreviewCache
+from phototag_settings import EXPORT_NONE, METADATA_IGNORE
+
+
+class Progress:
+    canceled = False
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Database:
+    def __init__(self):
+        self.values = {}
+        self.attributes = self
+
+    def set_attribute_value(self, file_path, name, value):
+        self.values[(file_path, name)] = value
+
+
+class Client:
+    """
+    Answers every request right away with values derived from the preset name.
+    """
+
+    requests = []
+
+    def __init__(self, max_concurrency, quota=None):
+        self.max_concurrency = max_concurrency
+
+    def submit(self, file_name, data, settings, payload=None, content_type="image/jpeg"):
+        Client.requests.append((file_name, bytes(data), settings.name, payload))
+        future = concurrent.futures.Future()
+        future.set_result(
+            {"data": {"title": f"{settings.name} title", "keywords": [settings.name, file_name]}}
+        )
+        return future
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def tagging(monkeypatch, tmp_path):
+    """
+    Runs process_files outside of Anchorpoint. Returns the names of the files whose
+    preview was loaded.
+    """
+    loaded = []
+
+    def load_preview(file_path, cache=None, render=True):
+        loaded.append(file_path)
+        return Preview("photo.png", b"preview of " + file_path.encode("utf-8"))
+
+    monkeypatch.setattr(
+        phototag_ai,
+        "ap",
+        types.SimpleNamespace(
+            Progress=Progress,
+            UI=lambda: types.SimpleNamespace(
+                show_info=lambda *args: None, show_error=lambda *args: None, show_success=lambda *args: None
+            ),
+        ),
+    )
+    monkeypatch.setattr(phototag_ai, "aps", types.SimpleNamespace(AttributeTagList=list, AttributeTag=str))
+    monkeypatch.setattr(
+        phototag_ai,
+        "get_local_settings",
+        lambda: types.SimpleNamespace(
+            spool_uploads=False, compute_backend=COMPUTE_THREADS, update_throughput=lambda *args: None
+        ),
+    )
+    monkeypatch.setattr(phototag_ai, "get_settings_list", lambda: types.SimpleNamespace(max_concurrent_uploads=2))
+    monkeypatch.setattr(phototag_ai, "get_member_quota", lambda: types.SimpleNamespace(unlimited=True))
+    monkeypatch.setattr(phototag_ai, "Spool", lambda: None)
+    monkeypatch.setattr(phototag_ai, "PreviewCache", lambda index: PreviewCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(phototag_ai, "load_preview", load_preview)
+    monkeypatch.setattr(phototag_ai.credits_service, "has_credits", lambda count=1: True)
+    monkeypatch.setattr(phototag_ai.credits_service, "debit", lambda count=1: None)
+    monkeypatch.setattr(phototag_fingerprint, "get_fingerprint_index", lambda: None)
+    monkeypatch.setattr(phototag_async_api, "AsyncPhototagClient", Client)
+    Client.requests = []
+    return loaded
+
+
+def make_preset(name, payload, enable_ai_tags=True):
+    return types.SimpleNamespace(
+        name=name,
+        payload=payload,
+        normalize_keywords=False,
+        export_results=EXPORT_NONE,
+        embedded_metadata=METADATA_IGNORE,
+        skip_tagged_files=False,
+        enable_ai_title=True,
+        enable_ai_description=False,
+        enable_ai_tags=enable_ai_tags,
+        fingerprint=name,
+    )
+
+
+def test_presets_share_one_preview_load(tagging):
+    presets = [
+        make_preset("Stock", {"maxKeywords": 40}),
+        make_preset("Social", {"maxKeywords": 5, "keywordsOnly": True}),
+    ]
+    database = Database()
+    assert phototag_ai.process_files(["a.jpg", "b.jpg"], database, presets, notify=False)
+
+    assert tagging == ["a.jpg", "b.jpg"]
+    # Each preset is sent the same preview with its own payload
+    assert sorted(Client.requests) == sorted(
+        (name, b"preview of " + file_path.encode("utf-8"), preset.name, preset.payload)
+        for file_path, name in [("a.jpg", "photo.png"), ("b.jpg", "photo.png")]
+        for preset in presets
+    )
+    assert database.values[("a.jpg", "AI-Title (Stock)")] == "Stock title"
+    assert database.values[("a.jpg", "AI-Title (Social)")] == "Social title"
+    assert database.values[("b.jpg", "AI-Keywords (Social)")] == ["Social", "photo.png"]
+    assert len(database.values) == 2 * 2 * 2
+
+
+def test_single_preset_uses_plain_attribute_names(tagging):
+    database = Database()
+    phototag_ai.process_files(["a.jpg"], database, [make_preset("Stock", {})], notify=False)
+    assert set(database.values) == {("a.jpg", "AI-Title"), ("a.jpg", "AI-Keywords")}
+
+
+def test_presets_without_payload_are_dropped(tagging):
+    presets = [make_preset("Stock", {}), make_preset("Disabled", None)]
+    database = Database()
+    phototag_ai.process_files(["a.jpg"], database, presets, notify=False)
+    assert [request[2] for request in Client.requests] == ["Stock"]
+    # The names still tell the presets of the run apart
+    assert ("a.jpg", "AI-Title (Stock)") in database.values
@@ -0,0 +1,66 @@
+import pytest
+from phototag_vocabulary import KeywordNormalizer, parse_synonyms, singularize
+
+
+@pytest.mark.parametrize(
+    "plural, singular",
+    [
+        ("cars", "car"),
+        ("boxes", "box"),
+        ("dishes", "dish"),
+        ("churches", "church"),
+        ("beaches", "beach"),
+        ("classes", "class"),
+        ("buzzes", "buzz"),
+        ("cities", "city"),
+        ("children", "child"),
+        ("mazes", "maze"),
+        ("sizes", "size"),
+        ("prizes", "prize"),
+        ("breezes", "breeze"),
+        ("quizzes", "quiz"),
+        ("caches", "cache"),
+        ("headaches", "headache"),
+        ("niches", "niche"),
+        ("buses", "bus"),
+        ("viruses", "virus"),
+        ("houses", "house"),
+        ("causes", "cause"),
+        ("movies", "movie"),
+    ],
+)
+def test_singularize(plural, singular):
+    assert singularize(plural) == singular
+
+
+@pytest.mark.parametrize("word", ["bus", "glass", "news", "species", "virus", "crisis", "tree", "3ds"])
+def test_singularize_keeps_singulars(word):
+    assert singularize(word) == word
+
+
+def test_parse_synonyms():
+    synonyms = parse_synonyms("Car = automobile, Auto;  dog = puppy ; invalid")
+    assert synonyms == {"automobile": "car", "auto": "car", "puppy": "dog"}
+
+
+def test_normalize_keywords():
+    normalizer = KeywordNormalizer(
+        required_keywords="Studio",
+        excluded_keywords="people",
+        prohibited_characters="#",
+        synonyms="car = automobile",
+    )
+    keywords = normalizer.normalize_keywords(["#Cars", "Automobiles", "  red   Apples ", "Person", "studio"])
+    assert keywords == ["studio", "car", "red apple"]
+
+
+def test_normalize_keywords_uses_vocabulary_spelling():
+    normalizer = KeywordNormalizer(vocabulary=["Car", "New York"])
+    assert normalizer.normalize_keywords(["cars", "new  york", "Bikes"]) == ["Car", "New York", "bike"]
+    assert normalizer.new_keywords_count == 1
+
+
+def test_normalize_keywords_limits():
+    normalizer = KeywordNormalizer(max_keywords=3, max_new_keywords=2, vocabulary=["tree"])
+    assert normalizer.normalize_keywords(["a1", "trees", "b2", "c3"]) == ["a1", "tree", "b2"]
+    assert normalizer.normalize_keywords(["d4", "a1"]) == ["a1"]
@@ -0,0 +1,58 @@
+import os
+import time
+from phototag_watch import DebouncedBatcher, PollingWatcher
+
+
+def touch(path, mtime=None):
+    with open(path, "wb") as f:
+        f.write(b"data")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_polling_watcher_backs_off_while_idle(tmp_path):
+    watcher = PollingWatcher(str(tmp_path), interval=0.01, max_interval=0.04)
+    intervals = []
+    for _ in range(4):
+        watcher.next_check = watcher.next_scan = 0
+        assert watcher.wait(0) == set()
+        intervals.append(watcher.scan_interval)
+    assert intervals == [0.02, 0.04, 0.04, 0.04]
+
+
+def test_polling_watcher_finds_new_files_through_folder_mtime(tmp_path):
+    subfolder = tmp_path / "shoot"
+    subfolder.mkdir()
+    watcher = PollingWatcher(str(tmp_path), interval=0.01, max_interval=60)
+    path = subfolder / "photo.jpg"
+    touch(path)
+    (subfolder / "notes.txt").write_text("")
+    os.utime(subfolder, ns=(0, 0))
+    watcher.next_check = 0
+    # The full scan isn't due, the changed folder triggers it
+    assert watcher.next_scan > time.monotonic()
+    assert watcher.wait(0) == {str(path)}
+    assert watcher.scan_interval == 0.01
+
+
+def test_polling_watcher_finds_modified_files_on_full_scan(tmp_path):
+    path = tmp_path / "photo.jpg"
+    touch(path, 1000)
+    watcher = PollingWatcher(str(tmp_path), interval=0.01, max_interval=60)
+    touch(path, 2000)
+    os.utime(tmp_path, ns=(watcher.directories[str(tmp_path)],) * 2)
+    watcher.next_check = 0
+    assert watcher.wait(0) == set()
+    watcher.next_check = watcher.next_scan = 0
+    assert watcher.wait(0) == {str(path)}
+
+
+def test_debounced_batcher(tmp_path):
+    paths = [str(tmp_path / f"{index}.jpg") for index in range(3)]
+    for path in paths:
+        touch(path)
+    batcher = DebouncedBatcher(settle_seconds=0, batch_size=2)
+    batcher.add(set(paths))
+    first = batcher.take_batch()
+    assert len(first) == 2
+    assert sorted(first + batcher.take_batch()) == sorted(paths)